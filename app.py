@@ -1,10 +1,24 @@
 import os
+import tempfile
 os.environ["HTTPX_HTTP2"] = "false"
 
 import streamlit as st
 import pandas as pd
 import altair as alt
-from datetime import datetime, timedelta, date, time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import functools
+import hashlib
+import hmac
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, date, time, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType
 from dateutil.relativedelta import relativedelta
 from streamlit_calendar import calendar
 from supabase import create_client, ClientOptions
@@ -13,22 +27,31 @@ from tenacity import retry, stop_after_attempt, wait_fixed
 # --- KONFIGURACJA STRONY ---
 st.set_page_config(page_title="Menedżer Korepetycji", layout="wide", page_icon="📚")
 
+DEFAULT_TENANT = "default"
+
 def check_password():
-    """Zwraca True jeśli użytkownik jest zalogowany."""
+    """Zwraca True jeśli użytkownik jest zalogowany; ustawia st.session_state["tenant"] (korepetytora).
+    Konta korepetytorów: sekcja [tenants] w sekretach ({login = {password = "..."}}).
+    Bez niej działa jedno hasło z [general] i wspólny tenant "default"."""
     if "password_correct" not in st.session_state:
         st.session_state["password_correct"] = False
 
     if st.session_state["password_correct"]:
+        st.session_state.setdefault("tenant", DEFAULT_TENANT)
         return True
 
     # Formularz logowania
     st.markdown("## 🔒 Zaloguj się")
+    tenants = st.secrets.get("tenants", {})
+    login = st.text_input("Login") if tenants else DEFAULT_TENANT
     password = st.text_input("Hasło", type="password")
     
     if st.button("Zaloguj"):
         # Sprawdzamy hasło z sekretów
-        if password == st.secrets["general"]["password"]:
+        expected = tenants[login]["password"] if login in tenants else (None if tenants else st.secrets["general"]["password"])
+        if expected is not None and password == expected:
             st.session_state["password_correct"] = True
+            st.session_state["tenant"] = login
             st.rerun()
         else:
             st.error("Nieprawidłowe hasło")
@@ -39,6 +62,22 @@ def check_password():
 if not check_password():
     st.stop()
 
+# Wszystkie odczyty, zapisy i cache są zawężone do danych zalogowanego korepetytora
+TENANT = st.session_state["tenant"]
+
+# Wątki tła (zadania okresowe) działają w imieniu kolejnych korepetytorów - funkcje logiki biorą tenanta
+# z current_tenant(), a nie bezpośrednio z TENANT sesji.
+_acting = threading.local()
+
+def current_tenant():
+    return getattr(_acting, 'tenant', None) or TENANT
+
+@contextmanager
+def acting_as(tenant_id):
+    previous, _acting.tenant = getattr(_acting, 'tenant', None), tenant_id
+    try: yield
+    finally: _acting.tenant = previous
+
 # --- POŁĄCZENIE Z SUPABASE Z ZABEZPIECZENIAMI ---
 @st.cache_resource
 def get_supabase_client():
@@ -64,133 +103,412 @@ COLUMNS = [
 COLUMNS_SETTLEMENTS = ['Uczen_ID', 'Okres', 'Kwota_Wymagana', 'Wplacono']
 COLUMNS_CANCELLATIONS = ['Uczen_ID', 'Data', 'Powod']
 COLUMNS_EXTRA = ['Uczen_ID', 'Data', 'Godzina', 'Stawka', 'Typ', 'Czas', 'Status']
-COLUMNS_SCHEDULE = ['Uczen_ID', 'Dzien_tyg', 'Godzina', 'Czas_trwania', 'Data_od', 'Data_do', 'Stawka']
+# Okres harmonogramu = reguła powtarzania: co Interwal tygodni w Dzien_tyg od Data_od do Data_do,
+# najwyżej Liczba lekcji (0 = bez limitu), z pominięciem dat z Wyjatki ('RRRR-MM-DD;...')
+COLUMNS_SCHEDULE = ['Uczen_ID', 'Dzien_tyg', 'Godzina', 'Czas_trwania', 'Data_od', 'Data_do', 'Stawka', 'Interwal', 'Liczba', 'Wyjatki']
+COLUMNS_HOLIDAYS = ['Data_od', 'Data_do', 'Nazwa', 'Szkola', 'Uczniowie']
+# Snapshot zamkniętego miesiąca: kwota, pozycje rachunku, wiersze rejestru i plan ucznia zamrożone przy zamknięciu
+COLUMNS_SNAPSHOTS = ['Miesiac', 'Uczen_ID', 'Tryb_platnosci', 'Kwota', 'Wplacono', 'Oplacone', 'Pozycje', 'Rejestr',
+                     'Plan', 'Plan_abonament', 'Plan_dojazd']
+# Dziennik zdarzeń liczników (tylko dopisywanie): zmiana każdego licznika wywołana zdarzeniem
+COLUMNS_COUNTER_EVENTS = ['id', 'Uczen_ID', 'Rodzaj', 'Nieobecnosci', 'Odrabiania', 'Do_odrobienia_umowione', 'Do_odrobienia_nieumowione']
 
 # Stałe
 DNI_MAPA = {"Poniedziałek": 0, "Wtorek": 1, "Środa": 2, "Czwartek": 3, "Piątek": 4, "Sobota": 5, "Niedziela": 6}
+TYPY_DODATKOWE = ['Dodatkowa', 'Odrabianie', 'Przełożona', 'Edytowana']
+STATUSY = ['Zaplanowana', 'Zrealizowana']
+TRYBY_PLATNOSCI = ['Co zajęcia', 'Miesięcznie']
+POWODY_ODWOLANIA = ['Wina Ucznia', 'Wina Korepetytora', 'Święto / Inne (Bez liczników)', 'Edycja (Zmiana stawki)']
 MIESIACE_PL = {1: 'Styczeń', 2: 'Luty', 3: 'Marzec', 4: 'Kwiecień', 5: 'Maj', 6: 'Czerwiec',
                7: 'Lipiec', 8: 'Sierpień', 9: 'Wrzesień', 10: 'Październik', 11: 'Listopad', 12: 'Grudzień'}
 
+# --- SCHEMAT TABEL (NORMALIZACJA TYPÓW PRZY WCZYTANIU) ---
+# required: wiersz bez poprawnej wartości nie trafia do obliczeń (trafia do raportu błędów)
+# numbers: kolumna liczbowa -> wartość domyślna dla pustych/błędnych pól
+# categories: kolumna słownikowa -> (znane wartości, wartość domyślna); nieznane wartości są dopisywane jako kategorie
+SCHEMA = {
+    'uczniowie': {'columns': COLUMNS, 'required': ['ID', 'Data_rozp', 'Data_zak'], 'ids': ['ID'],
+                  'dates': ['Data_rozp', 'Data_zak'], 'times': [],
+                  'numbers': {'Stawka': 0.0, 'Dojazd': 0.0, 'Nieobecnosci': 0.0, 'Odrabiania': 0.0,
+                              'Do_odrobienia_umowione': 0.0, 'Do_odrobienia_nieumowione': 0.0},
+                  'categories': {'Tryb_platnosci': (TRYBY_PLATNOSCI, 'Co zajęcia')}},
+    'rozliczenia': {'columns': COLUMNS_SETTLEMENTS, 'required': ['Uczen_ID', 'Okres'], 'ids': ['Uczen_ID'],
+                    'dates': [], 'times': [], 'numbers': {'Kwota_Wymagana': 0.0, 'Wplacono': 0.0}, 'categories': {}},
+    'odwolane': {'columns': COLUMNS_CANCELLATIONS, 'required': ['Uczen_ID', 'Data'], 'ids': ['Uczen_ID'],
+                 'dates': ['Data'], 'times': [], 'numbers': {},
+                 'categories': {'Powod': (POWODY_ODWOLANIA, 'Wina Korepetytora')}},
+    'dodatkowe': {'columns': COLUMNS_EXTRA, 'required': ['Uczen_ID', 'Data', 'Godzina', 'Stawka'], 'ids': ['Uczen_ID'],
+                  'dates': ['Data'], 'times': ['Godzina'], 'numbers': {'Stawka': 0.0, 'Czas': 1.0},
+                  'categories': {'Typ': (TYPY_DODATKOWE, 'Dodatkowa'), 'Status': (STATUSY, 'Zaplanowana')}},
+    'harmonogram': {'columns': COLUMNS_SCHEDULE, 'required': ['Uczen_ID', 'Dzien_tyg', 'Godzina', 'Czas_trwania', 'Data_od', 'Data_do'],
+                    'ids': ['Uczen_ID'], 'dates': ['Data_od', 'Data_do'], 'times': ['Godzina'],
+                    'numbers': {'Czas_trwania': 1.0, 'Stawka': 0.0, 'Interwal': 1.0, 'Liczba': 0.0},
+                    'categories': {'Dzien_tyg': (list(DNI_MAPA.keys()), None)}},
+    'dni_wolne': {'columns': COLUMNS_HOLIDAYS, 'required': ['Data_od', 'Data_do'], 'ids': [],
+                  'dates': ['Data_od', 'Data_do'], 'times': [], 'numbers': {}, 'categories': {}},
+    'zamkniete_miesiace': {'columns': COLUMNS_SNAPSHOTS, 'required': ['Miesiac', 'Uczen_ID'], 'ids': ['Uczen_ID'],
+                           'dates': [], 'times': [],
+                           'numbers': {'Kwota': 0.0, 'Wplacono': 0.0, 'Plan': 0.0, 'Plan_abonament': 0.0, 'Plan_dojazd': 0.0},
+                           'categories': {'Tryb_platnosci': (TRYBY_PLATNOSCI, 'Co zajęcia')}},
+    'zdarzenia_licznikow': {'columns': COLUMNS_COUNTER_EVENTS, 'required': ['id', 'Uczen_ID'], 'ids': ['id', 'Uczen_ID'],
+                            'dates': [], 'times': [],
+                            'numbers': {'Nieobecnosci': 0.0, 'Odrabiania': 0.0, 'Do_odrobienia_umowione': 0.0, 'Do_odrobienia_nieumowione': 0.0},
+                            'categories': {}},
+}
+# Kolumny wyliczane przy wczytaniu - nie są zapisywane do bazy
+DERIVED_COLUMNS = ['Minuty', 'Dzien_nr', 'Czy_swieto', 'Czy_edycja', 'Czy_wina_ucznia']
+
+def time_to_minutes(values):
+    """Zamienia 'HH:MM[:SS]' na minuty od północy (NaN dla błędnych wartości)."""
+    parts = pd.Series(values, dtype=object).astype(str).str.extract(r'^\s*(\d{1,2}):(\d{2})')
+    minutes = pd.to_numeric(parts[0], errors='coerce') * 60 + pd.to_numeric(parts[1], errors='coerce')
+    return minutes.where((minutes >= 0) & (minutes < 24 * 60))
+
+def minutes_to_time_str(minutes):
+    """Minuty od północy -> napisy 'HH:MM'."""
+    m = pd.Series(minutes).astype(int)
+    return (m // 60).astype(str).str.zfill(2) + ':' + (m % 60).astype(str).str.zfill(2)
+
+def parse_dates(values):
+    """Tekst/daty -> datetime64 (północ), błędne wartości jako NaT."""
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), errors='coerce', format='ISO8601')
+    if getattr(parsed.dt, 'tz', None) is not None: parsed = parsed.dt.tz_localize(None)
+    return parsed.dt.normalize()
+
+def category_flag(col, pattern):
+    """Flaga logiczna dla kolumny kategorycznej - regex liczony raz na kategorię, nie na wiersz."""
+    hits = np.append(np.asarray(col.cat.categories.astype(str).str.contains(pattern), dtype=bool), False)
+    return pd.Series(hits[col.cat.codes.to_numpy()], index=col.index)
+
+def normalize_table(df, table):
+    """Jednorazowa normalizacja typów po wczytaniu: daty -> datetime64, godziny -> minuty, liczby -> float.
+    Wiersze z błędnymi polami wymaganymi są pomijane, a wszystkie problemy trafiają do df.attrs['schema_issues']."""
+    spec = SCHEMA[table]
+    # Ramki są już zawężone do jednego korepetytora - kolumnę tenanta ustawia baza przy zapisie
+    df = df.drop(columns=['Tenant_ID'], errors='ignore').reset_index(drop=True)
+    for c in spec['columns']:
+        if c not in df.columns: df[c] = None
+    invalid = pd.Series(False, index=df.index)
+    issues = []
+    row_ids = df['id'] if 'id' in df.columns else (df['ID'] if 'ID' in df.columns else df.index.to_series())
+
+    def report(mask, col, problem):
+        for i in df.index[mask]:
+            issues.append({'Tabela': table, 'Wiersz': str(row_ids[i]), 'Kolumna': col, 'Wartość': str(df.at[i, col]), 'Problem': problem})
+
+    def check(col, parsed, problem):
+        nonlocal invalid
+        bad = parsed.isna()
+        if col in spec['required']: invalid |= bad
+        else: bad &= df[col].notna()
+        report(bad, col, problem)
+
+    for c in spec['ids']:
+        parsed = pd.to_numeric(df[c], errors='coerce')
+        check(c, parsed.where(parsed % 1 == 0), "Niepoprawny identyfikator")
+        df[c] = parsed
+    for c in spec['dates']:
+        parsed = parse_dates(df[c])
+        check(c, parsed, "Niepoprawna data")
+        df[c] = parsed
+    for c in spec['times']:
+        minutes = time_to_minutes(df[c])
+        check(c, minutes, "Niepoprawna godzina")
+        df['Minuty'] = minutes
+        df[c] = minutes_to_time_str(minutes.fillna(0)).where(minutes.notna()) + ':00'
+    for c, default in spec['numbers'].items():
+        parsed = pd.to_numeric(df[c], errors='coerce')
+        check(c, parsed, "Niepoprawna liczba")
+        df[c] = parsed.fillna(default).astype('float64')
+    for c, (known, default) in spec['categories'].items():
+        values = df[c].astype(object).where(df[c].notna(), default)
+        extra = sorted(set(values.dropna().astype(str)) - set(known))
+        df[c] = pd.Categorical(values, categories=known + extra)
+    if 'Dzien_tyg' in spec['required']:
+        weekday = df['Dzien_tyg'].astype(object).map(DNI_MAPA)
+        check('Dzien_tyg', weekday, "Nieznany dzień tygodnia")
+        df['Dzien_nr'] = weekday
+    if table == 'odwolane':
+        # Flagi liczone raz na kategoriach powodu, a nie regexem przy każdym filtrowaniu
+        df['Czy_swieto'] = category_flag(df['Powod'], 'Święto')
+        df['Czy_edycja'] = category_flag(df['Powod'], 'Edycja')
+        df['Czy_wina_ucznia'] = df['Powod'] == 'Wina Ucznia'
+
+    clean = df[~invalid].copy()
+    for c in spec['ids']: clean[c] = clean[c].astype('int64')
+    if 'Minuty' in clean.columns: clean['Minuty'] = clean['Minuty'].astype('int16')
+    if 'Dzien_nr' in clean.columns: clean['Dzien_nr'] = clean['Dzien_nr'].astype('int8')
+    clean.attrs['schema_issues'] = issues
+    return clean.reset_index(drop=True)
+
+def schema_issues(*frames):
+    """Zbiorczy raport błędnych wierszy z wczytanych tabel."""
+    rows = [i for f in frames for i in f.attrs.get('schema_issues', [])]
+    return pd.DataFrame(rows, columns=['Tabela', 'Wiersz', 'Kolumna', 'Wartość', 'Problem'])
+
 # --- FUNKCJE ŁADOWANIA DANYCH (Z RETRY I CACHE) ---
 
 # Dekorator @retry sprawia, że jeśli baza rozłączy (Server disconnected), 
 # aplikacja spróbuje jeszcze 5 razy co 2 sekundy, zamiast wyrzucać błąd.
 @retry(stop=stop_after_attempt(5), wait=wait_fixed(2))
-def fetch_table(table_name):
-    return supabase.table(table_name).select("*").execute()
+def fetch_table(table_name, tenant_id):
+    return supabase.table(table_name).select("*").eq("Tenant_ID", tenant_id).execute()
+
+def clear_cache(tenant_id, tables=None):
+    """Po zapisie danych: nowa wersja snapshotu (tylko zmienione tabele) i czyszczenie wyliczeń - tylko dla danego korepetytora"""
+    publish_tables(tenant_id, SNAPSHOT_TABLES if tables is None else tables)
+    for cached in (calendar_events, lesson_index, roster_index):
+        cached.clear(tenant_id)
+    # payment_rows i scenario_baseline mają wersję danych w kluczu - nie trzeba ich czyścić
+    # Widoki są już zgodne z nową wersją - odświeżanie w tle nie musi ich przeliczać
+    tenant_activity()['refreshed'][tenant_id] = data_version(tenant_id, 'wszystko')
 
-def clear_cache():
-    """Czyści pamięć podręczną po zapisie danych, żeby widzieć zmiany od razu"""
-    st.cache_data.clear()
+def json_value(v):
+    """Pojedyncza wartość -> typ akceptowany przez JSON/PostgREST (NaN -> None, daty jako tekst)."""
+    if isinstance(v, (list, dict)): return v
+    if pd.isna(v): return None
+    if isinstance(v, pd.Timestamp): return v.strftime('%Y-%m-%d')
+    if isinstance(v, (date, time)): return v.isoformat()
+    if isinstance(v, np.generic): v = v.item()
+    # Liczby całkowite wysyłamy jako int, żeby pasowały także do kolumn typu integer
+    if isinstance(v, float) and v.is_integer(): return int(v)
+    return v
 
-def clean_df_for_supabase(df):
-    """Zamienia wartości NaN na None, aby uniknąć błędu JSON w Supabase."""
-    return df.where(pd.notnull(df), None)
+def df_to_records(df):
+    """Przygotowuje ramkę do zapisu: bez kolumn wyliczanych, wartości zgodne z JSON."""
+    out = df.drop(columns=[c for c in DERIVED_COLUMNS if c in df.columns])
+    return [{c: json_value(v) for c, v in row.items()} for row in out.to_dict(orient='records')]
 # ------------------------
 
-@st.cache_data(ttl=60)
-def load_data():
-    try:
-        res = fetch_table("uczniowie")
-        df = pd.DataFrame(res.data)
-        if df.empty: return pd.DataFrame(columns=COLUMNS)
-        
-        # Konwersja typów liczbowych
-        cols_num = ['Stawka', 'Dojazd', 'Odrabiania', 'Nieobecnosci', 'Do_odrobienia_umowione', 'Do_odrobienia_nieumowione']
-        for c in cols_num:
-            if c in df.columns:
-                df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0.0)
-        return df
-    except Exception as e:
-        # Zwracamy pustą tabelę w razie awarii, żeby aplikacja "wstała"
-        return pd.DataFrame(columns=COLUMNS)
+# --- WSPÓLNY SNAPSHOT DANYCH ---
+# st.cache_data przy każdym odczycie rozpakowuje (pickle) świeżą kopię ramki, więc każda sesja przy każdym przebiegu
+# kopiowała wszystkie tabele. Snapshot to wersja tabel korepetytora wspólna dla sesji w procesie (st.cache_resource).
+# Loadery zwracają płytką kopię ramki (df.copy(deep=False)): dane nie są kopiowane, a dzięki Copy-on-Write (pandas 3)
+# zapis w kopii - także nowa kolumna czy inplace - kopiuje tylko zmienianą kolumnę i nie dociera do wspólnej ramki.
+# Dane snapshotu zmienia wyłącznie publish_tables - po zapisie w bazie wczytuje zmienione tabele i publikuje nową
+# wersję; niezmienione ramki przechodzą do niej bez kopiowania.
+SNAPSHOT_TABLES = ('uczniowie', 'rozliczenia', 'odwolane', 'dodatkowe', 'harmonogram', 'dni_wolne', 'zamkniete_miesiace')
+SNAPSHOT_TTL = timedelta(seconds=60)  # zmiany z zewnątrz (inny proces) widoczne najpóźniej po minucie
 
-def save_data(df):
-    # ZMIANA TUTAJ: Czyszczenie danych przed zapisem
-    df_clean = clean_df_for_supabase(df)
-    data = df_clean.to_dict(orient='records')
-    supabase.table("uczniowie").upsert(data).execute()
-    clear_cache()
+def fetch_normalized(table, tenant_id):
+    res = fetch_table(table, tenant_id)
+    return normalize_table(pd.DataFrame(res.data) if res.data else pd.DataFrame(columns=SCHEMA[table]['columns']), table)
 
-@st.cache_data(ttl=60)
-def load_settlements():
-    try:
-        res = fetch_table("rozliczenia")
-        return pd.DataFrame(res.data) if res.data else pd.DataFrame(columns=COLUMNS_SETTLEMENTS)
-    except: return pd.DataFrame(columns=COLUMNS_SETTLEMENTS)
+def table_hash(df):
+    df = df.astype({c: str for c in df.columns[df.dtypes == object]})
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
 
-def save_settlements(df):
-    # ZMIANA TUTAJ
-    df_clean = clean_df_for_supabase(df)
-    supabase.table("rozliczenia").upsert(df_clean.to_dict(orient='records')).execute()
-    clear_cache()
+class DataSnapshot:
+    """Wersja tabel korepetytora: tabela -> ramka (dostępna tylko przez płytką kopię), skróty treści tabel, numer wersji."""
 
-@st.cache_data(ttl=60)
-def load_cancellations():
-    try:
-        res = fetch_table("odwolane")
-        return pd.DataFrame(res.data) if res.data else pd.DataFrame(columns=COLUMNS_CANCELLATIONS)
-    except: return pd.DataFrame(columns=COLUMNS_CANCELLATIONS)
+    def __init__(self, tenant_id, tables, hashes, version):
+        self.tenant_id, self.version = tenant_id, version
+        self._tables, self.hashes = MappingProxyType(tables), MappingProxyType(hashes)
 
-def save_cancellations(df):
-    # ZMIANA TUTAJ (To naprawia Twój konkretny błąd z logów)
-    df_clean = clean_df_for_supabase(df)
-    supabase.table("odwolane").upsert(df_clean.to_dict(orient='records')).execute()
-    clear_cache()
+    def __getitem__(self, table):
+        return self._tables[table].copy(deep=False)
 
-@st.cache_data(ttl=60)
-def load_extra():
-    try:
-        res = fetch_table("dodatkowe")
-        return pd.DataFrame(res.data) if res.data else pd.DataFrame(columns=COLUMNS_EXTRA)
-    except: return pd.DataFrame(columns=COLUMNS_EXTRA)
+    def replace(self, tables):
+        """Nowa wersja z podmienionymi tabelami; tabele o niezmienionej treści zostają (te same obiekty)."""
+        hashes = {t: table_hash(df) for t, df in tables.items()}
+        changed = [t for t in tables if self.hashes.get(t) != hashes[t]]
+        if not changed: return self
+        return DataSnapshot(self.tenant_id, {**self._tables, **{t: tables[t] for t in changed}},
+                            {**self.hashes, **{t: hashes[t] for t in changed}}, self.version + 1)
 
-def save_extra(df):
-    # ZMIANA TUTAJ
-    df_clean = clean_df_for_supabase(df)
-    supabase.table("dodatkowe").upsert(df_clean.to_dict(orient='records')).execute()
-    clear_cache()
+@st.cache_resource
+def snapshot_store(tenant_id):
+    return {'snapshot': DataSnapshot(tenant_id, {}, {}, 0), 'loaded_at': None, 'lock': threading.RLock()}
 
-@st.cache_data(ttl=60)
-def load_schedule():
-    try:
-        res = fetch_table("harmonogram")
-        return pd.DataFrame(res.data) if res.data else pd.DataFrame(columns=COLUMNS_SCHEDULE)
-    except: return pd.DataFrame(columns=COLUMNS_SCHEDULE)
+def publish_tables(tenant_id, tables=SNAPSHOT_TABLES):
+    """Jedyny zapis do snapshotu: wczytuje tabele z bazy i publikuje nową wersję (jeśli treść się zmieniła).
+    Sesje, które już trzymają poprzednią wersję, liczą na niej do końca przebiegu."""
+    store = snapshot_store(tenant_id)
+    with store['lock']:
+        current, fresh = store['snapshot'], {}
+        for table in tables:
+            try: fresh[table] = fetch_normalized(table, tenant_id)
+            except Exception:
+                # Awaria bazy: zostaje poprzednia wersja tabeli, a przy pierwszym wczytaniu - pusta tabela, żeby aplikacja "wstała"
+                if table not in current.hashes: fresh[table] = normalize_table(pd.DataFrame(columns=SCHEMA[table]['columns']), table)
+        store['snapshot'] = current.replace(fresh)
+        if set(tables) >= set(SNAPSHOT_TABLES): store['loaded_at'] = datetime.now()
+        return store['snapshot']
+
+def data_snapshot(tenant_id):
+    """Aktualna wersja danych korepetytora (wspólna dla sesji); po SNAPSHOT_TTL wczytywana od nowa."""
+    store = snapshot_store(tenant_id)
+    stale = lambda: store['loaded_at'] is None or datetime.now() - store['loaded_at'] > SNAPSHOT_TTL
+    if stale():
+        with store['lock']:
+            if stale(): publish_tables(tenant_id)
+    return store['snapshot']
+
+def load_data(tenant_id): return data_snapshot(tenant_id)['uczniowie']
+def load_settlements(tenant_id): return data_snapshot(tenant_id)['rozliczenia']
+def load_cancellations(tenant_id): return data_snapshot(tenant_id)['odwolane']
+def load_extra(tenant_id): return data_snapshot(tenant_id)['dodatkowe']
+def load_schedule(tenant_id): return data_snapshot(tenant_id)['harmonogram']
+def load_holidays(tenant_id): return data_snapshot(tenant_id)['dni_wolne']
+def load_snapshots(tenant_id): return data_snapshot(tenant_id)['zamkniete_miesiace']
+
+# --- ZAPYTANIA Z PROJEKCJĄ I FILTRAMI ---
+# Wywołujący deklaruje kolumny i filtry (kolumna, operator, wartość), a wiersze pochodzą ze wspólnego snapshotu
+# tabel korepetytora. Strona i tak wczytuje całe tabele (z nich liczona jest wersja danych), więc osobne zapytania
+# do bazy dla widoków jednego ucznia dokładałyby tylko żądań - filtr w pandas na tabeli z pamięci jest tańszy.
+TABLE_LOADERS = {'uczniowie': load_data, 'rozliczenia': load_settlements, 'odwolane': load_cancellations, 'dodatkowe': load_extra,
+                 'harmonogram': load_schedule, 'dni_wolne': load_holidays, 'zamkniete_miesiace': load_snapshots}
+
+def filter_mask(df, table, filters):
+    """Filtry zapytania jako maska wierszy df."""
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        values = df[col]
+        if col in SCHEMA[table]['dates']: value = tuple(map(pd.Timestamp, value)) if op == 'in' else pd.Timestamp(value)
+        if op == 'eq': mask &= values == value
+        elif op == 'gte': mask &= values >= value
+        elif op == 'lte': mask &= values <= value
+        else: mask &= values.isin(value)
+    return mask
+
+def select_rows(tenant_id, table, columns, filters):
+    """Wiersze tabeli korepetytora wg zapytania: filters = [(kolumna, 'eq' | 'gte' | 'lte' | 'in', wartość)].
+    Zwracane są tylko zadeklarowane kolumny (i wymagane przez schemat) - wywołujący nie może liczyć na inne."""
+    df = TABLE_LOADERS[table](tenant_id)
+    columns = set(SCHEMA[table]['required']) | set(columns) | set(DERIVED_COLUMNS)
+    return df.loc[filter_mask(df, table, filters), [c for c in df.columns if c in columns]]
+
+def student_tables(df_students, tenant_id):
+    """(odwołania, dodatkowe, harmonogram) do rozwinięcia lekcji. Dla jednego ucznia - tylko jego wiersze (bez filtra
+    dat, rachunki liczone są miesiąc po miesiącu), dla wielu uczniów - całe tabele ze snapshotu."""
+    ids = df_students['ID'].unique()
+    if len(ids) != 1:
+        return load_cancellations(tenant_id), load_extra(tenant_id), load_schedule(tenant_id)
+    student = [('Uczen_ID', 'eq', ids[0])]
+    return (select_rows(tenant_id, 'odwolane', COLUMNS_CANCELLATIONS, student),
+            select_rows(tenant_id, 'dodatkowe', COLUMNS_EXTRA, student),
+            select_rows(tenant_id, 'harmonogram', COLUMNS_SCHEDULE, student))
+
+# --- ZAPIS DANYCH (UNIT OF WORK) ---
+
+def next_ids(name, count=1):
+    """Rezerwuje count kolejnych ID z sekwencji korepetytora (funkcja next_ids, sql/04_tenanci.sql)."""
+    res = supabase.rpc("next_ids", {"p_tenant": current_tenant(), "p_name": name, "p_count": count}).execute()
+    return [int(r['next_ids']) if isinstance(r, dict) else int(r) for r in res.data]
+
+# Klucze używane przy upsert (on_conflict) i przy usuwaniu pojedynczych wierszy
+TABLE_KEYS = {'uczniowie': 'Tenant_ID,ID', 'rozliczenia': 'Tenant_ID,Uczen_ID,Okres', 'odwolane': 'id', 'dodatkowe': 'id', 'harmonogram': 'id', 'dni_wolne': 'id',
+              'zamkniete_miesiace': 'Tenant_ID,Miesiac,Uczen_ID'}
+COUNTER_COLUMNS = ['Nieobecnosci', 'Odrabiania', 'Do_odrobienia_umowione', 'Do_odrobienia_nieumowione']
+# Liczniki ucznia wynikają z dziennika zdarzeń (zdarzenia_licznikow, sql/07_zdarzenia_licznikow.sql): każda zmiana
+# to dopisany wiersz, a kolumny liczników w tabeli uczniowie to projekcja utrzymywana przez wyzwalacz w bazie
+# (licznik = max(0, licznik + zmiana)). Skutki rodzajów zdarzeń: {licznik: (za lekcję, za godzinę)}.
+COUNTER_EVENTS = {
+    'Nieobecność': {'Nieobecnosci': (1, 0), 'Odrabiania': (1, 0)},
+    'Do odrobienia': {'Do_odrobienia_nieumowione': (0, 1)},
+    'Umówione odrabianie': {'Do_odrobienia_umowione': (0, 1), 'Do_odrobienia_nieumowione': (0, -1)},
+    'Cofnięte odrabianie': {'Do_odrobienia_umowione': (0, -1), 'Do_odrobienia_nieumowione': (0, 1)},
+    'Zrealizowane odrabianie': {'Do_odrobienia_umowione': (0, -1)},
+}
+
+class UnitOfWork:
+    """Zbiera wszystkie zmiany jednej akcji użytkownika i wysyła je jednym wywołaniem apply_batch
+    (sql/03_apply_batch.sql) - jedna transakcja w bazie, jedno czyszczenie cache.
+
+        with UnitOfWork() as uow:
+            uow.insert("odwolane", nowe_odwolania)
+            uow.record("Nieobecność", {uczen_id: (1, czas)})
+    """
+    def __init__(self):
+        self.ops, self.sent = [], []
+        self.tenant_id = current_tenant()
+
+    def insert(self, table, df):
+        rows = df_to_records(df)
+        if rows: self.ops.append({'op': 'insert', 'table': table, 'rows': rows})
+        return self
+
+    def upsert(self, table, df):
+        rows = df_to_records(df)
+        if rows: self.ops.append({'op': 'upsert', 'table': table, 'rows': rows, 'on_conflict': TABLE_KEYS[table]})
+        return self
+
+    def delete(self, table, **match):
+        self.ops.append({'op': 'delete', 'table': table, 'match': {k: json_value(v) for k, v in match.items()}})
+        return self
+
+    def record(self, kind, lessons):
+        """Dopisuje zdarzenia liczników rodzaju kind (COUNTER_EVENTS) - jeden wiersz dziennika na ucznia.
+        lessons: {ID ucznia: (liczba lekcji, godziny)}."""
+        effects = COUNTER_EVENTS[kind]
+        rows = [{'Uczen_ID': int(sid), 'Rodzaj': kind, **{c: float(effects[c][0] * n + effects[c][1] * h) if c in effects else 0.0 for c in COUNTER_COLUMNS}}
+                for sid, (n, h) in lessons.items() if n or h]
+        return self.insert("zdarzenia_licznikow", pd.DataFrame(rows))
+
+    def flush(self):
+        """Wysyła zebrane dotąd operacje jednym wywołaniem apply_batch (osobna transakcja), bez czyszczenia cache -
+        to robi commit, raz na końcu. Duży zapis dzielony jest tak na transakcje po całych grupach wierszy."""
+        ops, self.ops = self.ops, []  # po błędzie operacje porcji przepadają - nic z niej nie zostało zapisane
+        if ops: supabase.rpc("apply_batch", {"p_tenant": self.tenant_id, "p_ops": ops}).execute()
+        self.sent += ops
+        return self
+
+    def commit(self):
+        """Wysyła pozostałe operacje i czyści cache dla wszystkiego, co wysłano - także gdy zapis przerwał błąd
+        (wcześniejsze porcje z flush są już w bazie)."""
+        ops = self.sent + self.ops
+        if not ops: return
+        touched = set().union(*(rollup_keys(op) for op in ops))
+        # Zdarzenia liczników zmieniają (wyzwalaczem w bazie) tabelę uczniowie
+        tables = {'uczniowie' if op.get('table') == 'zdarzenia_licznikow' else op.get('table') for op in ops} & set(SNAPSHOT_TABLES)
+        try: self.flush()
+        finally:
+            self.sent = []
+            clear_cache(self.tenant_id, tables)
+            invalidate_rollup(self.tenant_id, touched)
 
-def save_schedule(df):
-    # ZMIANA TUTAJ
-    df_clean = clean_df_for_supabase(df)
-    supabase.table("harmonogram").upsert(df_clean.to_dict(orient='records')).execute()
-    clear_cache()
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Przy wyjątku nic więcej nie wysyłamy - żadnych połowicznie zapisanych akcji (porcje z flush już są w bazie)
+        if exc_type is not None: self.ops = []
+        self.commit()
+        return False
 
 # --- LOGIKA POMOCNICZA ---
 
 def process_past_makeups(df_students, df_extra):
     """Automatycznie zalicza odrabiania, których data minęła."""
-    today = date.today()
-    changes = False
-    for idx, row in df_extra.iterrows():
-        if row.get('Typ') == 'Odrabianie':
-            try:
-                l_date = pd.to_datetime(row['Data']).date()
-                status = row.get('Status', 'Zaplanowana')
-                if l_date < today and status != 'Zrealizowana':
-                    s_idx = df_students.index[df_students['ID'] == row['Uczen_ID']].tolist()
-                    if s_idx:
-                        s_idx = s_idx[0]
-                        curr_val = df_students.at[s_idx, 'Do_odrobienia_umowione']
-                        duration = float(row.get('Czas', 1.0))
-                        if curr_val > 0:
-                            df_students.at[s_idx, 'Do_odrobienia_umowione'] = max(0.0, curr_val - duration)
-                        df_extra.at[idx, 'Status'] = 'Zrealizowana'
-                        changes = True
-            except Exception: pass
-    if changes:
-        save_data(df_students)
-        save_extra(df_extra)
-        return True
-    return False
+    due = (df_extra['Typ'] == 'Odrabianie') & (df_extra['Data'] < pd.Timestamp(date.today())) \
+        & (df_extra['Status'] != 'Zrealizowana') & df_extra['Uczen_ID'].isin(df_students['ID'])
+    if not due.any(): return False
+    done = df_extra[due].groupby('Uczen_ID')['Czas'].agg(['size', 'sum'])
+    with UnitOfWork() as uow:
+        uow.upsert("dodatkowe", df_extra[due].assign(Status='Zrealizowana'))
+        uow.record("Zrealizowane odrabianie", {sid: (r['size'], r['sum']) for sid, r in done.iterrows()})
+    return True
+
+def rebuild_counters(df_events, student_ids):
+    """Pełne odtworzenie liczników z dziennika zdarzeń (weryfikacja projekcji), wektorowo dla wszystkich uczniów.
+    Licznik obcinany do zera po każdym zdarzeniu to suma częściowa odbita od zera: x_n = S_n - min(0, min_k<=n S_k)."""
+    ev = df_events.sort_values('id', kind='stable')
+    sums = ev.groupby('Uczen_ID')[COUNTER_COLUMNS].cumsum()
+    floor = sums.groupby(ev['Uczen_ID']).cummin().clip(upper=0)
+    state = (sums - floor).groupby(ev['Uczen_ID']).last()
+    return state.reindex(pd.Index(student_ids, name='Uczen_ID'), fill_value=0.0)
+
+def verify_counters(tenant_id):
+    """Różnice między licznikami w tabeli uczniowie a odtworzonymi z dziennika (pusta ramka = zgodne).
+    Obie tabele czytane wprost z bazy, z pominięciem cache."""
+    df_students = normalize_table(pd.DataFrame(fetch_table("uczniowie", tenant_id).data, columns=COLUMNS), "uczniowie").drop_duplicates('ID').set_index('ID')
+    df_events = normalize_table(pd.DataFrame(fetch_table("zdarzenia_licznikow", tenant_id).data, columns=COLUMNS_COUNTER_EVENTS), "zdarzenia_licznikow")
+    expected = rebuild_counters(df_events, df_students.index)
+    actual = df_students[COUNTER_COLUMNS].rename_axis('Uczen_ID')
+    diff = ~np.isclose(actual.to_numpy(dtype='float64'), expected.to_numpy(dtype='float64'))
+    rows = [{'Uczeń': student_labels(df_students.reset_index()).get(sid, sid), 'Licznik': c, 'W tabeli': actual.at[sid, c], 'Z dziennika': expected.at[sid, c]}
+            for sid, c in zip(actual.index[diff.nonzero()[0]], np.array(COUNTER_COLUMNS)[diff.nonzero()[1]])]
+    return pd.DataFrame(rows, columns=['Uczeń', 'Licznik', 'W tabeli', 'Z dziennika'])
 
 def parse_student_terms(row):
     days = str(row['Dzien_tyg']).split(';')
@@ -208,164 +526,303 @@ def parse_student_terms(row):
         terms.append({'day_name': day, 'time_str': time_str, 'duration': dur_val})
     return terms
 
+def student_schedule_rows(row):
+    """Wiersze harmonogramu nowego ucznia wyprowadzone z jego terminów (Dzien_tyg/Godzina/H_w_tygodniu)."""
+    return [{'Uczen_ID': row['ID'], 'Dzien_tyg': t['day_name'], 'Godzina': t['time_str'], 'Czas_trwania': t['duration'],
+             'Data_od': str(row['Data_rozp']), 'Data_do': str(row['Data_zak']), 'Stawka': row['Stawka']}
+            for t in parse_student_terms(row)]
+
+# --- IMPORT UCZNIÓW Z CSV ---
+IMPORT_COLUMNS = ['Imie', 'Nazwisko', 'Dzien_tyg', 'Godzina', 'H_w_tygodniu', 'Data_rozp', 'Data_zak', 'Stawka', 'Dojazd',
+                  'Tryb_platnosci', 'Szkola', 'Klasa', 'Poziom', 'Nr_tel', 'Adres']
+IMPORT_REQUIRED = ['Imie', 'Nazwisko', 'Dzien_tyg', 'Godzina', 'Data_rozp', 'Data_zak']
+IMPORT_CHUNK_ROWS = 500
+
+def validate_import(raw):
+    """Sprawdza CSV z uczniami. Zwraca (poprawne wiersze gotowe do tabeli uczniowie, błędy per wiersz);
+    numer wiersza liczony jak w arkuszu (nagłówek = 1)."""
+    raw = raw.rename(columns=lambda c: str(c).strip()).reset_index(drop=True)
+    missing = [c for c in IMPORT_REQUIRED if c not in raw.columns]
+    if missing:
+        return pd.DataFrame(columns=COLUMNS), [{'Wiersz': 1, 'Kolumna': ', '.join(missing), 'Problem': "Brak kolumny"}]
+    df = raw.reindex(columns=IMPORT_COLUMNS).astype(object)
+    df = df.where(df.notna() & (df.astype(str).apply(lambda c: c.str.strip()) != ''), None)
+    errors = []
+    invalid = pd.Series(False, index=df.index)
+
+    def bad(mask, col, problem):
+        nonlocal invalid
+        invalid |= mask
+        errors.extend({'Wiersz': int(i) + 2, 'Kolumna': col, 'Problem': problem} for i in df.index[mask])
+
+    for c in IMPORT_REQUIRED: bad(df[c].isna(), c, "Brak wartości")
+    start, end = parse_dates(df['Data_rozp']), parse_dates(df['Data_zak'])
+    bad(start.isna() & df['Data_rozp'].notna(), 'Data_rozp', "Niepoprawna data")
+    bad(end.isna() & df['Data_zak'].notna(), 'Data_zak', "Niepoprawna data")
+    bad(end < start, 'Data_zak', "Koniec przed startem")
+    for c in ['Stawka', 'Dojazd']:
+        num = pd.to_numeric(df[c], errors='coerce')
+        bad((num.isna() & df[c].notna()) | (num < 0), c, "Niepoprawna kwota")
+        df[c] = num.fillna(0.0)
+    df['Tryb_platnosci'] = df['Tryb_platnosci'].fillna('Co zajęcia')
+    bad(~df['Tryb_platnosci'].isin(TRYBY_PLATNOSCI), 'Tryb_platnosci', "Nieznany tryb płatności")
+    df['H_w_tygodniu'] = df['H_w_tygodniu'].fillna('1')
+    for i, row in df[df['Dzien_tyg'].notna() & df['Godzina'].notna()].iterrows():
+        terms = parse_student_terms(row)
+        if not terms: bad(df.index == i, 'Dzien_tyg', "Brak terminów")
+        if any(t['day_name'] not in DNI_MAPA for t in terms): bad(df.index == i, 'Dzien_tyg', "Nieznany dzień tygodnia")
+        if time_to_minutes([t['time_str'] for t in terms]).isna().any(): bad(df.index == i, 'Godzina', "Niepoprawna godzina")
+        if any(t['duration'] <= 0 for t in terms): bad(df.index == i, 'H_w_tygodniu', "Niepoprawny czas zajęć")
+
+    valid = df[~invalid].copy()
+    valid['Data_rozp'] = start[~invalid].dt.strftime('%Y-%m-%d')
+    valid['Data_zak'] = end[~invalid].dt.strftime('%Y-%m-%d')
+    for c in COUNTER_COLUMNS: valid[c] = 0
+    return valid.reset_index(drop=True), errors
+
+def import_students(valid):
+    """Zapisuje zweryfikowanych uczniów: ID rezerwowane jednym wywołaniem, porcje po IMPORT_CHUNK_ROWS uczniów -
+    każda porcja (uczniowie razem z ich harmonogramem) to jedna transakcja, więc żaden uczeń nie zostaje bez planu.
+    Zwraca (liczba zapisanych uczniów, błąd albo None); po błędzie kolejne porcje nie są wysyłane."""
+    if valid.empty: return 0, None
+    valid = valid.assign(ID=next_ids("uczniowie", len(valid)))
+    with UnitOfWork() as uow:
+        for i in range(0, len(valid), IMPORT_CHUNK_ROWS):
+            part = valid.iloc[i:i + IMPORT_CHUNK_ROWS]
+            schedule = [r for _, row in part.iterrows() for r in student_schedule_rows(row)]
+            uow.insert("uczniowie", part)
+            if schedule: uow.insert("harmonogram", pd.DataFrame(schedule))
+            try: uow.flush()
+            except Exception as e: return i, str(e)
+    return len(valid), None
+
+# --- PAMIĘĆ WYLICZEŃ (LRU) ---
+# Wyniki rachunków, planu lekcji i sum raportów pamiętane pod kluczem (funkcja, tenant, uczniowie, argumenty,
+# wersja danych). Zamiast hashować całą ramkę (jak st.cache_data) bierzemy skrót kolumny ID - resztę danych
+# opisuje wersja danych. Pamięć jest ograniczona liczbą wpisów i budżetem bajtów, najdawniej używane wypadają.
+MEMO_CONFIG = st.secrets.get("cache", {})
+MEMO_MAX_ENTRIES = int(MEMO_CONFIG.get("max_entries", 2000))
+MEMO_MAX_BYTES = int(MEMO_CONFIG.get("max_mb", 64)) * 1024 * 1024
+
+def result_size(value):
+    """Przybliżony rozmiar wyniku w bajtach (ramki i tablice dokładnie, reszta przez sys.getsizeof)."""
+    if isinstance(value, pd.DataFrame): return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)): return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray): return value.nbytes
+    if isinstance(value, dict): return sys.getsizeof(value) + sum(result_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)): return sys.getsizeof(value) + sum(result_size(v) for v in value)
+    return sys.getsizeof(value)
+
+class LruMemo:
+    """Pamięć LRU z limitem wpisów i bajtów oraz statystykami trafień (wspólna dla sesji, z blokadą)."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self.entries = OrderedDict()  # klucz -> (wynik, rozmiar)
+        self.bytes = self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        # Liczymy poza blokadą - równoległe sesje nie czekają na siebie (najwyżej policzą to samo dwa razy)
+        value = compute()
+        size = result_size(value)
+        with self.lock:
+            if key in self.entries: self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+        return value
+
+    def purge(self, keep):
+        """Usuwa wpisy, których klucz nie spełnia keep(klucz); zwraca liczbę usuniętych."""
+        with self.lock:
+            stale = [k for k in self.entries if not keep(k)]
+            for k in stale: self.bytes -= self.entries.pop(k)[1]
+            return len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            calls = self.hits + self.misses
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': self.hits / calls if calls else 0.0}
+
+@st.cache_resource
+def billing_memo():
+    return LruMemo(MEMO_MAX_ENTRIES, MEMO_MAX_BYTES)
+
+def memoized(fn):
+    """Dekorator dla fn(df_students, *args): wynik z billing_memo() dla bieżącej wersji danych korepetytora.
+    Wynik jest współdzielony - wywołujący nie mogą go modyfikować w miejscu."""
+    @functools.wraps(fn)
+    def wrapper(df_students, *args):
+        students = hashlib.sha1(df_students['ID'].to_numpy(dtype='int64').tobytes()).hexdigest()
+        tenant_id = current_tenant()
+        key = (fn.__name__, tenant_id, students, args, data_version(tenant_id, 'wszystko'))
+        return billing_memo().get_or_compute(key, lambda: fn(df_students, *args))
+    return wrapper
+
 # --- GŁÓWNA LOGIKA KALENDARZA I FINANSÓW ---
 
-def get_lessons_in_period(df_students, start_date, end_date):
-    lessons = []
-    df_cancel = load_cancellations()
-    df_extra = load_extra()
-    df_schedule = load_schedule()
-    
-    cancelled_set = set()
-    if not df_cancel.empty:
-        for _, row in df_cancel.iterrows():
-            cancelled_set.add((row['Uczen_ID'], str(row['Data'])))
+# Lekcje trzymamy kolumnowo: jeden wiersz = jedna lekcja, dane ucznia tylko przez Uczen_ID.
+LESSON_TYPES = pd.CategoricalDtype(['Stała', 'Dodatkowa', 'Odrabianie', 'Przełożona', 'Edytowana'])
+LESSON_COLUMNS = ['Data', 'Uczen_ID', 'Minuty', 'Czas', 'Stawka', 'Typ']
 
-    student_map = df_students.set_index('ID').to_dict('index')
-    
-    current_day = start_date
-    while current_day <= end_date:
-        weekday_num = current_day.weekday()
-        current_day_str = str(current_day)
-        
-        for _, sch_row in df_schedule.iterrows():
-            if DNI_MAPA.get(sch_row['Dzien_tyg']) == weekday_num:
-                try:
-                    s_valid_start = pd.to_datetime(sch_row['Data_od']).date()
-                    s_valid_end = pd.to_datetime(sch_row['Data_do']).date()
-                    
-                    if s_valid_start <= current_day <= s_valid_end:
-                        uid = sch_row['Uczen_ID']
-                        if uid in student_map: 
-                            if (uid, current_day_str) not in cancelled_set:
-                                s_info = student_map[uid]
-                                dur = float(sch_row['Czas_trwania'])
-                                sch_rate = float(sch_row.get('Stawka', 0))
-                                hourly_rate = sch_rate if sch_rate > 0 else s_info['Stawka']
-                                full_rate = (hourly_rate * dur) + s_info.get('Dojazd', 0)
-                                
-                                lessons.append({
-                                    'Data': current_day, 'Uczen_ID': uid, 'Stawka': full_rate, 
-                                    'Godzina': sch_row['Godzina'], 
-                                    'Imie': s_info['Imie'], 'Nazwisko': s_info['Nazwisko'],
-                                    'Typ': 'Stała', 'Czas': dur
-                                })
-                except: pass
-        current_day += timedelta(days=1)
+def empty_lessons():
+    return pd.DataFrame({
+        'Data': pd.Series(dtype='datetime64[ns]'), 'Uczen_ID': pd.Series(dtype='int64'),
+        'Minuty': pd.Series(dtype='int16'), 'Czas': pd.Series(dtype='float32'),
+        'Stawka': pd.Series(dtype='float64'), 'Typ': pd.Series(dtype=LESSON_TYPES)
+    })
 
-    if not df_extra.empty:
-        for _, row in df_extra.iterrows():
-            try:
-                l_date = pd.to_datetime(row['Data']).date()
-                if start_date <= l_date <= end_date:
-                    uid = row['Uczen_ID']
-                    if uid in student_map:
-                        s_info = student_map[uid]
-                        duration = float(row.get('Czas', 1.0))
-                        lessons.append({
-                            'Data': l_date, 'Uczen_ID': uid, 'Stawka': row['Stawka'],
-                            'Godzina': row['Godzina'], 
-                            'Imie': s_info['Imie'], 'Nazwisko': s_info['Nazwisko'],
-                            'Typ': row.get('Typ', 'Dodatkowa'), 'Czas': duration
-                        })
-            except: pass
-            
-    return lessons
+def lesson_keys(uids, dates):
+    """Klucz (uczeń, dzień) jako int64 - do szybkich porównań przez np.isin."""
+    days = np.asarray(dates, dtype='datetime64[D]').astype('int64')
+    return np.asarray(uids, dtype='int64') * 1_000_000 + days
+
+def expand_schedule(df_students, df_schedule, start_date, end_date):
+    """Rozwija okresy harmonogramu na konkretne lekcje w [start_date, end_date] bez pętli po dniach.
+    Reguła okresu jak rrule(WEEKLY, interval=Interwal, count=Liczba, until=Data_do) od pierwszego Dzien_tyg
+    >= Data_od, minus daty z Wyjatki - numery wystąpień w oknie liczone wprost, bez iterowania po regule."""
+    if df_schedule.empty or df_students.empty: return empty_lessons()
+    sch = df_schedule[df_schedule['Uczen_ID'].isin(df_students['ID'])]
+    if sch.empty: return empty_lessons()
+
+    weekday = sch['Dzien_nr'].astype('int64')
+    step = 7 * sch['Interwal'].clip(lower=1).round().astype('int64').to_numpy()
+    limit = sch['Liczba'].clip(lower=0).round().astype('int64').to_numpy()
+    first = sch['Data_od'] + pd.to_timedelta((weekday - sch['Data_od'].dt.weekday) % 7, unit='D')
+    # Wystąpienie k = first + k * step; w oknie są k od k_lo (pierwsze >= start_date) do k_hi (ostatnie <= końca okresu)
+    k_lo = np.maximum(-((first - pd.Timestamp(start_date)).dt.days.to_numpy() // step), 0)
+    k_hi = (sch['Data_do'].clip(upper=pd.Timestamp(end_date)) - first).dt.days.to_numpy() // step
+    k_hi = np.where(limit > 0, np.minimum(k_hi, limit - 1), k_hi)
+    counts = np.maximum(k_hi - k_lo + 1, 0)
+    total = int(counts.sum())
+    if total == 0: return empty_lessons()
+
+    rows = np.repeat(np.arange(len(sch)), counts)
+    occurrence = k_lo[rows] + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    dates = first.to_numpy()[rows] + (occurrence * step[rows]).astype('timedelta64[D]')
+    skipped = sch['Wyjatki'].where(sch['Wyjatki'].notna() & (sch['Wyjatki'].astype(str).str.strip() != '')).dropna()
+    if not skipped.empty:
+        skipped = parse_dates(skipped.astype(str).str.split(';').explode().str.strip()).dropna()
+        keep = ~np.isin(lesson_keys(rows, dates), lesson_keys(sch.index.get_indexer(skipped.index), skipped.to_numpy()))
+        rows, dates, total = rows[keep], dates[keep], int(keep.sum())
+        if total == 0: return empty_lessons()
+
+    students = df_students.drop_duplicates('ID').set_index('ID')
+    uids = sch['Uczen_ID'].to_numpy()[rows]
+    sch_rate = sch['Stawka'].to_numpy()[rows]
+    durations = sch['Czas_trwania'].to_numpy()[rows]
+    hourly = np.where(sch_rate > 0, sch_rate, students['Stawka'].reindex(uids).to_numpy())
+
+    return pd.DataFrame({
+        'Data': dates, 'Uczen_ID': uids,
+        'Minuty': sch['Minuty'].to_numpy()[rows], 'Czas': durations.astype('float32'),
+        'Stawka': hourly * durations + students['Dojazd'].reindex(uids).to_numpy(),
+        'Typ': pd.Categorical(['Stała'] * total, dtype=LESSON_TYPES)
+    })
+
+def extra_lessons(df_students, df_extra, start_date, end_date):
+    """Lekcje dodatkowe/odrabiania z tabeli 'dodatkowe' w zadanym okresie (format kolumnowy)."""
+    if df_extra.empty or df_students.empty: return empty_lessons()
+    ex = df_extra[(df_extra['Data'] >= pd.Timestamp(start_date)) & (df_extra['Data'] <= pd.Timestamp(end_date))
+                  & df_extra['Uczen_ID'].isin(df_students['ID'])]
+    if ex.empty: return empty_lessons()
+    return pd.DataFrame({
+        'Data': ex['Data'].to_numpy(), 'Uczen_ID': ex['Uczen_ID'].to_numpy(),
+        'Minuty': ex['Minuty'].to_numpy(), 'Czas': ex['Czas'].to_numpy(dtype='float32'),
+        'Stawka': ex['Stawka'].to_numpy(),
+        'Typ': pd.Categorical(ex['Typ'].fillna('Dodatkowa'), dtype=LESSON_TYPES)
+    })
+
+def drop_cancelled(lessons, df_cancel):
+    """Usuwa lekcje, dla których istnieje wpis w tabeli odwołań."""
+    if lessons.empty or df_cancel.empty: return lessons
+    cancelled = lesson_keys(df_cancel['Uczen_ID'], df_cancel['Data'])
+    return lessons[~np.isin(lesson_keys(lessons['Uczen_ID'], lessons['Data']), cancelled)]
+
+def sort_lessons(lessons):
+    return lessons.sort_values(['Data', 'Minuty'], kind='stable').reset_index(drop=True)
+
+def drop_holidays(lessons, df_students, df_holidays):
+    """Usuwa lekcje wypadające w dni wolne (jedna maska przedziałów: lekcje x przedziały).
+    Przedział dotyczy wszystkich, jednej szkoły (Szkola) albo listy uczniów (Uczniowie: '1;2;3')."""
+    if lessons.empty or df_holidays.empty: return lessons
+    days = lessons['Data'].to_numpy(dtype='datetime64[D]')[:, None]
+    in_range = (days >= df_holidays['Data_od'].to_numpy(dtype='datetime64[D]')) & (days <= df_holidays['Data_do'].to_numpy(dtype='datetime64[D]'))
+    if not in_range.any(): return lessons
+
+    school = df_holidays['Szkola'].where(df_holidays['Szkola'].notna() & (df_holidays['Szkola'].astype(str).str.strip() != ''))
+    listed = df_holidays['Uczniowie'].where(df_holidays['Uczniowie'].notna() & (df_holidays['Uczniowie'].astype(str).str.strip() != ''))
+    applies = np.broadcast_to((school.isna() & listed.isna()).to_numpy(), in_range.shape).copy()
+    if school.notna().any():
+        student_school = lessons['Uczen_ID'].map(df_students.drop_duplicates('ID').set_index('ID')['Szkola']).astype(object).to_numpy()
+        applies |= student_school[:, None] == school.astype(object).to_numpy()[None, :]
+    if listed.notna().any():
+        pairs = listed.dropna().astype(str).str.split(';').explode().str.strip()
+        pairs = pd.to_numeric(pairs, errors='coerce').dropna()
+        hol_pos = df_holidays.index.get_indexer(pairs.index)
+        listed_keys = pairs.to_numpy(dtype='int64') * len(df_holidays) + hol_pos
+        lesson_keys_h = lessons['Uczen_ID'].to_numpy(dtype='int64')[:, None] * len(df_holidays) + np.arange(len(df_holidays))[None, :]
+        applies |= np.isin(lesson_keys_h, listed_keys)
+    return lessons[~(in_range & applies).any(axis=1)]
+
+def get_lessons_in_period(df_students, start_date, end_date, tenant_id=None):
+    """Faktyczne lekcje w okresie: plan bez odwołanych + dodatkowe (ramka kolumnowa).
+    tenant_id podajemy poza sesją użytkownika (np. w serwerze ICS), domyślnie zalogowany korepetytor."""
+    tenant_id = tenant_id or current_tenant()
+    df_cancel, df_extra, df_schedule = student_tables(df_students, tenant_id)
+    fixed = drop_cancelled(expand_schedule(df_students, df_schedule, start_date, end_date), df_cancel)
+    fixed = drop_holidays(fixed, df_students, load_holidays(tenant_id))
+    extra = extra_lessons(df_students, df_extra, start_date, end_date)
+    return sort_lessons(pd.concat([fixed, extra], ignore_index=True))
 
+@memoized
 def get_predicted_lessons(df_students, start_date, end_date):
-    lessons = []
-    df_cancel = load_cancellations()
-    df_schedule = load_schedule()
-    
-    excluded_set = set()
+    """Plan lekcji w okresie - pomija tylko święta i edycje (odwołania uczniów nadal liczone)."""
+    df_cancel, _, df_schedule = student_tables(df_students, current_tenant())
     if not df_cancel.empty:
-        ex_recs = df_cancel[df_cancel['Powod'].astype(str).str.contains("Święto|Edycja")]
-        for _, r in ex_recs.iterrows():
-            excluded_set.add((r['Uczen_ID'], str(r['Data'])))
-            
-    student_map = df_students.set_index('ID').to_dict('index')
-    
-    current_day = start_date
-    while current_day <= end_date:
-        weekday_num = current_day.weekday()
-        current_day_str = str(current_day)
-        
-        for _, sch_row in df_schedule.iterrows():
-            if DNI_MAPA.get(sch_row['Dzien_tyg']) == weekday_num:
-                try:
-                    s_valid_start = pd.to_datetime(sch_row['Data_od']).date()
-                    s_valid_end = pd.to_datetime(sch_row['Data_do']).date()
-                    
-                    if s_valid_start <= current_day <= s_valid_end:
-                        uid = sch_row['Uczen_ID']
-                        if uid in student_map:
-                            if (uid, current_day_str) not in excluded_set:
-                                s_info = student_map[uid]
-                                dur = float(sch_row['Czas_trwania'])
-                                sch_rate = float(sch_row.get('Stawka', 0))
-                                hourly_rate = sch_rate if sch_rate > 0 else s_info['Stawka']
-                                full_rate = (hourly_rate * dur) + s_info.get('Dojazd', 0)
-                                
-                                lessons.append({
-                                    'Data': current_day, 'Uczen_ID': uid, 'Stawka': full_rate, 
-                                    'Godzina': sch_row['Godzina'], 
-                                    'Imie': s_info['Imie'], 'Nazwisko': s_info['Nazwisko'],
-                                    'Typ': 'Stała', 'Czas': dur
-                                })
-                except: pass
-        current_day += timedelta(days=1)
-        
-    return lessons
+        df_cancel = df_cancel[df_cancel['Czy_swieto'] | df_cancel['Czy_edycja']]
+    planned = drop_cancelled(expand_schedule(df_students, df_schedule, start_date, end_date), df_cancel)
+    return sort_lessons(drop_holidays(planned, df_students, load_holidays(current_tenant())))
 
-def calculate_predicted_income(df_students, start_date, end_date):
-    lessons = get_predicted_lessons(df_students, start_date, end_date)
-    return sum(l['Stawka'] for l in lessons)
+def lesson_travel_split(lessons, df_students):
+    """Dzieli kwotę lekcji na dojazd i edukację (dojazd nie większy niż kwota)."""
+    travel_unit = pd.to_numeric(df_students.drop_duplicates('ID').set_index('ID')['Dojazd'], errors='coerce').fillna(0.0)
+    travel = np.minimum(lessons['Uczen_ID'].map(travel_unit).fillna(0.0).to_numpy(), lessons['Stawka'].to_numpy())
+    return travel, lessons['Stawka'].to_numpy() - travel
 
+@memoized
 def calculate_monthly_breakdown(df_students, student_id, target_month_date):
     breakdown = []
     total_amount = 0.0
     
-    student_row = df_students[df_students['ID'] == student_id].iloc[0]
+    student_df = df_students[df_students['ID'] == student_id]
+    student_row = student_df.iloc[0]
     tryb = student_row.get('Tryb_platnosci', 'Co zajęcia')
     
     y, m = target_month_date.year, target_month_date.month
     curr_start = date(y, m, 1)
     curr_end = curr_start + relativedelta(months=1) - timedelta(days=1)
     
-    df_schedule = load_schedule()
-    student_schedule = df_schedule[df_schedule['Uczen_ID'] == student_id]
-    
-    lessons_count = 0
-    base_cost_accumulated = 0.0
-    day_ptr = curr_start
-    
-    df_cancel = load_cancellations()
-    holidays_set = set()
-    if not df_cancel.empty:
-        holiday_recs = df_cancel[
-            (df_cancel['Uczen_ID'] == student_id) & 
-            (df_cancel['Powod'].astype(str).str.contains("Święto|Edycja"))
-        ]
-        for _, r in holiday_recs.iterrows(): holidays_set.add(str(r['Data']))
-
-    while day_ptr <= curr_end:
-        weekday_num = day_ptr.weekday()
-        if str(day_ptr) not in holidays_set:
-            for _, sch in student_schedule.iterrows():
-                if DNI_MAPA.get(sch['Dzien_tyg']) == weekday_num:
-                    try:
-                        s_od = pd.to_datetime(sch['Data_od']).date()
-                        s_do = pd.to_datetime(sch['Data_do']).date()
-                        if s_od <= day_ptr <= s_do:
-                            lessons_count += 1
-                            dur = float(sch['Czas_trwania'])
-                            sch_rate = float(sch.get('Stawka', 0))
-                            hourly_rate = sch_rate if sch_rate > 0 else student_row['Stawka']
-                            cost = (hourly_rate * dur) + student_row.get('Dojazd', 0)
-                            base_cost_accumulated += cost
-                    except: pass
-        day_ptr += timedelta(days=1)
-            
+    planned = get_predicted_lessons(student_df, curr_start, curr_end)
+    lessons_count = len(planned)
+    base_cost_accumulated = float(planned['Stawka'].sum())
+    df_cancel, df_extra, df_schedule = student_tables(student_df, current_tenant())
+
     total_amount += base_cost_accumulated
     label_base = f"Abonament: {MIESIACE_PL[m]}" if tryb == 'Miesięcznie' else f"Planowe zajęcia: {MIESIACE_PL[m]}"
     
@@ -375,15 +832,14 @@ def calculate_monthly_breakdown(df_students, student_id, target_month_date):
         "Typ": "Baza"
     })
     
-    query_start = curr_start
-    query_end = curr_end
+    query_start = pd.Timestamp(curr_start)
+    query_end = pd.Timestamp(curr_end)
     
-    df_extra = load_extra()
     if not df_extra.empty:
-        extras = df_extra[(df_extra['Uczen_ID'] == student_id) & (pd.to_datetime(df_extra['Data']).dt.date >= query_start) & (pd.to_datetime(df_extra['Data']).dt.date <= query_end)]
+        extras = df_extra[(df_extra['Uczen_ID'] == student_id) & (df_extra['Data'] >= query_start) & (df_extra['Data'] <= query_end)]
         for _, row in extras.iterrows():
-            typ = row.get('Typ', 'Dodatkowa')
-            dur = row.get('Czas', 1.0)
+            typ = row['Typ'] if pd.notna(row['Typ']) else 'Dodatkowa'
+            dur = row['Czas']
             
             kwota_do_sumy = 0.0
             kwota_do_wyswietlenia = 0.0
@@ -411,110 +867,1445 @@ def calculate_monthly_breakdown(df_students, student_id, target_month_date):
                     opis_typ = f"Odrabianie - bez dopłaty ({dur}h)"
             
             total_amount += kwota_do_sumy
-            breakdown.append({"Opis": f"{typ}: {row['Data']}", "Kwota": kwota_do_wyswietlenia, "Typ": opis_typ})
+            breakdown.append({"Opis": f"{typ}: {row['Data']:%Y-%m-%d}", "Kwota": kwota_do_wyswietlenia, "Typ": opis_typ})
             
     if not df_cancel.empty:
-        cancels = df_cancel[(df_cancel['Uczen_ID'] == student_id) & (pd.to_datetime(df_cancel['Data']).dt.date >= query_start) & (pd.to_datetime(df_cancel['Data']).dt.date <= query_end)]
+        cancels = df_cancel[(df_cancel['Uczen_ID'] == student_id) & (df_cancel['Data'] >= query_start) & (df_cancel['Data'] <= query_end)
+                            & ~df_cancel['Czy_swieto'] & ~df_cancel['Czy_edycja']]
+        # Koszt odwołanej lekcji = koszt z planu w tym dniu (pierwszy pasujący okres harmonogramu)
+        plan_cost = expand_schedule(student_df, df_schedule, curr_start, curr_end).drop_duplicates('Data').set_index('Data')['Stawka']
         for _, row in cancels.iterrows():
-            powod = row.get('Powod', 'Nieznany')
-            if "Święto" in str(powod) or "Edycja" in str(powod): continue
-            
             if tryb == 'Miesięcznie':
                 kwota_cancel = 0.0
-                desc = f"Odwołana: {row['Data']} (Brak zwrotu)"
+                desc = f"Odwołana: {row['Data']:%Y-%m-%d} (Brak zwrotu)"
             else:
-                day_of_cancel = pd.to_datetime(row['Data']).weekday()
-                cost_of_lesson = 0.0
-                found = False
-                for _, sch in student_schedule.iterrows():
-                    if DNI_MAPA.get(sch['Dzien_tyg']) == day_of_cancel:
-                        s_od = pd.to_datetime(sch['Data_od']).date()
-                        s_do = pd.to_datetime(sch['Data_do']).date()
-                        target_d = pd.to_datetime(row['Data']).date()
-                        if s_od <= target_d <= s_do:
-                            dur = float(sch['Czas_trwania'])
-                            sch_rate = float(sch.get('Stawka', 0))
-                            hourly_rate = sch_rate if sch_rate > 0 else student_row['Stawka']
-                            cost_of_lesson = (hourly_rate * dur) + student_row.get('Dojazd', 0)
-                            found = True
-                            break
-                
-                if found:
-                    kwota_cancel = -cost_of_lesson
-                    desc = f"Odwołana: {row['Data']} (Odliczenie)"
+                cost_of_lesson = plan_cost.get(row['Data'])
+                if cost_of_lesson is not None:
+                    kwota_cancel = -float(cost_of_lesson)
+                    desc = f"Odwołana: {row['Data']:%Y-%m-%d} (Odliczenie)"
                 else:
                     kwota_cancel = 0.0
-                    desc = f"Odwołana: {row['Data']}"
+                    desc = f"Odwołana: {row['Data']:%Y-%m-%d}"
 
             total_amount += kwota_cancel
             breakdown.append({"Opis": desc, "Kwota": kwota_cancel, "Typ": "Korekta"})
             
     return total_amount, breakdown
 
+LESSON_COLORS = {'Stała': "#3788d8", 'Dodatkowa': "#28a745", 'Odrabianie': "#fd7e14", 'Przełożona': "#6f42c1", 'Edytowana': "#17a2b8"}
+
 def generate_calendar_events(df_students):
     today = date.today()
     end_date = today + timedelta(days=365)
     start_date = today - timedelta(days=365)
     lessons = get_lessons_in_period(df_students, start_date, end_date)
-    events = []
-    for l in lessons:
-        try:
-            godzina_str = str(l['Godzina'])
-            if len(godzina_str.split(':')) == 2: godzina_str += ":00"
-            start_time = datetime.combine(l['Data'], datetime.strptime(godzina_str, "%H:%M:%S").time())
-            duration_hours = l.get('Czas', 1.0)
-            end_time = start_time + timedelta(hours=duration_hours)
-            
-            color = "#3788d8"
-            typ = l['Typ']
-            if typ == 'Dodatkowa': color = "#28a745"
-            elif typ == 'Odrabianie': color = "#fd7e14"
-            elif typ == 'Przełożona': color = "#6f42c1"
-            elif typ == 'Edytowana': color = "#17a2b8" 
+    if lessons.empty: return []
+
+    # Wszystkie pola liczymy kolumnowo, dopiero na końcu składamy listę słowników dla kalendarza
+    students = df_students.drop_duplicates('ID').set_index('ID')
+    imie = lessons['Uczen_ID'].map(students['Imie']).astype(str)
+    nazwisko = lessons['Uczen_ID'].map(students['Nazwisko']).astype(str)
+    start_ts = lessons['Data'] + pd.to_timedelta(lessons['Minuty'].astype('int64'), unit='m')
+    end_ts = start_ts + pd.to_timedelta(lessons['Czas'].astype('float64'), unit='h')
+    colors = lessons['Typ'].astype(object).map(LESSON_COLORS).fillna(LESSON_COLORS['Stała'])
+    cols = zip(
+        (imie + ' ' + nazwisko), start_ts.dt.strftime('%Y-%m-%dT%H:%M:%S'), end_ts.dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        colors, lessons['Uczen_ID'], lessons['Typ'].astype(str), lessons['Data'].dt.strftime('%Y-%m-%d'),
+        minutes_to_time_str(lessons['Minuty']), lessons['Stawka'], imie, nazwisko, lessons['Czas'].astype(float)
+    )
+    return [{
+        "title": title, "start": start, "end": end, "backgroundColor": color, "borderColor": color,
+        "extendedProps": {
+            "Uczen_ID": int(uid), "Typ": typ, "Data": d_str, "Godzina": godz, "Stawka": float(stawka),
+            "Imie": im, "Nazwisko": naz, "Czas": czas
+        }
+    } for title, start, end, color, uid, typ, d_str, godz, stawka, im, naz, czas in cols]
+
+def holiday_events(df_holidays):
+    """Dni wolne jako wydarzenia w tle kalendarza (koniec przedziału w FullCalendar jest wyłączny)."""
+    return [{
+        "title": str(h['Nazwa']) if pd.notna(h['Nazwa']) else "Dzień wolny", "display": "background", "backgroundColor": "#ffc9c9",
+        "start": h['Data_od'].strftime("%Y-%m-%d"), "end": (h['Data_do'] + timedelta(days=1)).strftime("%Y-%m-%d")
+    } for _, h in df_holidays.iterrows()]
+
+def student_labels(df_students):
+    """ID -> 'Imię Nazwisko' (do list wyboru)."""
+    return dict(zip(df_students['ID'], df_students['Imie'].astype(str) + ' ' + df_students['Nazwisko'].astype(str)))
+
+def plan_bulk_cancellation(df_students, student_ids, start_date, end_date):
+    """Nieodwołane lekcje z planu wybranych uczniów w okresie - podgląd odwołania zbiorczego."""
+    lessons = get_lessons_in_period(df_students[df_students['ID'].isin(student_ids)], start_date, end_date)
+    return lessons[lessons['Typ'] == 'Stała'].reset_index(drop=True)
+
+def apply_bulk_cancellation(df_students, lessons, powod, shift_days=0):
+    """Odwołuje (i opcjonalnie przekłada o shift_days) wiele lekcji naraz w jednej transakcji,
+    liczniki aktualizowane tylko dla uczniów, których dotyczy odwołanie."""
+    if lessons.empty: return
+    uow = UnitOfWork()
+    uow.insert("odwolane", pd.DataFrame({'Uczen_ID': lessons['Uczen_ID'], 'Data': lessons['Data'], 'Powod': powod}))
+    if shift_days:
+        moved = pd.DataFrame({
+            'Uczen_ID': lessons['Uczen_ID'], 'Data': lessons['Data'] + pd.Timedelta(days=shift_days),
+            'Godzina': minutes_to_time_str(lessons['Minuty']) + ':00', 'Stawka': lessons['Stawka'],
+            'Typ': 'Przełożona', 'Czas': lessons['Czas'].astype(float), 'Status': 'Zaplanowana'
+        })
+        uow.insert("dodatkowe", moved)
+    if "Święto" not in powod and (powod == "Wina Ucznia" or not shift_days):
+        per_student = {sid: (r['size'], r['sum']) for sid, r in lessons.groupby('Uczen_ID')['Czas'].agg(['size', 'sum']).iterrows()}
+        if powod == "Wina Ucznia": uow.record("Nieobecność", per_student)
+        # Przełożone lekcje mają już nowy termin, więc nie wiszą jako "do odrobienia"
+        if not shift_days: uow.record("Do odrobienia", per_student)
+    uow.commit()
+
+# --- KOLIZJE TERMINÓW (INDEKS PRZEDZIAŁÓW) ---
+# Lekcja zajmuje [początek, koniec) w minutach od epoki. Między lekcjami różnych uczniów musi zostać przerwa
+# co najmniej TRAVEL_BUFFER_MIN, jeśli którakolwiek z nich jest z dojazdem - bufor liczony raz na przerwę
+# (większy z dwóch), nie sumowany. Przedziały powiększone o bufor, posortowane po początku, + najdłuższy
+# przedział wystarczą, żeby zapytanie o kolizje było wyszukiwaniem binarnym (np.searchsorted) zamiast
+# porównania ze wszystkimi lekcjami; dokładny warunek przerwy sprawdzany jest już tylko na kandydatach.
+TRAVEL_BUFFER_MIN = 30
+CONFLICT_HORIZON_DAYS = 365
+
+def lesson_spans(lessons, df_students):
+    """(początek, koniec, bufor) lekcji w minutach - koniec z Czas (h), bufor tylko u uczniów z dojazdem."""
+    start = lessons['Data'].to_numpy(dtype='datetime64[m]').astype('int64') + lessons['Minuty'].to_numpy(dtype='int64')
+    end = start + np.round(lessons['Czas'].to_numpy(dtype='float64') * 60).astype('int64')
+    travel = lessons['Uczen_ID'].map(df_students.drop_duplicates('ID').set_index('ID')['Dojazd']).fillna(0).to_numpy()
+    return start, end, np.where(travel > 0, TRAVEL_BUFFER_MIN, 0).astype('int64')
+
+class LessonIndex:
+    """Indeks przedziałów lekcji: kolizje jednego terminu w O(log n + k)."""
+
+    def __init__(self, lessons, df_students):
+        start, end, buf = lesson_spans(lessons, df_students)
+        order = np.argsort(start - buf, kind='stable')
+        self.lessons = lessons.iloc[order].reset_index(drop=True)
+        self.uid = self.lessons['Uczen_ID'].to_numpy(dtype='int64')
+        self.start, self.end, self.buf = start[order], end[order], buf[order]
+        self.lo, self.hi = self.start - self.buf, self.end + self.buf
+        self.max_span = int((self.hi - self.lo).max()) if len(order) else 0
+
+    def query(self, uid, start, end, buf=0):
+        """Pozycje lekcji kolidujących z [start, end) (przerwa krótsza niż większy z buforów: nowej lekcji
+        i istniejącej) oraz maska, czy zajęcia nakładają się wprost (False = kolizja tylko przez dojazd)."""
+        lo, hi = start - buf, end + buf
+        cand = np.arange(np.searchsorted(self.lo, lo - self.max_span, 'right'), np.searchsorted(self.lo, hi, 'left'))
+        cand = cand[self.hi[cand] > lo]
+        gap = np.maximum(self.start[cand] - end, start - self.end[cand])
+        direct = gap < 0
+        # Kolejne lekcje tego samego ucznia nie wymagają dojazdu między nimi
+        keep = direct | ((gap < np.maximum(self.buf[cand], buf)) & (self.uid[cand] != uid))
+        return cand[keep], direct[keep]
+
+    def all_conflicts(self):
+        """Wszystkie pary kolidujących lekcji (i < j) - dla każdej lekcji tylko kandydaci z searchsorted."""
+        n = len(self.lo)
+        last = np.searchsorted(self.lo, self.hi, 'left')
+        counts = np.maximum(last - np.arange(n) - 1, 0)
+        i = np.repeat(np.arange(n), counts)
+        j = i + 1 + np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        gap = np.maximum(self.start[j] - self.end[i], self.start[i] - self.end[j])
+        direct = gap < 0
+        keep = direct | ((gap < np.maximum(self.buf[i], self.buf[j])) & (self.uid[i] != self.uid[j]))
+        return i[keep], j[keep], direct[keep]
+
+def lesson_conflicts(index, new_lessons, df_students):
+    """Kolizje nowych lekcji (ramka kolumnowa) z lekcjami w indeksie - tabela do ostrzeżenia przed zapisem."""
+    if new_lessons.empty or index.lessons.empty: return pd.DataFrame()
+    start, end, buf = lesson_spans(new_lessons, df_students)
+    found = [(k, *index.query(u, s, e, b)) for k, (u, s, e, b) in enumerate(zip(new_lessons['Uczen_ID'], start, end, buf))]
+    new_pos = np.concatenate([np.full(len(c), k) for k, c, _ in found])
+    old_pos = np.concatenate([c for _, c, _ in found]).astype('int64')
+    direct = np.concatenate([d for _, _, d in found]).astype(bool)
+    return conflict_table(new_lessons.iloc[new_pos], index.lessons.iloc[old_pos], direct, df_students)
+
+def conflict_table(first, second, direct, df_students):
+    labels = student_labels(df_students)
+    fmt = lambda l: (l['Data'].dt.strftime('%Y-%m-%d') + ' ' + minutes_to_time_str(l['Minuty'])).to_numpy()
+    return pd.DataFrame({
+        "Termin": fmt(first), "Uczeń": first['Uczen_ID'].map(labels).to_numpy(),
+        "Koliduje z": second['Uczen_ID'].map(labels).to_numpy(), "Termin (kolizja)": fmt(second),
+        "Typ (kolizja)": second['Typ'].astype(str).to_numpy(),
+        "Rodzaj": np.where(direct, "Nakładanie", f"Dojazd (< {TRAVEL_BUFFER_MIN} min)")
+    })
+
+# --- WOLNE TERMINY (MIEJSCE NA ODRABIANIE) ---
+# Godziny pracy = granice widoku tygodnia w kalendarzu (slotMinTime / slotMaxTime).
+SLOT_MIN_TIME, SLOT_MAX_TIME = "08:00:00", "22:00:00"
+SLOT_STEP_MIN = 15
+
+def free_slots(index, df_students, student_id, duration_h, weeks=4, n=5, usual_days_only=False, now=None):
+    """Najbliższe wolne terminy (najwyżej jeden na dzień) na lekcję ucznia w ciągu `weeks` tygodni.
+    Zajętość to mapy dni x sloty 15-minutowe z przedziałów indeksu lekcji: z buforami istniejących lekcji
+    (sprawdzana sama nowa lekcja) i bez nich (sprawdzana nowa lekcja z jej buforem) - bufor raz na przerwę,
+    jak w LessonIndex. W danym dniu wybierana jest godzina najbliższa zwykłej godzinie zajęć ucznia."""
+    now = pd.Timestamp(now or datetime.now())
+    student = df_students[df_students['ID'] == student_id].iloc[0]
+    pad = -(-(TRAVEL_BUFFER_MIN if float(student['Dojazd']) > 0 else 0) // SLOT_STEP_MIN)
+    day_min, day_max = (int(m) for m in time_to_minutes([SLOT_MIN_TIME, SLOT_MAX_TIME]))
+    n_slots = (day_max - day_min) // SLOT_STEP_MIN + 2 * pad
+    lesson_width = -(-round(duration_h * 60) // SLOT_STEP_MIN)
+    width = lesson_width + 2 * pad
+    if width > n_slots: return pd.DataFrame(columns=['Data', 'Dzień', 'Godzina', 'Zwykły dzień'])
+
+    days = pd.date_range(now.normalize(), periods=weeks * 7, freq='D')
+    # Początek siatki każdego dnia (minuty od epoki) - pierwsze sloty to bufor przed SLOT_MIN_TIME
+    day_start = days.to_numpy(dtype='datetime64[m]').astype('int64')
+    origin = day_start + day_min - pad * SLOT_STEP_MIN
+    cand = np.arange(np.searchsorted(index.lo, origin[0] - index.max_span, 'right'),
+                     np.searchsorted(index.lo, origin[-1] + n_slots * SLOT_STEP_MIN, 'left'))
+    cand = cand[index.hi[cand] > origin[0]]
+    row = (index.start[cand] - day_start[0]) // 1440
+    cand, row = cand[(row >= 0) & (row < len(days))], row[(row >= 0) & (row < len(days))]
+
+    def busy_map(lo, hi):
+        occupied = np.zeros((len(days), n_slots + 1), dtype='int32')
+        if len(cand):
+            np.add.at(occupied, (row, np.clip((lo[cand] - origin[row]) // SLOT_STEP_MIN, 0, n_slots)), 1)
+            np.add.at(occupied, (row, np.clip(-(-(hi[cand] - origin[row]) // SLOT_STEP_MIN), 0, n_slots)), -1)
+        busy = np.cumsum(occupied[:, :n_slots], axis=1) > 0
+        return np.concatenate([np.zeros((len(days), 1), dtype='int64'), np.cumsum(busy, axis=1)], axis=1)
+
+    # Okno jest wolne, gdy suma zajętości w nim = 0 (sumy prefiksowe po wierszach); k = początek okna z buforem
+    count = n_slots - width + 1
+    padded, plain = busy_map(index.lo, index.hi), busy_map(index.start, index.end)
+    free = ((padded[:, pad + lesson_width:pad + lesson_width + count] - padded[:, pad:pad + count]) == 0) \
+        & ((plain[:, width:width + count] - plain[:, :count]) == 0)
+    day_minutes = day_min + np.arange(free.shape[1]) * SLOT_STEP_MIN
+    free &= day_start[:, None] + day_minutes > now.to_datetime64().astype('datetime64[m]').astype('int64')
+
+    sch = load_schedule(current_tenant())
+    sch = sch[(sch['Uczen_ID'] == student_id) & (sch['Data_do'] >= now.normalize())]
+    usual = days.weekday.isin(sch['Dzien_nr'].astype(int))
+    day_ok = np.isin(days.to_numpy(), drop_holidays(pd.DataFrame({'Data': days, 'Uczen_ID': student_id}), df_students, load_holidays(current_tenant()))['Data'].to_numpy())
+    if usual_days_only: day_ok &= usual
+    free &= day_ok[:, None]
+
+    preferred = float(sch['Minuty'].median()) if not sch.empty else day_min
+    distance = np.where(free, np.abs(day_minutes - preferred), np.inf)
+    rows = np.flatnonzero(free.any(axis=1))[:n]
+    best = distance[rows].argmin(axis=1)
+    weekday_names = {v: k for k, v in DNI_MAPA.items()}
+    return pd.DataFrame({
+        'Data': days[rows].date, 'Dzień': [weekday_names[d] for d in days[rows].weekday],
+        'Godzina': minutes_to_time_str(day_minutes[best]).to_numpy(),
+        'Zwykły dzień': usual[rows]
+    })
+
+REGISTER_COLUMNS = ["ID Okresu", "Termin", "Kwota do zapłaty"]
+
+@memoized
+def register_rows(df_students, selected_id, start_date, end_date):
+    """Pozycje rejestru wpłat ucznia w okresie (bez wpłat): abonament + lekcje dodatkowe albo pojedyncze lekcje."""
+    student_row = df_students[df_students['ID'] == selected_id].iloc[0]
+    rows = []
+    if student_row.get('Tryb_platnosci', 'Co zajęcia') == "Miesięcznie":
+        curr = start_date.replace(day=1)
+        df_extra_all = select_rows(current_tenant(), 'dodatkowe', ['Uczen_ID', 'Data', 'Typ', 'Stawka'], [
+            ('Uczen_ID', 'eq', selected_id), ('Typ', 'eq', 'Dodatkowa'),
+            ('Data', 'gte', curr), ('Data', 'lte', end_date.replace(day=1) + relativedelta(months=1, days=-1))])
+        while curr <= end_date:
+            m_str = curr.strftime("%Y-%m")
+            calc_amount, _ = calculate_monthly_breakdown(df_students, selected_id, curr)
+            rows.append({"ID Okresu": m_str, "Termin": f"{MIESIACE_PL.get(curr.month)} {curr.year}", "Kwota do zapłaty": float(calc_amount)})
+
+            month_start, month_end = curr, curr + relativedelta(months=1) - timedelta(days=1)
+            extras_in_month = df_extra_all[(df_extra_all['Uczen_ID'] == selected_id) & (df_extra_all['Typ'] == 'Dodatkowa') & (df_extra_all['Data'] >= pd.Timestamp(month_start)) & (df_extra_all['Data'] <= pd.Timestamp(month_end))]
+            for _, ex_row in extras_in_month.iterrows():
+                d_str = ex_row['Data'].strftime("%Y-%m-%d")
+                rows.append({"ID Okresu": d_str, "Termin": f"Lekcja dodatkowa: {d_str}", "Kwota do zapłaty": float(ex_row['Stawka'])})
+            curr += relativedelta(months=1)
+        return pd.DataFrame(rows, columns=REGISTER_COLUMNS)
+    all_lessons = get_lessons_in_period(df_students[df_students['ID'] == selected_id], start_date, end_date)
+    l_dates = all_lessons['Data'].dt
+    label = l_dates.day.astype(str) + ' ' + l_dates.month.map(MIESIACE_PL) + ' ' + l_dates.year.astype(str)
+    label = label.where(all_lessons['Typ'] == 'Stała', label + ' (' + all_lessons['Typ'].astype(str) + ')')
+    return pd.DataFrame({"ID Okresu": l_dates.strftime("%Y-%m-%d"), "Termin": label, "Kwota do zapłaty": all_lessons['Stawka'].astype(float)})
+
+def paid_by_period(df_settlements, selected_id):
+    """Wpłaty ucznia wg okresu (przy zdublowanych wpisach liczy się pierwszy)."""
+    saved = df_settlements[df_settlements['Uczen_ID'] == selected_id]
+    saved = saved[~saved['Okres'].astype(str).duplicated()]
+    return pd.to_numeric(saved['Wplacono'], errors='coerce').set_axis(saved['Okres'].astype(str))
+
+@st.cache_data(ttl=60)
+def payment_rows(tenant_id, selected_id, version):
+    """Wiersze rejestru wpłat ucznia (okres, kwota wymagana, wpłacono) - liczone raz na wersję danych (version w kluczu cache).
+    Zamknięte miesiące pochodzą ze snapshotów, liczone są tylko okresy otwarte."""
+    df = load_data(tenant_id)
+    df_settlements = select_rows(tenant_id, 'rozliczenia', ['Uczen_ID', 'Okres', 'Wplacono'], [('Uczen_ID', 'eq', selected_id)])
+    student_row = df[df['ID'] == selected_id].iloc[0]
+    start_date = student_row['Data_rozp'].date()
+    if student_row.get('Tryb_platnosci', 'Co zajęcia') == "Miesięcznie":
+        end_date = (date.today().replace(day=1) + relativedelta(months=1)) - timedelta(days=1)
+    else:
+        end_date = min(student_row['Data_zak'].date(), date.today())
+
+    snaps = select_rows(tenant_id, 'zamkniete_miesiace', ['Uczen_ID', 'Miesiac', 'Rejestr'], [('Uczen_ID', 'eq', selected_id)])
+    closed = set(snaps['Miesiac'])
+    open_start = start_date.replace(day=1)
+    while open_start.strftime("%Y-%m") in closed: open_start += relativedelta(months=1)
+    live = register_rows(df, selected_id, max(start_date, open_start), end_date)
+    live = live[~live['ID Okresu'].str.slice(0, 7).isin(closed)]
+    frozen = pd.DataFrame([r for rows in snaps['Rejestr'] for r in rows], columns=REGISTER_COLUMNS)
+
+    table = pd.concat([frozen, live], ignore_index=True).sort_values("ID Okresu", ascending=False, kind='stable')
+    table["Ile wpłacono"] = table["ID Okresu"].map(paid_by_period(df_settlements, selected_id)).fillna(0.0).astype(float)
+    return table.to_dict('records')
+
+# --- ZAMYKANIE MIESIĘCY (SNAPSHOTY) ---
+
+def month_bounds(month_start):
+    return month_start, month_start + relativedelta(months=1) - timedelta(days=1)
+
+def month_students(df_students, m_start, m_end, lessons):
+    """Uczniowie aktywni w miesiącu albo mający w nim zajęcia z planu (okresy harmonogramu mogą wychodzić poza daty ucznia)."""
+    return df_students[((df_students['Data_rozp'] <= pd.Timestamp(m_end)) & (df_students['Data_zak'] >= pd.Timestamp(m_start)))
+                       | df_students['ID'].isin(lessons['Uczen_ID'])]
+
+def build_month_snapshot(df_students, month_start):
+    """Zamraża rozliczenie miesiąca: dla każdego aktywnego ucznia kwota, pozycje rachunku,
+    wiersze rejestru, stan wpłat oraz plan (łącznie / abonament / dojazd)."""
+    m_start, m_end = month_bounds(month_start)
+    m_str = m_start.strftime("%Y-%m")
+    lessons = get_predicted_lessons(df_students, m_start, m_end)
+    plan = summarize_plan(lessons, df_students)['per_student']
+    mode = lessons['Uczen_ID'].map(df_students.drop_duplicates('ID').set_index('ID')['Tryb_platnosci'])
+    active = month_students(df_students, m_start, m_end, lessons)
+    abon = lessons['Stawka'].where((mode == 'Miesięcznie') & (lessons['Typ'] != 'Dodatkowa'), 0.0).groupby(lessons['Uczen_ID']).sum()
+    df_settlements = load_settlements(current_tenant())
+    rows = []
+    for _, st_row in active.iterrows():
+        sid = st_row['ID']
+        _, details = calculate_monthly_breakdown(df_students, sid, m_start)
+        reg_end = m_end if st_row['Tryb_platnosci'] == "Miesięcznie" else min(m_end, st_row['Data_zak'].date())
+        reg = register_rows(df_students, sid, max(st_row['Data_rozp'].date(), m_start), reg_end)
+        reg = reg[reg['ID Okresu'].str.slice(0, 7) == m_str]
+        due = float(reg['Kwota do zapłaty'].sum())
+        paid = float(reg['ID Okresu'].map(paid_by_period(df_settlements, sid)).fillna(0.0).sum())
+        rows.append({'Miesiac': m_str, 'Uczen_ID': sid, 'Tryb_platnosci': st_row['Tryb_platnosci'], 'Kwota': due,
+                     'Wplacono': paid, 'Oplacone': paid >= due,
+                     'Pozycje': [{k: json_value(v) for k, v in d.items()} for d in details],
+                     'Rejestr': [{k: json_value(v) for k, v in r.items()} for r in reg.to_dict('records')],
+                     'Plan': float(plan['Kwota'].get(sid, 0.0)), 'Plan_abonament': float(abon.get(sid, 0.0)),
+                     'Plan_dojazd': float(plan['Dojazd'].get(sid, 0.0))})
+    return pd.DataFrame(rows, columns=COLUMNS_SNAPSHOTS)
+
+def closed_month_keys(df_snapshots):
+    return set(df_snapshots['Miesiac'])
+
+def month_keys(start_date, end_date):
+    """Miesiące 'YYYY-MM' od start_date do end_date włącznie."""
+    return [m.strftime("%Y-%m") for m in pd.date_range(pd.Timestamp(start_date).replace(day=1), end_date, freq='MS')]
+
+@memoized
+def plan_summary(df_students, start_date, end_date):
+    """Sumy planu (jak summarize_plan) dla okresu z pełnych miesięcy - czytane z zestawienia miesięcznego."""
+    rows = monthly_rollup(current_tenant(), month_keys(start_date, end_date))
+    rows = rows[rows['Uczen_ID'].isin(df_students['ID'])]
+    monthly = ((rows['Tryb_platnosci'] == 'Miesięcznie') & (rows['Typ'] != 'Dodatkowa')).to_numpy()
+    amt = rows['Plan'].to_numpy()
+    per_student = rows[rows['Plan'] != 0].groupby('Uczen_ID')[['Plan', 'Plan_dojazd']].sum().rename(columns={'Plan': 'Kwota', 'Plan_dojazd': 'Dojazd'})
+    return {'total': amt.sum(), 'monthly': amt[monthly].sum(), 'single': amt[~monthly].sum(),
+            'tuition': rows['Plan_edukacja'].sum(), 'travel': rows['Plan_dojazd'].sum(), 'per_student': per_student}
+
+def summarize_plan(lessons, df_students):
+    """Sumy planu do raportów: łącznie, abonamenty/pojedyncze, edukacja/dojazd oraz per uczeń."""
+    travel, tuition = lesson_travel_split(lessons, df_students)
+    mode = lessons['Uczen_ID'].map(df_students.drop_duplicates('ID').set_index('ID')['Tryb_platnosci'])
+    monthly = ((mode == 'Miesięcznie') & (lessons['Typ'] != 'Dodatkowa')).to_numpy()
+    amt = lessons['Stawka'].to_numpy()
+    per_student = pd.DataFrame({'Uczen_ID': lessons['Uczen_ID'].to_numpy(), 'Kwota': amt, 'Dojazd': travel}).groupby('Uczen_ID').sum()
+    return {'total': amt.sum(), 'monthly': amt[monthly].sum(), 'single': amt[~monthly].sum(),
+            'tuition': tuition.sum(), 'travel': travel.sum(), 'per_student': per_student}
+
+def summarize_real(rows, df_students, plan_per_student):
+    """Sumy wpłat z wierszy zestawienia miesięcznego; dojazd szacowany proporcjonalnie do planu ucznia."""
+    recs = rows[(rows['Wplacono'] > 0) & rows['Uczen_ID'].isin(df_students['ID'])]
+    paid = recs['Wplacono'].to_numpy()
+    monthly = ((recs['Tryb_platnosci'] == 'Miesięcznie') & (recs['Typ'] != 'Dodatkowa')).to_numpy()
+    p_tot = recs['Uczen_ID'].map(plan_per_student['Kwota']).fillna(0.0).to_numpy()
+    p_trav = recs['Uczen_ID'].map(plan_per_student['Dojazd']).fillna(0.0).to_numpy()
+    ratio = np.minimum(np.divide(paid, p_tot, out=np.zeros_like(paid), where=p_tot > 0), 1.0)
+    est_travel = p_trav * ratio
+    return {'total': rows['Wplacono'].sum(), 'monthly': paid[monthly].sum(), 'single': paid[~monthly].sum(),
+            'tuition': (paid - est_travel).sum(), 'travel': est_travel.sum()}
+
+# --- ZESTAWIENIE MIESIĘCZNE (ROLLUP PRZYCHODÓW) ---
+# Plan i wpłaty zagregowane po (miesiąc, uczeń, tryb płatności, typ lekcji). Zestawienie jest wspólne dla sesji
+# w procesie (st.cache_resource); brakujące miesiące liczone są przy pierwszym odczycie, a zapis przez UnitOfWork
+# oznacza tylko dotknięte klucze (miesiąc, uczeń) do przeliczenia. Zmiana danych z zewnątrz (inny proces)
+# wykrywana jest po wersji danych i przelicza zestawienie od nowa.
+ROLLUP_KEYS = ['Miesiac', 'Uczen_ID', 'Tryb_platnosci', 'Typ']
+ROLLUP_COLUMNS = ROLLUP_KEYS + ['Plan', 'Plan_edukacja', 'Plan_dojazd', 'Wplacono']
+# Kolumna z datą/miesiącem wiersza; tabele bez niej (uczniowie, harmonogram) zmieniają wszystkie miesiące ucznia
+ROLLUP_MONTH_COLUMNS = {'rozliczenia': 'Okres', 'odwolane': 'Data', 'dodatkowe': 'Data', 'zamkniete_miesiace': 'Miesiac'}
+
+# Zakres wersji danych: 'grafik' - tabele potrzebne do rozwinięcia lekcji, 'wszystko' - także wpłaty i snapshoty
+DATA_VERSION_TABLES = {'grafik': ('uczniowie', 'harmonogram', 'dodatkowe', 'odwolane', 'dni_wolne')}
+DATA_VERSION_TABLES['wszystko'] = DATA_VERSION_TABLES['grafik'] + ('rozliczenia', 'zamkniete_miesiace')
+
+def data_version(tenant_id, scope):
+    """Wersja danych = skrót hashy tabel snapshotu (zmienia się tylko, gdy zmieniły się dane)."""
+    hashes = data_snapshot(tenant_id).hashes
+    return hashlib.sha1("".join(hashes[t] for t in DATA_VERSION_TABLES[scope]).encode()).hexdigest()[:16]
+
+def rollup_keys(op):
+    """Klucze (miesiąc, uczeń) zmienione operacją UnitOfWork; None = wszystkie miesiące / wszyscy uczniowie."""
+    table = op.get('table')
+    if table == 'zdarzenia_licznikow': return set()
+    if table == 'dni_wolne': return {(None, None)}
+    month_col = ROLLUP_MONTH_COLUMNS.get(table)
+    keys = set()
+    for r in op.get('rows') or [op['match']]:
+        sid = r.get('ID' if table == 'uczniowie' else 'Uczen_ID')
+        month = r.get(month_col)
+        keys.add((str(month)[:7] if month_col and month else None, int(sid) if sid is not None else None))
+    return keys
+
+def build_rollup(tenant_id, df_students, months, student_ids=None):
+    """Wiersze zestawienia dla miesięcy 'YYYY-MM' (opcjonalnie tylko dla wybranych uczniów).
+    Miesiące zamknięte biorą plan ze snapshotów, otwarte z rozwinięcia planu lekcji."""
+    if student_ids is not None: df_students = df_students[df_students['ID'].isin(student_ids)]
+    students = df_students.drop_duplicates('ID').set_index('ID')
+    snaps = load_snapshots(tenant_id)
+    closed = snaps[snaps['Miesiac'].isin(months)]
+    if student_ids is not None: closed = closed[closed['Uczen_ID'].isin(student_ids)]
+    open_months = sorted(set(months) - closed_month_keys(snaps[snaps['Miesiac'].isin(months)]))
+    parts = []
+
+    if open_months and not df_students.empty:
+        lessons = get_predicted_lessons(df_students, pd.Timestamp(open_months[0]).date(), month_bounds(pd.Timestamp(open_months[-1]).date())[1])
+        lessons = lessons[lessons['Data'].dt.strftime('%Y-%m').isin(open_months)]
+        travel, tuition = lesson_travel_split(lessons, df_students)
+        parts.append(pd.DataFrame({
+            'Miesiac': lessons['Data'].dt.strftime('%Y-%m').to_numpy(), 'Uczen_ID': lessons['Uczen_ID'].to_numpy(),
+            'Tryb_platnosci': lessons['Uczen_ID'].map(students['Tryb_platnosci']).astype(object).to_numpy(),
+            'Typ': lessons['Typ'].astype(str).to_numpy(), 'Plan': lessons['Stawka'].to_numpy(), 'Plan_edukacja': tuition, 'Plan_dojazd': travel
+        }))
+    if not closed.empty:
+        # Snapshot trzyma plan ucznia łącznie i część abonamentową - dzielimy go na wiersze Stała / Dodatkowa
+        abon = closed['Plan_abonament'].where(closed['Tryb_platnosci'] == 'Miesięcznie', closed['Plan']).to_numpy()
+        for typ, amount in (('Stała', abon), ('Dodatkowa', closed['Plan'].to_numpy() - abon)):
+            share = np.divide(amount, closed['Plan'].to_numpy(), out=np.zeros_like(amount), where=closed['Plan'].to_numpy() != 0)
+            parts.append(pd.DataFrame({
+                'Miesiac': closed['Miesiac'].to_numpy(), 'Uczen_ID': closed['Uczen_ID'].to_numpy(),
+                'Tryb_platnosci': closed['Tryb_platnosci'].astype(object).to_numpy(), 'Typ': typ, 'Plan': amount,
+                'Plan_edukacja': amount - closed['Plan_dojazd'].to_numpy() * share, 'Plan_dojazd': closed['Plan_dojazd'].to_numpy() * share
+            }))
+    rec = load_settlements(tenant_id)
+    rec = rec[rec['Okres'].astype(str).str.slice(0, 7).isin(months)]
+    if student_ids is not None: rec = rec[rec['Uczen_ID'].isin(student_ids)]
+    if not rec.empty:
+        parts.append(pd.DataFrame({
+            'Miesiac': rec['Okres'].astype(str).str.slice(0, 7).to_numpy(), 'Uczen_ID': rec['Uczen_ID'].to_numpy(),
+            'Tryb_platnosci': rec['Uczen_ID'].map(students['Tryb_platnosci']).astype(object).to_numpy(),
+            # Okres dłuższy niż 'YYYY-MM' to pojedyncza lekcja, krótszy - opłata za miesiąc
+            'Typ': np.where(rec['Okres'].astype(str).str.len() > 7, 'Dodatkowa', 'Stała'),
+            'Wplacono': pd.to_numeric(rec['Wplacono'], errors='coerce').fillna(0.0).to_numpy()
+        }))
+    if not parts: return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    rows = pd.concat(parts, ignore_index=True).reindex(columns=ROLLUP_COLUMNS)
+    rows[ROLLUP_COLUMNS[4:]] = rows[ROLLUP_COLUMNS[4:]].astype('float64').fillna(0.0)
+    rows['Tryb_platnosci'] = rows['Tryb_platnosci'].fillna('')
+    return rows.groupby(ROLLUP_KEYS, as_index=False)[ROLLUP_COLUMNS[4:]].sum()[ROLLUP_COLUMNS]
+
+@st.cache_resource
+def rollup_store(tenant_id):
+    return {'frame': pd.DataFrame(columns=ROLLUP_COLUMNS), 'months': set(), 'dirty': set(), 'version': None, 'lock': threading.Lock()}
+
+def invalidate_rollup(tenant_id, keys):
+    store = rollup_store(tenant_id)
+    with store['lock']: store['dirty'] |= keys
+
+def monthly_rollup(tenant_id, months):
+    """Wiersze zestawienia dla miesięcy 'YYYY-MM'; przelicza tylko brakujące miesiące i klucze oznaczone po zapisach."""
+    store = rollup_store(tenant_id)
+    with store['lock']:
+        df_students = load_data(tenant_id)
+        version = data_version(tenant_id, 'wszystko')
+        dirty, frame = store['dirty'], store['frame']
+        if (None, None) in dirty or (store['version'] not in (None, version) and not dirty):
+            frame, store['months'], dirty = frame.iloc[0:0], set(), set()
+        parts = [frame]
+        if dirty:
+            cached = sorted(store['months'])
+            whole_months = {m for m, sid in dirty if sid is None}
+            per_student = {}
+            for m, sid in dirty:
+                if sid is not None and m not in whole_months:
+                    per_student.setdefault(sid, set()).update([m] if m is not None else cached)
+            stale = frame['Miesiac'].isin(whole_months)
+            for sid, ms in per_student.items():
+                stale |= (frame['Uczen_ID'] == sid) & frame['Miesiac'].isin(ms)
+            parts = [frame[~stale]]
+            if whole_months & store['months']: parts.append(build_rollup(tenant_id, df_students, sorted(whole_months & store['months'])))
+            for sid, ms in per_student.items():
+                if ms & store['months']: parts.append(build_rollup(tenant_id, df_students, sorted(ms & store['months']), [sid]))
+        missing = sorted(set(months) - store['months'])
+        if missing: parts.append(build_rollup(tenant_id, df_students, missing))
+        store['frame'] = pd.concat([p for p in parts if not p.empty], ignore_index=True) if any(not p.empty for p in parts) else frame.iloc[0:0]
+        store['months'] |= set(missing)
+        store['dirty'], store['version'] = set(), version
+        return store['frame'][store['frame']['Miesiac'].isin(months)]
+
+# --- SCENARIUSZE "CO JEŚLI" (PROGNOZA PRZYCHODÓW) ---
+# Bazowy plan lekcji rozwijany jest raz; każdy scenariusz to tylko inne parametry nałożone na macierze
+# S scenariuszy × L lekcji, a przychód miesięczny to iloczyn macierzowy z macierzą przynależności lekcji do miesięcy.
+
+@st.cache_data(ttl=60)
+def scenario_baseline(tenant_id, start_date, end_date, version):
+    """Plan lekcji w okresie jako tablice numpy: dzień, miesiąc, uczeń, godziny, edukacja, dojazd (version = wersja grafiku)."""
+    df = load_data(tenant_id)
+    lessons = get_predicted_lessons(df, start_date, end_date)
+    travel, tuition = lesson_travel_split(lessons, df)
+    months = pd.period_range(start_date, end_date, freq='M')
+    return {
+        'day': ((lessons['Data'] - pd.Timestamp(start_date)).dt.days).to_numpy(dtype='int64'),
+        'month': lessons['Data'].dt.to_period('M').map({m: i for i, m in enumerate(months)}).to_numpy(dtype='int64'),
+        'student': lessons['Uczen_ID'].to_numpy(dtype='int64'),
+        'hours': lessons['Czas'].to_numpy(dtype='float64'),
+        'tuition': tuition.astype('float64'), 'travel': travel.astype('float64'),
+        'months': [f"{MIESIACE_PL[m.month]} {m.year}" for m in months], 'start': pd.Timestamp(start_date),
+        'n_days': (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1,
+    }
+
+def run_scenarios(base, params, n_scenarios=1000, seed=0):
+    """Przychód miesięczny (S × M) dla n_scenarios losowanych scenariuszy.
+    params: rate_delta (min, max) zł/h od rate_from; travel_delta (min, max) zł za lekcję z dojazdem od travel_from;
+    dropout_ids, dropout_p, dropout_from - uczniowie, którzy z prawdopodobieństwem p kończą zajęcia;
+    extra_days - oczekiwana liczba dodatkowych dni wolnych od holidays_from."""
+    rng = np.random.default_rng(seed)
+    S, L, M = n_scenarios, len(base['day']), len(base['months'])
+    if L == 0: return np.zeros((S, M))
+    day_of = lambda d: (pd.Timestamp(d) - base['start']).days
+    day = base['day']
+
+    rate = rng.uniform(*params.get('rate_delta', (0.0, 0.0)), size=(S, 1))
+    rate_on = (day >= day_of(params.get('rate_from', base['start'])))[None, :]
+    trav = rng.uniform(*params.get('travel_delta', (0.0, 0.0)), size=(S, 1))
+    trav_on = ((day >= day_of(params.get('travel_from', base['start']))) & (base['travel'] > 0))[None, :]
+    revenue = base['tuition'] + rate * base['hours'] * rate_on + np.maximum(base['travel'] + trav * trav_on, 0.0)
+
+    active = np.ones((S, L), dtype=bool)
+    ids = np.unique(np.asarray(params.get('dropout_ids', []), dtype='int64'))
+    if len(ids) and params.get('dropout_p', 0) > 0:
+        dropped = rng.random((S, len(ids))) < params['dropout_p']
+        col = np.searchsorted(ids, base['student']).clip(max=len(ids) - 1)
+        late = np.isin(base['student'], ids) & (day >= day_of(params.get('dropout_from', base['start'])))
+        active &= ~(dropped[:, col] & late[None, :])
+    holidays_from = max(day_of(params.get('holidays_from', base['start'])), 0)
+    free_days = base['n_days'] - holidays_from
+    if params.get('extra_days', 0) > 0 and free_days > 0:
+        off = rng.random((S, free_days)) < params['extra_days'] / free_days
+        late = day >= holidays_from
+        active[:, late] &= ~off[:, day[late] - holidays_from]
+
+    onehot = np.zeros((L, M))
+    onehot[np.arange(L), base['month']] = 1.0
+    return np.maximum(revenue, 0.0) * active @ onehot
+
+def scenario_summary(base, monthly):
+    """Rozkład przychodu per miesiąc (P10/P50/P90, średnia) obok planu bazowego."""
+    plan = np.bincount(base['month'], weights=base['tuition'] + base['travel'], minlength=len(base['months']))
+    q = np.percentile(monthly, [10, 50, 90], axis=0)
+    return pd.DataFrame({'Miesiąc': base['months'], 'Plan': plan, 'P10': q[0], 'P50': q[1], 'P90': q[2], 'Średnia': monthly.mean(axis=0)})
+
+# --- EKSPORT DANYCH (CSV / PARQUET, PORCJAMI) ---
+# Każdy eksport to generator ramek (miesiąc po miesiącu), zapisywanych od razu do pliku tymczasowego -
+# wieloletni eksport nie jest nigdy w całości w pamięci jako ramka. Schemat pliku jest zadeklarowany z góry
+# (EXPORT_SCHEMAS), a nie zgadywany z pierwszej porcji - kolumna pusta w pierwszym miesiącu nie psuje Parquet.
+
+EXPORT_CHUNK_ROWS = 5000
+
+def export_months(start_date, end_date):
+    m_ptr = start_date.replace(day=1)
+    while m_ptr <= end_date:
+        m_start, m_end = month_bounds(m_ptr)
+        yield max(m_start, start_date), min(m_end, end_date)
+        m_ptr += relativedelta(months=1)
+
+def export_lessons(df_students, start_date, end_date):
+    """Rozwinięte lekcje (po odwołaniach i dniach wolnych, z dodatkowymi) z podziałem na edukację i dojazd."""
+    labels = student_labels(df_students)
+    for m_start, m_end in export_months(start_date, end_date):
+        lessons = get_lessons_in_period(df_students, m_start, m_end)
+        if lessons.empty: continue
+        travel, tuition = lesson_travel_split(lessons, df_students)
+        yield pd.DataFrame({
+            'Data': lessons['Data'].dt.strftime('%Y-%m-%d'), 'Godzina': minutes_to_time_str(lessons['Minuty']).to_numpy(),
+            'Uczen_ID': lessons['Uczen_ID'], 'Uczen': lessons['Uczen_ID'].map(labels), 'Typ': lessons['Typ'].astype(str),
+            'Czas': lessons['Czas'].astype('float64'), 'Kwota': lessons['Stawka'].astype('float64'),
+            'Edukacja': tuition, 'Dojazd': travel})
+
+def export_settlements(df_students, start_date, end_date):
+    """Zapisane rozliczenia, których okres (miesiąc albo dzień lekcji) mieści się w zakresie."""
+    labels = student_labels(df_students)
+    rec = load_settlements(current_tenant())
+    okres = rec['Okres'].astype(str)
+    rec = rec[(okres.str.slice(0, 7) >= start_date.strftime('%Y-%m')) & (okres.str.slice(0, 7) <= end_date.strftime('%Y-%m'))].sort_values('Okres')
+    for i in range(0, len(rec), EXPORT_CHUNK_ROWS):
+        part = rec.iloc[i:i + EXPORT_CHUNK_ROWS]
+        yield pd.DataFrame({'Okres': part['Okres'].astype(str), 'Uczen_ID': part['Uczen_ID'], 'Uczen': part['Uczen_ID'].map(labels),
+                            'Kwota_Wymagana': part['Kwota_Wymagana'], 'Wplacono': part['Wplacono']})
+
+def export_breakdowns(df_students, start_date, end_date):
+    """Pozycje rachunków miesięcznych uczniów aktywnych w miesiącu, jak przy zamykaniu (zamknięte miesiące ze snapshotów)."""
+    labels = student_labels(df_students)
+    snaps = load_snapshots(current_tenant())
+    for m_ptr, _ in export_months(start_date, end_date):
+        m_start, m_end = month_bounds(m_ptr.replace(day=1))
+        m_str = m_start.strftime('%Y-%m')
+        frozen = snaps[snaps['Miesiac'] == m_str].set_index('Uczen_ID')['Pozycje']
+        active = month_students(df_students, m_start, m_end, get_predicted_lessons(df_students, m_start, m_end))
+        rows = []
+        for sid in df_students.loc[df_students['ID'].isin(active['ID']) | df_students['ID'].isin(frozen.index), 'ID']:
+            details = frozen[sid] if sid in frozen.index else calculate_monthly_breakdown(df_students, sid, m_start)[1]
+            rows += [{'Miesiac': m_str, 'Uczen_ID': sid, 'Uczen': labels[sid], 'Opis': d['Opis'], 'Kwota': float(d['Kwota']), 'Typ': d['Typ']} for d in details]
+        if rows: yield pd.DataFrame(rows)
+
+def export_plan_vs_actual(df_students, start_date, end_date):
+    """Plan (z dojazdem) a wpłaty - miesiąc × uczeń."""
+    labels = student_labels(df_students)
+    rec = load_settlements(current_tenant())
+    paid = rec.assign(Miesiac=rec['Okres'].astype(str).str.slice(0, 7)).groupby(['Miesiac', 'Uczen_ID'])['Wplacono'].sum()
+    for m_start, _ in export_months(start_date, end_date):
+        m_start = m_start.replace(day=1)
+        m_str = m_start.strftime('%Y-%m')
+        plan = plan_summary(df_students, *month_bounds(m_start))['per_student']
+        m_paid = paid.xs(m_str, level='Miesiac') if m_str in paid.index.get_level_values('Miesiac') else pd.Series(dtype='float64')
+        ids = plan.index.union(m_paid.index)
+        if ids.empty: continue
+        out = pd.DataFrame({'Miesiac': m_str, 'Uczen_ID': ids, 'Uczen': ids.map(labels),
+                            'Plan': plan['Kwota'].reindex(ids).fillna(0.0).to_numpy(), 'Plan_dojazd': plan['Dojazd'].reindex(ids).fillna(0.0).to_numpy(),
+                            'Wplacono': m_paid.reindex(ids).fillna(0.0).to_numpy()})
+        out['Roznica'] = out['Wplacono'] - out['Plan']
+        yield out
+
+EXPORTS = {"Lekcje": export_lessons, "Rozliczenia": export_settlements,
+           "Rachunki miesięczne": export_breakdowns, "Plan vs wpłaty": export_plan_vs_actual}
+_student = [('Uczen_ID', pa.int64()), ('Uczen', pa.string())]
+EXPORT_SCHEMAS = {
+    "Lekcje": pa.schema([('Data', pa.string()), ('Godzina', pa.string())] + _student + [('Typ', pa.string()), ('Czas', pa.float64()),
+                        ('Kwota', pa.float64()), ('Edukacja', pa.float64()), ('Dojazd', pa.float64())]),
+    "Rozliczenia": pa.schema([('Okres', pa.string())] + _student + [('Kwota_Wymagana', pa.float64()), ('Wplacono', pa.float64())]),
+    "Rachunki miesięczne": pa.schema([('Miesiac', pa.string())] + _student + [('Opis', pa.string()), ('Kwota', pa.float64()), ('Typ', pa.string())]),
+    "Plan vs wpłaty": pa.schema([('Miesiac', pa.string())] + _student + [('Plan', pa.float64()), ('Plan_dojazd', pa.float64()),
+                                ('Wplacono', pa.float64()), ('Roznica', pa.float64())]),
+}
+
+def write_export(chunks, fmt, schema):
+    """Zapisuje porcje do pliku tymczasowego (CSV albo Parquet o schemacie `schema`); zwraca (zawartość pliku,
+    liczba wierszy). Plik tymczasowy jest usuwany od razu po odczycie."""
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    rows, writer = 0, pq.ParquetWriter(path, schema) if fmt == "parquet" else None
+    try:
+        for chunk in chunks:
+            chunk = chunk[schema.names]
+            if writer is None: chunk.to_csv(path, mode='a', header=rows == 0, index=False)
+            else: writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+        if writer is not None: writer.close()
+        elif rows == 0: pd.DataFrame(columns=schema.names).to_csv(path, index=False)
+        with open(path, "rb") as f: return f.read(), rows
+    finally:
+        os.remove(path)
+
+# --- WYSZUKIWANIE UCZNIÓW (INDEKS LISTY) ---
+# Lista indeksowana raz na odświeżenie danych: posortowane tokeny (imię, nazwisko, szkoła, klasa, telefon)
+# dają wyszukiwanie po prefiksie przez np.searchsorted, a wspólny napis - wyszukiwanie fragmentu.
+PICKER_LIMIT = 100
+
+@st.cache_data(ttl=60)
+def roster_index(tenant_id):
+    df_students = load_data(tenant_id).drop_duplicates('ID')
+    text = lambda col: df_students[col].astype(object).fillna('').astype(str).str.strip()
+    name = text('Imie') + ' ' + text('Nazwisko')
+    school = (text('Szkola') + ' ' + text('Klasa')).str.strip()
+    label = name + np.where(school != '', ' · ' + school, '')
+    # Ta sama etykieta u kilku uczniów - dopisujemy ID, żeby dało się ich odróżnić
+    label = label.where(~label.duplicated(keep=False), label + ' (ID ' + df_students['ID'].astype(str) + ')')
+    roster = pd.DataFrame({
+        'ID': df_students['ID'].to_numpy(), 'Etykieta': label.to_numpy(),
+        'Szukaj': (name + ' ' + school + ' ' + text('Nr_tel').str.replace(r'\D', '', regex=True)).str.lower().to_numpy(),
+        'Data_rozp': df_students['Data_rozp'].to_numpy(), 'Data_zak': df_students['Data_zak'].to_numpy()
+    }).sort_values('Etykieta', key=lambda c: c.str.lower(), kind='stable').reset_index(drop=True)
+    tokens = roster['Szukaj'].str.split().explode().dropna()
+    order = np.argsort(tokens.to_numpy(dtype=str), kind='stable')
+    return {'roster': roster, 'tokens': tokens.to_numpy(dtype=str)[order], 'token_rows': tokens.index.to_numpy()[order]}
+
+def search_roster(index, query, active_on=None):
+    """Uczniowie pasujący do wszystkich słów zapytania, najpierw trafienia po prefiksie tokenu (z indeksu);
+    gdy tych jest mniej niż PICKER_LIMIT, dochodzą dopasowania fragmentu napisu (skan listy).
+    active_on zawęża do uczniów z Data_rozp <= dzień <= Data_zak."""
+    roster, words = index['roster'], query.lower().split()
+    active = np.ones(len(roster), dtype=bool)
+    if active_on is not None:
+        day = pd.Timestamp(active_on)
+        active &= ~(roster['Data_rozp'] > day).to_numpy() & ~(roster['Data_zak'] < day).to_numpy()
+    prefix = active.copy()
+    for word in words:
+        lo, hi = np.searchsorted(index['tokens'], [word, word + '\uffff'])
+        match = np.zeros(len(roster), dtype=bool)
+        match[index['token_rows'][lo:hi]] = True
+        prefix &= match
+    if prefix.sum() >= PICKER_LIMIT: return roster[prefix]
+    hits = active
+    for word in words:
+        rows = np.flatnonzero(hits)
+        hits[rows] = roster['Szukaj'].iloc[rows].str.contains(word, regex=False).to_numpy()
+    return roster[hits].iloc[np.argsort(~prefix[hits], kind='stable')]
+
+# --- FRAGMENTY UI (ODŚWIEŻANE NIEZALEŻNIE OD RESZTY STRONY) ---
+# Interakcja z widżetem wewnątrz fragmentu uruchamia ponownie tylko ten fragment.
+# Dane czytamy przez loadery (cache), a po zapisie st.rerun() odświeża całą aplikację.
+
+@st.cache_data(ttl=60)
+def calendar_events(tenant_id):
+    return generate_calendar_events(load_data(tenant_id)) + holiday_events(load_holidays(tenant_id))
+
+# Indeks trzymany jako zasób (bez kopiowania przy każdym odczycie) - tylko do odczytu, przebudowa po zapisie
+@st.cache_resource(ttl=60)
+def lesson_index(tenant_id):
+    df_students, today = load_data(tenant_id), date.today()
+    horizon = timedelta(days=CONFLICT_HORIZON_DAYS)
+    return LessonIndex(get_lessons_in_period(df_students, today - horizon, today + horizon), df_students)
+
+def use_slot(slot):
+    """Callback: wstawia wybrany wolny termin do pól lekcji dodatkowej (przed ponownym narysowaniem widżetów)."""
+    st.session_state["extra_date"] = slot['Data']
+    st.session_state["extra_time"] = time(*map(int, slot['Godzina'].split(':')))
+
+def student_picker(label, key):
+    """Wybór ucznia z wyszukiwarką; zwraca ID (opcjami są ID, więc uczniowie o tym samym nazwisku się nie sklejają)
+    albo None, gdy nikt nie pasuje do zapytania."""
+    index = roster_index(TENANT)
+    c_q, c_a = st.columns([3, 1])
+    query = c_q.text_input(f"🔎 {label}", key=f"{key}_q", placeholder="imię, nazwisko, szkoła, klasa, telefon")
+    active = c_a.checkbox("Tylko aktywni", key=f"{key}_active")
+    found = search_roster(index, query, date.today() if active else None)
+    if found.empty:
+        st.info("Brak uczniów pasujących do wyszukiwania."); return None
+    if len(found) > PICKER_LIMIT: st.caption(f"Pokazano {PICKER_LIMIT} z {len(found)} - zawęź wyszukiwanie.")
+    found = found.head(PICKER_LIMIT)
+    # Wybór spoza nowych wyników przechodzi na pierwsze trafienie
+    if st.session_state.get(key) not in set(found['ID']): st.session_state.pop(key, None)
+    return st.selectbox(label, found['ID'].tolist(), format_func=dict(zip(found['ID'], found['Etykieta'])).get, key=key, label_visibility="collapsed")
+
+def conflict_warning(clashes, key):
+    """Ostrzeżenie o kolizjach przed zapisem - zapis wymaga wtedy potwierdzenia. True = można zapisać."""
+    if clashes.empty: return True
+    st.warning(f"⚠️ Termin koliduje z innymi zajęciami ({len(clashes)}).")
+    st.dataframe(clashes, hide_index=True, use_container_width=True)
+    return st.checkbox("Zapisz mimo kolizji", key=key)
+
+@st.fragment
+def calendar_section():
+    df, df_extra = load_data(TENANT), load_extra(TENANT)
+    calendar_options = {
+        "editable": "true", "locale": "pl", "firstDay": 1,
+        "headerToolbar": {"left": "prev,next today", "center": "title", "right": "dayGridMonth,timeGridWeek"},
+        "buttonText": {"today": "Dziś", "month": "Miesiąc", "week": "Tydzień", "day": "Dzień"},
+        "slotMinTime": SLOT_MIN_TIME, "slotMaxTime": SLOT_MAX_TIME, "allDaySlot": False,
+        "eventTimeFormat": {"hour": "2-digit", "minute": "2-digit", "hour12": False}
+    }
+    events = calendar_events(TENANT)
+    cal_state = calendar(events=events, options=calendar_options)
+    
+    if cal_state.get("eventClick") and "Uczen_ID" in cal_state["eventClick"]["event"].get("extendedProps", {}):
+        props = cal_state["eventClick"]["event"]["extendedProps"]
+        st.divider()
+        st.subheader(f"Zarządzanie: {props['Imie']} {props['Nazwisko']} ({props['Data']})")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.info(f"Typ: {props['Typ']} | Czas: {props.get('Czas', 1.0)}h | Stawka: {props['Stawka']} zł")
+        with col2:
+            tab_edit, tab_del = st.tabs(["✏️ Edytuj", "🗑️ Usuń / Odwołaj"])
             
-            events.append({
-                "title": f"{l['Imie']} {l['Nazwisko']}",
-                "start": start_time.isoformat(), "end": end_time.isoformat(),
-                "backgroundColor": color, "borderColor": color,
-                "extendedProps": {
-                    "Uczen_ID": l['Uczen_ID'], "Typ": typ, "Data": l['Data'].strftime("%Y-%m-%d"),
-                    "Godzina": str(l['Godzina']), "Stawka": l['Stawka'], "Imie": l['Imie'],
-                    "Nazwisko": l['Nazwisko'], "Czas": duration_hours
-                }
-            })
-        except: pass
-    return events
+            with tab_edit:
+                c_e1, c_e2 = st.columns(2)
+                new_rate = c_e1.number_input("Nowa stawka (Total)", value=float(props['Stawka']))
+                new_dur = c_e2.number_input("Nowy czas (h)", value=float(props.get('Czas', 1.0)), step=0.25)
+                
+                if st.button("Zapisz zmiany"):
+                    with UnitOfWork() as uow:
+                        if props['Typ'] == 'Stała':
+                            uow.insert("odwolane", pd.DataFrame([{
+                                'Uczen_ID': props['Uczen_ID'], 'Data': props['Data'], 'Powod': 'Edycja (Zmiana stawki)'
+                            }]))
+                            uow.insert("dodatkowe", pd.DataFrame([{
+                                'Uczen_ID': props['Uczen_ID'], 'Data': props['Data'], 'Godzina': props['Godzina'],
+                                'Stawka': new_rate, 'Typ': 'Edytowana', 'Czas': new_dur, 'Status': 'Zaplanowana'
+                            }]))
+                        else:
+                            mask = (df_extra['Uczen_ID'] == props['Uczen_ID']) & (df_extra['Data'] == pd.Timestamp(props['Data'])) & (df_extra['Minuty'] == time_to_minutes([props['Godzina']])[0])
+                            if mask.any():
+                                uow.upsert("dodatkowe", df_extra[mask].head(1).assign(Stawka=new_rate, Czas=new_dur))
+                    st.success("Zapisano!"); st.rerun()
+
+            with tab_del:
+                if props['Typ'] == 'Stała':
+                    powod_del = st.radio("Kto zawinił?", POWODY_ODWOLANIA[:3], key="del_reason_click")
+                    if st.button("❌ Odwołaj zajęcia"):
+                        with UnitOfWork() as uow:
+                            uow.insert("odwolane", pd.DataFrame([{'Uczen_ID': props['Uczen_ID'], 'Data': props['Data'], 'Powod': powod_del}]))
+                            if "Święto" not in powod_del:
+                                lesson = {props['Uczen_ID']: (1, float(props.get('Czas', 1.0)))}
+                                if powod_del == "Wina Ucznia": uow.record("Nieobecność", lesson)
+                                uow.record("Do odrobienia", lesson)
+                        st.success("Odwołano."); st.rerun()
+                else:
+                    if st.button("🗑️ Usuń z kalendarza"):
+                        mask = (df_extra['Uczen_ID'] == props['Uczen_ID']) & (df_extra['Data'] == pd.Timestamp(props['Data'])) & (df_extra['Minuty'] == time_to_minutes([props['Godzina']])[0])
+                        if mask.any():
+                            with UnitOfWork() as uow:
+                                uow.delete("dodatkowe", id=df_extra.loc[mask, 'id'].iloc[0], Uczen_ID=props['Uczen_ID'])
+                                if props['Typ'] == 'Odrabianie':
+                                    uow.record("Cofnięte odrabianie", {props['Uczen_ID']: (1, float(props.get('Czas', 1.0)))})
+                            if props['Typ'] == 'Odrabianie': st.toast("Cofnięto status odrabiania.")
+                        st.success("Usunięto."); st.rerun()
+
+@st.fragment
+def schedule_editor(student_row):
+    selected_id = student_row['ID']
+    df_schedule = load_schedule(TENANT)
+    st.caption("Tutaj możesz zmienić dzień/godzinę zajęć w czasie.")
+    s_sch = df_schedule[df_schedule['Uczen_ID'] == selected_id].copy()
+    c_h1, c_h2, c_h3, c_h4, c_h8, c_h5, c_h6, c_h7 = st.columns([2, 2, 1.5, 1.5, 1.5, 2, 2, 1])
+    new_day = c_h1.selectbox("Dzień", list(DNI_MAPA.keys()), key="ns_d")
+    new_hour = c_h2.time_input("Godz", time(16,0), key="ns_t")
+    new_dur = c_h3.number_input("h", 0.5, 3.0, 1.0, 0.25, key="ns_dur")
+    new_rate_val = float(student_row['Stawka'])
+    new_rate = c_h4.number_input("Stawka", value=new_rate_val, key="ns_rate")
+    new_every = c_h8.number_input("Co ile tyg.", 1, 8, 1, key="ns_every", help="1 = co tydzień, 2 = co dwa tygodnie...")
+    new_start = c_h5.date_input("Od", date.today(), key="ns_od")
+    new_end = c_h6.date_input("Do", date(2026, 6, 26), key="ns_do")
+    new_sch_entry = pd.DataFrame([{
+        'Uczen_ID': selected_id, 'Dzien_tyg': new_day, 'Godzina': new_hour, 
+        'Czas_trwania': new_dur, 'Data_od': new_start, 'Data_do': new_end,
+        'Stawka': new_rate, 'Interwal': new_every
+    }])
+    df_students = load_data(TENANT)
+    new_lessons = drop_holidays(expand_schedule(df_students, normalize_table(new_sch_entry, 'harmonogram'), new_start, new_end),
+                                df_students, load_holidays(TENANT))
+    confirmed = conflict_warning(lesson_conflicts(lesson_index(TENANT), new_lessons, df_students), key="ns_conflict_ok")
+    if c_h7.button("➕", help="Dodaj nowy okres", disabled=not confirmed):
+        UnitOfWork().insert("harmonogram", new_sch_entry).commit(); st.rerun()
+
+    if not s_sch.empty:
+        s_sch['Godzina'] = [time(m // 60, m % 60) for m in s_sch['Minuty']]
+        s_sch['Data_od'] = s_sch['Data_od'].dt.date
+        s_sch['Data_do'] = s_sch['Data_do'].dt.date
+        s_sch['Wyjatki'] = s_sch['Wyjatki'].fillna('').astype(str)
+        s_sch = s_sch.drop(columns=DERIVED_COLUMNS, errors='ignore')
+
+        edited_sch = st.data_editor(
+            s_sch, 
+            column_config={
+                "id": None, "Uczen_ID": None,
+                "Dzien_tyg": st.column_config.SelectboxColumn("Dzień", options=list(DNI_MAPA.keys()), required=True),
+                "Godzina": st.column_config.TimeColumn("Godzina", required=True),
+                "Czas_trwania": st.column_config.NumberColumn("Czas (h)", min_value=0.5, max_value=4.0, step=0.25),
+                "Stawka": st.column_config.NumberColumn("Stawka (zł/h)", min_value=0.0, step=5.0),
+                "Data_od": st.column_config.DateColumn("Od", required=True),
+                "Data_do": st.column_config.DateColumn("Do", required=True),
+                "Interwal": st.column_config.NumberColumn("Co ile tyg.", min_value=1, max_value=8, step=1),
+                "Liczba": st.column_config.NumberColumn("Liczba lekcji", min_value=0, step=1, help="0 = bez limitu (do daty końca)"),
+                "Wyjatki": st.column_config.TextColumn("Wyjątki", help="Pominięte daty RRRR-MM-DD rozdzielone ';'")
+            },
+            hide_index=True, use_container_width=True, key="sch_editor"
+        )
+        if st.button("Zapisz zmiany w planie"):
+            UnitOfWork().upsert("harmonogram", edited_sch).commit(); st.success("Plan zaktualizowany!"); st.rerun()
+    else: st.warning("Brak zdefiniowanego planu.")
+
+# Rejestr wpłat: ostatnie miesiące stronicowane, starsze zwinięte do podsumowań miesięcznych
+REGISTER_PAGE_SIZE = 20
+REGISTER_RECENT_MONTHS = 2
+
+def changed_payments(before, after):
+    """Wiersze edytora, w których zmieniono kwotę wpłaty (tylko one idą do zapisu)."""
+    diff = after['Ile wpłacono'].fillna(0).to_numpy() != before['Ile wpłacono'].fillna(0).to_numpy()
+    return after[diff]
+
+def register_editor(rows, key):
+    return st.data_editor(rows, column_config={"ID Okresu": None, "Termin": st.column_config.TextColumn(disabled=True), "Kwota do zapłaty": st.column_config.NumberColumn(format="%.2f zł", disabled=True), "Ile wpłacono": st.column_config.NumberColumn(format="%.2f zł", min_value=0, step=10)}, hide_index=True, use_container_width=True, key=key, num_rows="fixed")
+
+@st.fragment
+def payment_register(selected_id):
+    table_data = payment_rows(TENANT, selected_id, data_version(TENANT, 'wszystko'))
+    st.subheader("💳 Rejestr wpłat")
+    if not table_data: st.info("Brak danych."); return
+    df_reg = pd.DataFrame(table_data)
+    month = df_reg['ID Okresu'].str.slice(0, 7)
+    cutoff = (date.today().replace(day=1) - relativedelta(months=REGISTER_RECENT_MONTHS - 1)).strftime("%Y-%m")
+    recent, older = df_reg[month >= cutoff], df_reg[month < cutoff]
+    changes = []
+
+    if not recent.empty:
+        pages = (len(recent) - 1) // REGISTER_PAGE_SIZE + 1
+        page = st.number_input(f"Strona (z {pages})", 1, pages, 1, key=f"reg_page_{selected_id}") if pages > 1 else 1
+        page_rows = recent.iloc[(page - 1) * REGISTER_PAGE_SIZE:page * REGISTER_PAGE_SIZE]
+        changes.append(changed_payments(page_rows, register_editor(page_rows, f"edit_{selected_id}_{page}")))
+
+    if not older.empty:
+        st.caption("Starsze okresy - podsumowanie miesięczne")
+        summary = older.groupby(month[older.index], sort=False).agg(
+            Pozycji=('ID Okresu', 'size'), Do_zaplaty=('Kwota do zapłaty', 'sum'), Wplacono=('Ile wpłacono', 'sum'))
+        summary['Saldo'] = summary['Wplacono'] - summary['Do_zaplaty']
+        month_label = lambda m: f"{MIESIACE_PL[int(m[5:7])]} {m[:4]}"
+        st.dataframe(summary.rename(index=month_label).rename_axis("Miesiąc").reset_index(), hide_index=True, use_container_width=True,
+                     column_config={"Do_zaplaty": st.column_config.NumberColumn("Do zapłaty", format="%.2f zł"),
+                                    "Wplacono": st.column_config.NumberColumn("Wpłacono", format="%.2f zł"),
+                                    "Saldo": st.column_config.NumberColumn(format="%+.2f zł")})
+        open_month = st.selectbox("Rozwiń miesiąc:", [None] + summary.index.tolist(), format_func=lambda m: "—" if m is None else month_label(m), key=f"reg_month_{selected_id}")
+        if open_month:
+            month_rows = older[month[older.index] == open_month]
+            changes.append(changed_payments(month_rows, register_editor(month_rows, f"edit_{selected_id}_{open_month}")))
+
+    if st.button("💾 Zapisz wpłaty", type="primary"):
+        edited = pd.concat(changes) if changes else df_reg.iloc[:0]
+        if edited.empty: st.info("Brak zmian do zapisania."); return
+        new_rows = pd.DataFrame({'Uczen_ID': selected_id, 'Okres': edited['ID Okresu'], 'Kwota_Wymagana': edited['Kwota do zapłaty'], 'Wplacono': edited['Ile wpłacono']})
+        UnitOfWork().upsert("rozliczenia", new_rows).commit()
+        st.success("Zapisano!"); st.rerun()
+
+@st.fragment
+def month_breakdown(selected_id):
+    df = load_data(TENANT)
+    student_row = df[df['ID'] == selected_id].iloc[0]
+    start_date = student_row['Data_rozp'].date()
+    end_date = student_row['Data_zak'].date()
+    st.subheader("🔍 Szczegóły wyliczeń dla miesiąca (Plan)")
+    month_map = {}
+    iter_date = start_date.replace(day=1)
+    safe_end = end_date if end_date >= start_date else date.today() + relativedelta(years=1)
+    while iter_date <= safe_end:
+        m_label = f"{MIESIACE_PL.get(iter_date.month)} {iter_date.year}"
+        month_map[m_label] = iter_date
+        iter_date += relativedelta(months=1)
+    sorted_opts = sorted(month_map.keys(), key=lambda x: month_map[x], reverse=True)
+    if sorted_opts:
+        sel_month_label = st.selectbox("Wybierz miesiąc do analizy:", sorted_opts)
+        target_date = month_map[sel_month_label]
+        snaps = load_snapshots(TENANT)
+        frozen = snaps[(snaps['Uczen_ID'] == selected_id) & (snaps['Miesiac'] == target_date.strftime("%Y-%m"))]
+        if not frozen.empty:
+            details = [{**d, 'Kwota': float(d['Kwota'])} for d in frozen['Pozycje'].iloc[0]]
+            st.caption("🔒 Miesiąc zamknięty - pozycje z zamrożonego rozliczenia.")
+        else:
+            calc_amount, details = calculate_monthly_breakdown(df, selected_id, target_date)
+        if details:
+            det_df = pd.DataFrame(details)
+            st.dataframe(det_df, hide_index=True, use_container_width=True)
+            sum_info = sum(d['Kwota'] for d in details)
+            st.caption(f"Suma wyliczona z planu (Abonament + Dodatki): **{sum_info:.2f} zł**")
+        else: st.info("Brak pozycji w rachunku.")
+    else: st.info("Brak miesięcy do wyświetlenia.")
+
+@st.fragment
+def monthly_report(start_year, end_year):
+    df = load_data(TENANT)
+    today = date.today()
+    st.subheader("📊 Raport Miesięczny")
+    months_options = []
+    m_ptr = start_year
+    while m_ptr <= end_year:
+        months_options.append(f"{MIESIACE_PL[m_ptr.month]} {m_ptr.year}")
+        m_ptr += relativedelta(months=1)
+    if months_options:
+        curr_month_str = f"{MIESIACE_PL[today.month]} {today.year}"
+        def_idx = months_options.index(curr_month_str) if curr_month_str in months_options else 0
+        sel_month_report = st.selectbox("Wybierz miesiąc do analizy:", months_options, index=def_idx)
+        target_report_date = None
+        m_ptr = start_year
+        while m_ptr <= end_year:
+            if f"{MIESIACE_PL[m_ptr.month]} {m_ptr.year}" == sel_month_report:
+                target_report_date = m_ptr
+                break
+            m_ptr += relativedelta(months=1)
+
+        if target_report_date:
+            r_start = target_report_date.replace(day=1)
+            r_end = r_start + relativedelta(months=1) - timedelta(days=1)
+
+            plan = plan_summary(df, r_start, r_end)
+            plan_total, plan_monthly, plan_single, plan_tuition, plan_travel = plan['total'], plan['monthly'], plan['single'], plan['tuition'], plan['travel']
+
+            st.markdown("#### 🔵 PLAN (Przewidywane)")
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Suma", f"{plan_total:.2f} zł")
+            c2.metric("Edukacja", f"{plan_tuition:.2f} zł")
+            c3.metric("Dojazdy", f"{plan_travel:.2f} zł")
+            c4.caption(f"Abonamenty: {plan_monthly:.2f}\nPojedyncze: {plan_single:.2f}")
+
+            real = summarize_real(monthly_rollup(TENANT, month_keys(r_start, r_end)), df, plan['per_student'])
+            real_total, real_monthly, real_single, real_tuition, real_travel = real['total'], real['monthly'], real['single'], real['tuition'], real['travel']
+
+            st.markdown("#### 🟢 RZECZYWISTOŚĆ (Wpłacone)")
+            r1, r2, r3, r4 = st.columns(4)
+            r1.metric("Suma", f"{real_total:.2f} zł", delta=f"{real_total - plan_total:.2f} zł")
+            r2.metric("Edukacja", f"{real_tuition:.2f} zł")
+            r3.metric("Dojazdy", f"{real_travel:.2f} zł")
+            r4.caption(f"Abonamenty: {real_monthly:.2f}\nPojedyncze: {real_single:.2f}")
+    else: st.info("Brak danych.")
+
+@st.fragment
+def quarterly_report(start_year, end_year):
+    df = load_data(TENANT)
+    today = date.today()
+    st.subheader("📊 Raport Kwartalny")
+    quarter_options = []
+    q_ptr = start_year
+    while q_ptr <= end_year:
+        curr_q = (q_ptr.month - 1) // 3 + 1
+        label_q = f"Q{curr_q} {q_ptr.year}"
+        if not quarter_options or quarter_options[-1]['Label'] != label_q:
+            q_start_month = (curr_q - 1) * 3 + 1
+            q_start_date = date(q_ptr.year, q_start_month, 1)
+            q_end_date = q_start_date + relativedelta(months=3) - timedelta(days=1)
+            quarter_options.append({'Label': label_q, 'Start': q_start_date, 'End': q_end_date})
+        q_ptr += relativedelta(months=1)
+    q_labels = [q['Label'] for q in quarter_options]
+    if q_labels:
+        curr_q_label = f"Q{(today.month - 1) // 3 + 1} {today.year}"
+        def_q_idx = q_labels.index(curr_q_label) if curr_q_label in q_labels else 0
+        sel_q_label = st.selectbox("Wybierz kwartał:", q_labels, index=def_q_idx)
+        sel_q_data = next(q for q in quarter_options if q['Label'] == sel_q_label)
+        if sel_q_data:
+            q_start, q_end = sel_q_data['Start'], sel_q_data['End']
+
+            q_plan = plan_summary(df, q_start, q_end)
+            q_plan_total, q_plan_monthly, q_plan_single, q_plan_tuition, q_plan_travel = q_plan['total'], q_plan['monthly'], q_plan['single'], q_plan['tuition'], q_plan['travel']
+
+            st.markdown("#### 🔵 PLAN KWARTALNY (Przewidywane)")
+            qc1, qc2, qc3, qc4 = st.columns(4)
+            qc1.metric("Suma", f"{q_plan_total:.2f} zł")
+            qc2.metric("Edukacja", f"{q_plan_tuition:.2f} zł")
+            qc3.metric("Dojazdy", f"{q_plan_travel:.2f} zł")
+            qc4.caption(f"Abonamenty: {q_plan_monthly:.2f}\nPojedyncze: {q_plan_single:.2f}")
+
+            q_real = summarize_real(monthly_rollup(TENANT, month_keys(q_start, q_end)), df, q_plan['per_student'])
+            q_real_total, q_real_monthly, q_real_single, q_real_tuition, q_real_travel = q_real['total'], q_real['monthly'], q_real['single'], q_real['tuition'], q_real['travel']
+
+            st.markdown("#### 🟢 RZECZYWISTOŚĆ KWARTALNA (Wpłacone)")
+            qr1, qr2, qr3, qr4 = st.columns(4)
+            qr1.metric("Suma", f"{q_real_total:.2f} zł", delta=f"{q_real_total - q_plan_total:.2f} zł")
+            qr2.metric("Edukacja", f"{q_real_tuition:.2f} zł")
+            qr3.metric("Dojazdy", f"{q_real_travel:.2f} zł")
+            qr4.caption(f"Abonamenty: {q_real_monthly:.2f}\nPojedyncze: {q_real_single:.2f}")
+    else: st.info("Brak danych.")
+
+@st.fragment
+def scenario_forecaster(start_year, end_year):
+    st.subheader("🔮 Scenariusze \"co jeśli\"")
+    with st.expander("Parametry scenariuszy", expanded=False):
+        df = load_data(TENANT)
+        today = date.today()
+        c1, c2 = st.columns(2)
+        rate_delta = c1.slider("Zmiana stawki (zł/h, losowana z przedziału)", -30.0, 50.0, (0.0, 0.0), 1.0, key="sc_rate")
+        rate_from = c2.date_input("Zmiana stawki od", today, key="sc_rate_from")
+        travel_delta = c1.slider("Zmiana kosztu dojazdu (zł/lekcję)", -20.0, 30.0, (0.0, 0.0), 1.0, key="sc_travel")
+        travel_from = c2.date_input("Zmiana dojazdu od", today, key="sc_travel_from")
+        dropout_ids = st.multiselect("Uczniowie, którzy mogą zrezygnować", df['ID'].tolist(), format_func=student_labels(df).get, key="sc_drop")
+        c3, c4 = st.columns(2)
+        dropout_p = c3.slider("Prawdopodobieństwo rezygnacji", 0.0, 1.0, 0.5, 0.05, key="sc_drop_p")
+        dropout_from = c4.date_input("Rezygnacja od", today, key="sc_drop_from")
+        extra_days = c3.number_input("Oczekiwana liczba dodatkowych dni wolnych", 0.0, 60.0, 0.0, 1.0, key="sc_days")
+        n_scenarios = c4.number_input("Liczba scenariuszy", 100, 5000, 1000, 100, key="sc_n")
+    params = {'rate_delta': rate_delta, 'rate_from': rate_from, 'travel_delta': travel_delta, 'travel_from': travel_from,
+              'dropout_ids': dropout_ids, 'dropout_p': dropout_p, 'dropout_from': dropout_from,
+              'extra_days': extra_days, 'holidays_from': today}
+    base = scenario_baseline(TENANT, start_year, end_year, data_version(TENANT, 'grafik'))
+    monthly = run_scenarios(base, params, int(n_scenarios))
+    summary = scenario_summary(base, monthly)
+    totals = np.percentile(monthly.sum(axis=1), [10, 50, 90])
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Plan (Rok)", f"{summary['Plan'].sum():.2f} zł")
+    c2.metric("P10", f"{totals[0]:.2f} zł")
+    c3.metric("P50", f"{totals[1]:.2f} zł", delta=f"{totals[1] - summary['Plan'].sum():.2f} zł")
+    c4.metric("P90", f"{totals[2]:.2f} zł")
+    order = alt.SortField(field='Nr', order='ascending')
+    chart_df = summary.assign(Nr=range(len(summary)))
+    band = alt.Chart(chart_df).mark_area(opacity=0.3, color='#a0c4ff').encode(x=alt.X('Miesiąc:N', sort=order, axis=alt.Axis(title=None, labelAngle=-45)), y=alt.Y('P10:Q', title='Kwota (PLN)'), y2='P90:Q')
+    median = alt.Chart(chart_df).mark_line(point=True, color='#1f77b4').encode(x=alt.X('Miesiąc:N', sort=order), y='P50:Q', tooltip=['Miesiąc', 'Plan', 'P10', 'P50', 'P90'])
+    plan_line = alt.Chart(chart_df).mark_line(strokeDash=[4, 4], color='#28a745').encode(x=alt.X('Miesiąc:N', sort=order), y='Plan:Q')
+    st.altair_chart(band + median + plan_line, use_container_width=True)
+    st.dataframe(summary.round(2), hide_index=True, use_container_width=True)
+
+@st.fragment
+def student_import():
+    st.subheader("📥 Import uczniów z CSV")
+    st.caption("Jeden wiersz = jeden uczeń. Kilka terminów rozdzielaj ';' w kolumnach Dzien_tyg, Godzina i H_w_tygodniu (np. 'Poniedziałek;Czwartek').")
+    st.download_button("Szablon CSV", ",".join(IMPORT_COLUMNS) + "\n", file_name="uczniowie_szablon.csv", key="imp_tpl")
+    uploaded = st.file_uploader("Plik CSV", type=["csv"], key="imp_file")
+    if uploaded is None: return
+    try: raw = pd.read_csv(uploaded, dtype=str, sep=None, engine='python')
+    except Exception as e: st.error(f"Nie udało się odczytać pliku: {e}"); return
+    valid, errors = validate_import(raw)
+    c1, c2 = st.columns(2)
+    c1.metric("Poprawne wiersze", len(valid))
+    c2.metric("Błędne wiersze", len({e['Wiersz'] for e in errors}))
+    if errors:
+        st.dataframe(pd.DataFrame(errors), hide_index=True, use_container_width=True)
+    if not valid.empty:
+        st.dataframe(valid[['Imie', 'Nazwisko', 'Dzien_tyg', 'Godzina', 'Data_rozp', 'Data_zak', 'Stawka', 'Tryb_platnosci']], hide_index=True, use_container_width=True)
+        if st.button(f"Importuj {len(valid)} uczniów", type="primary", key="imp_run"):
+            imported, error = import_students(valid)
+            if error is None: st.success(f"Zaimportowano {imported} uczniów."); st.rerun()
+            st.error(f"Zaimportowano {imported} z {len(valid)} uczniów (pierwsze wiersze pliku, porcje po {IMPORT_CHUNK_ROWS}); "
+                     f"pozostali nie zostali zapisani: {error}")
+
+@st.fragment
+def data_export():
+    st.subheader("📤 Eksport danych")
+    c1, c2, c3, c4 = st.columns([2, 2, 2, 1])
+    dataset = c1.selectbox("Zakres danych", list(EXPORTS.keys()), key="exp_set")
+    exp_od = c2.date_input("Od", date.today().replace(month=1, day=1), key="exp_od")
+    exp_do = c3.date_input("Do", date.today(), key="exp_do")
+    fmt = c4.radio("Format", ["csv", "parquet"], key="exp_fmt")
+    if st.button("Przygotuj plik", key="exp_run"):
+        if exp_do < exp_od: st.error("Data końcowa jest wcześniejsza niż początkowa."); return
+        data, rows = write_export(EXPORTS[dataset](load_data(TENANT), exp_od, exp_do), fmt, EXPORT_SCHEMAS[dataset])
+        st.session_state["export_file"] = (data, f"{dataset.replace(' ', '_').lower()}_{exp_od}_{exp_do}.{fmt}", rows)
+    if st.session_state.get("export_file"):
+        data, name, rows = st.session_state["export_file"]
+        st.download_button(f"⬇️ Pobierz {name} ({rows} wierszy)", data, file_name=name, key="exp_dl")
+
+@st.fragment
+def month_closing():
+    df = load_data(TENANT)
+    snaps = load_snapshots(TENANT)
+    st.subheader("🔒 Zamykanie miesięcy")
+    st.caption("Zamknięcie zamraża kwoty, pozycje rachunku i stan wpłat - późniejsze zmiany planu nie zmieniają historii.")
+    closed = sorted(closed_month_keys(snaps), reverse=True)
+    first = df['Data_rozp'].min()
+    candidates = []
+    if pd.notna(first):
+        m_ptr = first.date().replace(day=1)
+        while m_ptr < date.today().replace(day=1):
+            if m_ptr.strftime("%Y-%m") not in closed: candidates.append(m_ptr)
+            m_ptr += relativedelta(months=1)
+    label = lambda m: f"{MIESIACE_PL[m.month]} {m.year}"
+    c1, c2 = st.columns(2)
+    if candidates:
+        to_close = c1.selectbox("Miesiąc do zamknięcia:", candidates[::-1], format_func=label, key="close_month")
+        if c1.button("🔒 Zamknij miesiąc", key="close_month_btn"):
+            snapshot = build_month_snapshot(df, to_close)
+            if snapshot.empty: st.info("Brak aktywnych uczniów w tym miesiącu.")
+            else:
+                UnitOfWork().upsert("zamkniete_miesiace", snapshot).commit()
+                st.success(f"Zamknięto: {label(to_close)}."); st.rerun()
+    else: c1.info("Brak miesięcy do zamknięcia.")
+    if closed:
+        to_open = c2.selectbox("Zamknięte miesiące:", closed, key="reopen_month")
+        if c2.button("🔓 Otwórz ponownie", key="reopen_month_btn"):
+            UnitOfWork().delete("zamkniete_miesiace", Miesiac=to_open).commit()
+            st.success(f"Otwarto ponownie: {to_open}."); st.rerun()
+
+@st.fragment
+def counter_check():
+    st.subheader("🧮 Liczniki odrabiań")
+    st.caption("Liczniki uczniów są projekcją dziennika zdarzeń (odwołania, umówione i zrealizowane odrabiania). "
+               "Sprawdzenie odtwarza je od zera z całego dziennika i porównuje z tabelą.")
+    if st.button("🔍 Sprawdź liczniki", key="counters_verify"):
+        diff = verify_counters(TENANT)
+        if diff.empty: st.success("Liczniki zgodne z dziennikiem zdarzeń.")
+        else:
+            st.error(f"Niezgodne liczniki: {len(diff)}.")
+            st.dataframe(diff, hide_index=True, use_container_width=True)
+
+@st.fragment
+def memo_stats():
+    st.subheader("⚡ Pamięć wyliczeń")
+    st.caption("Rachunki, plan lekcji i sumy raportów zapamiętane dla bieżącej wersji danych (wspólne dla wszystkich sesji).")
+    stats = billing_memo().stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Wpisy", f"{stats['entries']} / {MEMO_MAX_ENTRIES}")
+    c2.metric("Pamięć", f"{stats['bytes'] / 2**20:.1f} / {MEMO_MAX_BYTES / 2**20:.0f} MB")
+    c3.metric("Trafienia", f"{stats['hit_rate']:.0%}", help=f"{stats['hits']} trafień, {stats['misses']} chybień")
+    c4.metric("Usunięte (LRU)", stats['evictions'])
+    if st.button("🧹 Wyczyść pamięć wyliczeń", key="memo_clear"):
+        billing_memo().clear(); st.rerun(scope="fragment")
+
+# --- KALENDARZ ICS (SUBSKRYPCJA W TELEFONIE) ---
+# Mały serwer HTTP w wątku tła (jeden na proces, st.cache_resource) wystawia grafik jako plik ICS:
+#   /ics/<tenant>/<token>.ics          - wszystkie zajęcia korepetytora
+#   /ics/<tenant>/<uczeń>/<token>.ics  - zajęcia jednego ucznia
+# Token to HMAC z osobnego sekretu [ics] secret (bez niego serwer się nie uruchamia). Treść jest cache'owana per
+# wersja danych (hash wczytanych tabel) i dzień (okno zajęć liczone od dziś), a ETag / Last-Modified pozwalają
+# aplikacjom kalendarza dostać 304 bez przeliczania czegokolwiek. Domyślnie serwer słucha tylko lokalnie -
+# wystawienie na zewnątrz (ICS_HOST=0.0.0.0 albo reverse proxy z base_url) to świadoma decyzja.
+ICS_HOST = os.environ.get("ICS_HOST", "127.0.0.1")
+ICS_PORT = int(os.environ.get("ICS_PORT", 8502))
+ICS_PAST_DAYS, ICS_FUTURE_DAYS = 30, 365
+
+def ics_secret():
+    return st.secrets.get("ics", {}).get("secret")
+
+def ics_token(secret, tenant_id, student_id=None):
+    return hmac.new(str(secret).encode(), f"{tenant_id}/{student_id or ''}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def ics_url(tenant_id, student_id=None):
+    base = st.secrets.get("ics", {}).get("base_url", f"http://localhost:{ICS_PORT}").rstrip('/')
+    student = f"/{student_id}" if student_id is not None else ""
+    return f"{base}/ics/{tenant_id}{student}/{ics_token(ics_secret(), tenant_id, student_id)}.ics"
+
+def ics_text(value):
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+@st.cache_data(max_entries=200)
+def ics_feed(tenant_id, student_id, version, today):
+    """Plik ICS dla wersji danych `version` (argument tylko jako klucz cache) z oknem zajęć wokół dnia `today`."""
+    df_students = load_data(tenant_id)
+    if student_id is not None: df_students = df_students[df_students['ID'] == student_id]
+    lessons = get_lessons_in_period(df_students, today - timedelta(days=ICS_PAST_DAYS), today + timedelta(days=ICS_FUTURE_DAYS), tenant_id)
+    labels = student_labels(df_students)
+    start_ts = lessons['Data'] + pd.to_timedelta(lessons['Minuty'].astype('int64'), unit='m')
+    end_ts = start_ts + pd.to_timedelta(lessons['Czas'].astype('float64'), unit='h')
+    # Kilka lekcji ucznia o tej samej porze (np. edycja + odrabianie) rozróżnia numer kolejny w UID
+    seq = lessons.groupby(['Uczen_ID', start_ts]).cumcount()
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    events = [
+        f"BEGIN:VEVENT\r\nUID:{uid}-{start:%Y%m%dT%H%M}-{k}@{tenant_id}.korepetycje\r\nDTSTAMP:{stamp}\r\n"
+        f"DTSTART:{start:%Y%m%dT%H%M%S}\r\nDTEND:{end:%Y%m%dT%H%M%S}\r\n"
+        f"SUMMARY:{ics_text(f'{labels.get(uid, uid)} ({typ})')}\r\nDESCRIPTION:{ics_text(f'Stawka: {stawka:.2f} zł')}\r\nEND:VEVENT\r\n"
+        for uid, start, end, k, typ, stawka in zip(lessons['Uczen_ID'], start_ts, end_ts, seq, lessons['Typ'].astype(str), lessons['Stawka'])
+    ]
+    name = "Korepetycje" + (f" - {labels.get(student_id, student_id)}" if student_id is not None else "")
+    return (f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Korepetycje//PL\r\nCALSCALE:GREGORIAN\r\n"
+            f"X-WR-CALNAME:{ics_text(name)}\r\n" + "".join(events) + "END:VCALENDAR\r\n")
+
+class IcsHandler(BaseHTTPRequestHandler):
+    secret = None
+    versions = {}  # (tenant, uczeń) -> ((wersja danych, dzień), Last-Modified)
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').removesuffix('.ics').split('/')
+        if parts[0] != 'ics' or len(parts) not in (3, 4) or (len(parts) == 4 and not parts[2].isdigit()):
+            return self.send_error(404)
+        tenant_id, token = parts[1], parts[-1]
+        student_id = int(parts[2]) if len(parts) == 4 else None
+        if not hmac.compare_digest(token, ics_token(self.secret, tenant_id, student_id)): return self.send_error(403)
+
+        version, today = data_version(tenant_id, 'grafik'), date.today()
+        known = self.versions.get((tenant_id, student_id))
+        modified = known[1] if known and known[0] == (version, today) else datetime.now(timezone.utc).replace(microsecond=0)
+        self.versions[(tenant_id, student_id)] = ((version, today), modified)
+        etag = f'"{version}-{today:%Y%m%d}-{student_id or 0}"'
+        if_none, if_since = self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')
+        try: not_modified = etag in (if_none or '') if if_none else (bool(if_since) and parsedate_to_datetime(if_since) >= modified)
+        except (TypeError, ValueError): not_modified = False
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', format_datetime(modified, usegmt=True))
+        self.send_header('Cache-Control', 'no-cache')
+        if not_modified: return self.end_headers()
+        body = ics_feed(tenant_id, student_id, version, today).encode('utf-8')
+        self.send_header('Content-Type', 'text/calendar; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@st.cache_resource
+def ics_server():
+    """Uruchamia serwer ICS raz na proces; None, gdy brak sekretu [ics] secret albo port jest zajęty."""
+    IcsHandler.secret = ics_secret()
+    if not IcsHandler.secret: return None
+    try: server = ThreadingHTTPServer((ICS_HOST, ICS_PORT), IcsHandler)
+    except OSError: return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@st.fragment
+def ics_links():
+    if ics_server() is None:
+        st.warning(f"Serwer kalendarza ICS nie działa (brak sekretu `secret` w sekcji [ics] konfiguracji albo port {ICS_PORT} jest zajęty).")
+        return
+    st.caption("Adres do subskrypcji w kalendarzu telefonu (Google / Apple). Aplikacja kalendarza pobiera nową wersję tylko po zmianie danych.")
+    st.code(ics_url(TENANT), language=None)
+    df = load_data(TENANT)
+    if not df.empty:
+        sid = st.selectbox("Kalendarz ucznia", df['ID'].tolist(), format_func=student_labels(df).get, key="ics_student")
+        st.code(ics_url(TENANT, sid), language=None)
+
+# --- ZADANIA W TLE (PRACE OKRESOWE) ---
+# Zaliczanie minionych odrabiań, odświeżanie cache przed wygaśnięciem, zestawienia, zamykanie miesięcy i porządki
+# wykonuje jeden wątek tła na proces (st.cache_resource), kolejno dla każdego korepetytora. Strony tylko czytają
+# gotowy stan - żadna sesja nie płaci za prace okresowe. Konfiguracja: sekcja [scheduler] w sekretach.
+SCHEDULER_CONFIG = st.secrets.get("scheduler", {})
+REFRESH_SECONDS = int(SCHEDULER_CONFIG.get("refresh_seconds", 50))  # krócej niż ttl cache (60 s)
+MAKEUPS_MINUTES = int(SCHEDULER_CONFIG.get("makeups_minutes", 15))
+NIGHTLY_HOUR = int(SCHEDULER_CONFIG.get("nightly_hour", 5))
+AUTO_CLOSE_AFTER_MONTHS = int(SCHEDULER_CONFIG.get("auto_close_after_months", 0))  # 0 = bez automatycznego zamykania
+IDLE_MINUTES = int(SCHEDULER_CONFIG.get("idle_minutes", 30))  # bez odświeżania, gdy nikt nie korzysta z aplikacji
+
+def known_tenants():
+    return list(st.secrets.get("tenants", {})) or [DEFAULT_TENANT]
+
+def school_year_bounds(today=None):
+    """Bieżący rok szkolny (1 września - 31 sierpnia)."""
+    today = today or date.today()
+    start = date(today.year if today.month >= 9 else today.year - 1, 9, 1)
+    return start, start + relativedelta(years=1, days=-1)
+
+def job_makeups(tenant_id):
+    done = process_past_makeups(load_data(tenant_id), load_extra(tenant_id))
+    return "zaliczono minione odrabiania" if done else "brak minionych odrabiań"
+
+@st.cache_resource
+def tenant_activity():
+    """Ostatnie wejście korepetytora (przebieg strony) i wersja danych, dla której przeliczono jego widoki."""
+    return {'seen': {}, 'refreshed': {}}
+
+def job_refresh(tenant_id):
+    """Wczytuje tabele i - jeśli dane się zmieniły - przelicza widoki korepetytora, zanim sesje trafią na wygasły cache.
+    Korepetytorzy bez aktywności od IDLE_MINUTES są pomijani (ich dane wczytają się przy następnym wejściu)."""
+    activity = tenant_activity()
+    seen = activity['seen'].get(tenant_id)
+    if seen is None or datetime.now() - seen > timedelta(minutes=IDLE_MINUTES): return "brak aktywności"
+    publish_tables(tenant_id)
+    version = data_version(tenant_id, 'wszystko')
+    if activity['refreshed'].get(tenant_id) == version: return "bez zmian"
+    # Zapisy z aplikacji czyszczą te cache same (clear_cache) - tu chodzi o zmiany z zewnątrz
+    for cached in (calendar_events, lesson_index, roster_index):
+        cached.clear(tenant_id); cached(tenant_id)
+    ids = load_data(tenant_id)['ID'].drop_duplicates().tolist()
+    for sid in ids:
+        payment_rows(tenant_id, sid, version)
+    monthly_rollup(tenant_id, month_keys(*school_year_bounds()))
+    activity['refreshed'][tenant_id] = version
+    return f"{len(ids)} uczniów"
+
+def job_close_months(tenant_id):
+    """Zamyka (snapshot) miesiące starsze niż AUTO_CLOSE_AFTER_MONTHS, które nie są jeszcze zamknięte."""
+    if AUTO_CLOSE_AFTER_MONTHS <= 0: return "wyłączone"
+    df_students, closed = load_data(tenant_id), closed_month_keys(load_snapshots(tenant_id))
+    first = df_students['Data_rozp'].min()
+    if pd.isna(first): return "brak uczniów"
+    last = date.today().replace(day=1) - relativedelta(months=AUTO_CLOSE_AFTER_MONTHS)
+    months = [m for m in month_keys(first, last) if m not in closed]
+    snapshots = [build_month_snapshot(df_students, pd.Timestamp(m).date()) for m in months]
+    snapshots = [s for s in snapshots if not s.empty]
+    if snapshots: UnitOfWork().upsert("zamkniete_miesiace", pd.concat(snapshots, ignore_index=True)).commit()
+    return f"zamknięto {len(snapshots)} mies."
+
+def job_compact(tenant_id):
+    """Porządki w pamięci procesu: wyliczenia dla nieaktualnych wersji danych, stare miesiące zestawienia,
+    nieaktualne wpisy serwera ICS."""
+    version = data_version(tenant_id, 'wszystko')
+    memo = billing_memo().purge(lambda key: key[1] != tenant_id or key[-1] == version)
+    keep = set(month_keys(school_year_bounds()[0] - relativedelta(years=1), school_year_bounds()[1]))
+    store = rollup_store(tenant_id)
+    with store['lock']:
+        old = store['months'] - keep
+        store['frame'] = store['frame'][~store['frame']['Miesiac'].isin(old)]
+        store['months'] -= old
+    schedule = data_version(tenant_id, 'grafik')
+    ics = [k for k, ((v, day), _) in list(IcsHandler.versions.items()) if k[0] == tenant_id and (v != schedule or day != date.today())]
+    for k in ics: IcsHandler.versions.pop(k, None)
+    return f"wyliczenia: {memo}, miesiące: {len(old)}, ICS: {len(ics)}"
+
+# (nazwa, funkcja, co ile albo None, godzina nocna albo None)
+SCHEDULED_JOBS = [
+    ("Zaliczanie minionych odrabiań", job_makeups, timedelta(minutes=MAKEUPS_MINUTES), None),
+    ("Odświeżanie cache i zestawień", job_refresh, timedelta(seconds=REFRESH_SECONDS), None),
+    ("Zamykanie starych miesięcy", job_close_months, None, NIGHTLY_HOUR),
+    ("Porządki w pamięci", job_compact, None, NIGHTLY_HOUR),
+]
+
+class Scheduler:
+    """Wątek tła wykonujący SCHEDULED_JOBS dla wszystkich korepetytorów; stan zadań do podglądu w aplikacji."""
+
+    def __init__(self, jobs, tenants):
+        now = datetime.now()
+        self.tenants = tenants
+        self.jobs = {name: {'fn': fn, 'every': every, 'hour': hour, 'next': now, 'last': None, 'duration': None,
+                            'result': None, 'error': None, 'runs': 0} for name, fn, every, hour in jobs}
+        self.lock, self.wake = threading.Lock(), threading.Event()
+        threading.Thread(target=self.loop, daemon=True, name="scheduler").start()
+
+    def next_run(self, job, now):
+        if job['every'] is not None: return now + job['every']
+        at = now.replace(hour=job['hour'], minute=0, second=0, microsecond=0)
+        return at if at > now else at + timedelta(days=1)
+
+    def run(self, name):
+        job, started, results, errors = self.jobs[name], datetime.now(), [], []
+        for tenant_id in self.tenants:
+            try:
+                with acting_as(tenant_id): results.append(f"{tenant_id}: {job['fn'](tenant_id)}")
+            except Exception as e:  # jeden korepetytor nie blokuje pozostałych
+                errors.append(f"{tenant_id}: {e}")
+        with self.lock:
+            job.update(last=started, duration=(datetime.now() - started).total_seconds(), result="; ".join(results),
+                       error="; ".join(errors) or None, runs=job['runs'] + 1, next=self.next_run(job, datetime.now()))
+
+    def loop(self):
+        while True:
+            self.wake.clear()
+            for name, job in self.jobs.items():
+                if job['next'] <= datetime.now(): self.run(name)
+            self.wake.wait(max(1.0, (min(j['next'] for j in self.jobs.values()) - datetime.now()).total_seconds()))
+
+    def trigger(self, name):
+        with self.lock: self.jobs[name]['next'] = datetime.now()
+        self.wake.set()
+
+    def status(self):
+        with self.lock:
+            return pd.DataFrame([{'Zadanie': name, 'Ostatnio': j['last'], 'Czas [s]': j['duration'], 'Uruchomień': j['runs'],
+                                  'Następne': j['next'], 'Wynik': j['error'] or j['result']} for name, j in self.jobs.items()])
+
+@st.cache_resource
+def scheduler():
+    return Scheduler(SCHEDULED_JOBS, known_tenants())
+
+@st.fragment
+def scheduler_status():
+    st.subheader("⏱️ Zadania w tle")
+    st.caption("Prace okresowe wykonywane poza sesjami użytkowników, dla wszystkich korepetytorów.")
+    status = scheduler().status()
+    st.dataframe(status, hide_index=True, use_container_width=True)
+    c1, c2 = st.columns([3, 1])
+    name = c1.selectbox("Zadanie", status['Zadanie'].tolist(), key="job_pick", label_visibility="collapsed")
+    if c2.button("▶️ Uruchom teraz", key="job_run"):
+        scheduler().trigger(name); st.toast(f"Zlecono: {name}")
 
 # --- START APLIKACJI ---
-df = load_data()
-df_settlements = load_settlements()
-df_cancellations = load_cancellations()
-df_extra = load_extra()
-df_schedule = load_schedule()
+df = load_data(TENANT)
+df_settlements = load_settlements(TENANT)
+df_cancellations = load_cancellations(TENANT)
+df_extra = load_extra(TENANT)
+df_schedule = load_schedule(TENANT)
 
 # USUNIĘTO starą logikę check_and_migrate_schedule, która powodowała NameError
 
-if process_past_makeups(df, df_extra):
-    df = load_data()
-    df_extra = load_extra()
+df_issues = schema_issues(df, df_settlements, df_cancellations, df_extra, df_schedule)
+tenant_activity()['seen'][TENANT] = datetime.now()
+ics_server()
+scheduler()
 
 with st.sidebar:
     st.title("📚 Korepetycje")
     menu = st.radio("Menu", ["📅 Kalendarz", "👤 Szczegóły Ucznia", "💰 Finanse (Wykres)", "➕ Dodaj Ucznia", "📋 Baza Danych"])
+    if not df_issues.empty:
+        st.warning(f"⚠️ Pominięto błędne wiersze w danych ({len(df_issues)}). Szczegóły w zakładce 'Baza Danych'.")
 
 # --- ZAKŁADKA KALENDARZ ---
 if menu == "📅 Kalendarz":
     st.header("Grafik Zajęć")
     
     with st.expander("➕ Dodaj dodatkową lekcję / odrabianie"):
-        student_opts = {f"{r['Imie']} {r['Nazwisko']}": r['ID'] for i, r in df.iterrows()}
-        c1, c2 = st.columns(2)
-        if not student_opts:
+        e_id = student_picker("Kto?", key="extra_who") if not df.empty else None
+        if df.empty:
             st.warning("Dodaj najpierw ucznia w zakładce 'Dodaj Ucznia'.")
-        else:
-            e_name = c1.selectbox("Kto?", list(student_opts.keys()), key="extra_who")
-            e_id = student_opts[e_name]
-            
+        elif e_id is not None:
             s_row = df[df['ID'] == e_id].iloc[0]
             sched_rows = df_schedule[df_schedule['Uczen_ID'] == e_id]
             def_dur = 1.0
@@ -536,172 +2327,111 @@ if menu == "📅 Kalendarz":
             dojazd_koszt = float(s_row.get('Dojazd', 0))
             final_total = (e_hourly * e_dur) + dojazd_koszt
             st.caption(f"ℹ️ Wyliczenie: {e_hourly} zł/h × {e_dur}h + {dojazd_koszt} zł (dojazd) = **{final_total:.2f} zł**")
+            if st.toggle("🔎 Szukaj wolnego terminu", value=float(s_row['Do_odrobienia_nieumowione']) > 0, key="slot_finder"):
+                f1, f2, f3 = st.columns(3)
+                f_weeks = f1.number_input("Tygodnie do przodu", 1, 26, 4, key="slot_weeks")
+                f_count = f2.number_input("Ile propozycji", 1, 20, 5, key="slot_count")
+                f_usual = f3.checkbox("Tylko zwykłe dni ucznia", key="slot_usual")
+                slots = free_slots(lesson_index(TENANT), df, e_id, e_dur, int(f_weeks), int(f_count), f_usual)
+                if slots.empty: st.info("Brak wolnych terminów w tym okresie.")
+                else:
+                    st.dataframe(slots, hide_index=True, use_container_width=True)
+                    pick = st.selectbox("Termin", slots.index, format_func=lambda i: f"{slots.at[i, 'Dzień']} {slots.at[i, 'Data']} {slots.at[i, 'Godzina']}", key="slot_pick")
+                    st.button("Wstaw termin", on_click=use_slot, args=(slots.loc[pick],), key="slot_use")
             typ_lekcji_ui = st.radio("Typ:", ["Odrabianie", "Dodatkowa"], horizontal=True)
-            if st.button("Dodaj lekcję"):
+            new_lesson = pd.DataFrame({'Data': [pd.Timestamp(e_date)], 'Uczen_ID': [e_id], 'Minuty': [e_time.hour * 60 + e_time.minute], 'Czas': [e_dur]})
+            confirmed = conflict_warning(lesson_conflicts(lesson_index(TENANT), new_lesson, df), key="extra_conflict_ok")
+            if st.button("Dodaj lekcję", disabled=not confirmed):
                 typ_save = "Odrabianie" if typ_lekcji_ui == "Odrabianie" else "Dodatkowa"
                 new_extra = pd.DataFrame([{
                     'Uczen_ID': e_id, 'Data': e_date, 'Godzina': e_time, 
                     'Stawka': final_total, 'Typ': typ_save, 'Czas': e_dur, 'Status': 'Zaplanowana'
                 }])
-                df_extra = pd.concat([df_extra, new_extra], ignore_index=True)
-                save_extra(df_extra)
+                with UnitOfWork() as uow:
+                    uow.insert("dodatkowe", new_extra)
+                    if typ_save == "Odrabianie":
+                        uow.record("Umówione odrabianie", {e_id: (1, e_dur)})
                 if typ_save == "Odrabianie":
-                    idx = df.index[df['ID'] == e_id].tolist()
-                    if idx:
-                        idx = idx[0]
-                        df.at[idx, 'Do_odrobienia_umowione'] += e_dur
-                        current_pending = df.at[idx, 'Do_odrobienia_nieumowione']
-                        if current_pending > 0:
-                            df.at[idx, 'Do_odrobienia_nieumowione'] = max(0.0, current_pending - e_dur)
-                        save_data(df)
-                        st.success(f"Dodano lekcję (Odrabianie {e_dur}h) i zaktualizowano liczniki!")
+                    st.success(f"Dodano lekcję (Odrabianie {e_dur}h) i zaktualizowano liczniki!")
                 else:
                     st.success("Dodano lekcję dodatkową!")
                 st.rerun()
 
-    calendar_options = {
-        "editable": "true", "locale": "pl", "firstDay": 1,
-        "headerToolbar": {"left": "prev,next today", "center": "title", "right": "dayGridMonth,timeGridWeek"},
-        "buttonText": {"today": "Dziś", "month": "Miesiąc", "week": "Tydzień", "day": "Dzień"},
-        "slotMinTime": "08:00:00", "slotMaxTime": "22:00:00", "allDaySlot": False,
-        "eventTimeFormat": {"hour": "2-digit", "minute": "2-digit", "hour12": False}
-    }
-    events = generate_calendar_events(df)
-    cal_state = calendar(events=events, options=calendar_options)
-    
-    if cal_state.get("eventClick"):
-        props = cal_state["eventClick"]["event"]["extendedProps"]
-        st.divider()
-        st.subheader(f"Zarządzanie: {props['Imie']} {props['Nazwisko']} ({props['Data']})")
-        col1, col2 = st.columns(2)
-        with col1:
-            st.info(f"Typ: {props['Typ']} | Czas: {props.get('Czas', 1.0)}h | Stawka: {props['Stawka']} zł")
-        with col2:
-            tab_edit, tab_del = st.tabs(["✏️ Edytuj", "🗑️ Usuń / Odwołaj"])
-            
-            with tab_edit:
-                c_e1, c_e2 = st.columns(2)
-                new_rate = c_e1.number_input("Nowa stawka (Total)", value=float(props['Stawka']))
-                new_dur = c_e2.number_input("Nowy czas (h)", value=float(props.get('Czas', 1.0)), step=0.25)
-                
-                if st.button("Zapisz zmiany"):
-                    if props['Typ'] == 'Stała':
-                        nc = pd.DataFrame([{
-                            'Uczen_ID': props['Uczen_ID'], 'Data': props['Data'], 'Powod': 'Edycja (Zmiana stawki)'
-                        }])
-                        df_cancellations = pd.concat([df_cancellations, nc], ignore_index=True)
-                        save_cancellations(df_cancellations)
-                        
-                        ne = pd.DataFrame([{
-                            'Uczen_ID': props['Uczen_ID'], 'Data': props['Data'], 'Godzina': props['Godzina'], 
-                            'Stawka': new_rate, 'Typ': 'Edytowana', 'Czas': new_dur, 'Status': 'Zaplanowana'
-                        }])
-                        df_extra = pd.concat([df_extra, ne], ignore_index=True)
-                        save_extra(df_extra)
-                    else:
-                        mask = (df_extra['Uczen_ID'] == props['Uczen_ID']) & (df_extra['Data'] == props['Data']) & (df_extra['Godzina'].astype(str).str.contains(str(props['Godzina'])[:5]))
-                        if mask.any():
-                            idx = df_extra[mask].index[0]
-                            df_extra.at[idx, 'Stawka'] = new_rate
-                            df_extra.at[idx, 'Czas'] = new_dur
-                            save_extra(df_extra)
-                    st.success("Zapisano!"); st.rerun()
+    with st.expander("🏖️ Dni wolne (święta, ferie)"):
+        st.caption("Jeden wpis wyłącza zajęcia w całym przedziale - dla wszystkich, jednej szkoły albo wybranych uczniów.")
+        df_holidays = load_holidays(TENANT)
+        h1, h2, h3 = st.columns([2, 2, 3])
+        h_od = h1.date_input("Od", date.today(), key="hol_od")
+        h_do = h2.date_input("Do", date.today(), key="hol_do")
+        h_name = h3.text_input("Nazwa", "Święto", key="hol_name")
+        h_scope = st.radio("Dotyczy:", ["Wszystkich", "Szkoły", "Wybranych uczniów"], horizontal=True, key="hol_scope")
+        h_school, h_students = None, None
+        if h_scope == "Szkoły":
+            h_school = st.selectbox("Szkoła", ["Podstawowa", "Liceum", "Technikum"], key="hol_school")
+        elif h_scope == "Wybranych uczniów":
+            h_ids = st.multiselect("Uczniowie", df['ID'].tolist(), format_func=student_labels(df).get, key="hol_students")
+            h_students = ";".join(str(i) for i in h_ids) or None
+        if st.button("Dodaj dni wolne"):
+            if h_do < h_od: st.error("Data końcowa jest wcześniejsza niż początkowa.")
+            else:
+                with UnitOfWork() as uow:
+                    uow.insert("dni_wolne", pd.DataFrame([{'Data_od': h_od, 'Data_do': h_do, 'Nazwa': h_name, 'Szkola': h_school, 'Uczniowie': h_students}]))
+                st.success("Dodano dni wolne."); st.rerun()
+        for _, h in df_holidays.sort_values('Data_od', ascending=False).iterrows():
+            scope = h['Szkola'] if pd.notna(h['Szkola']) else (f"uczniowie: {h['Uczniowie']}" if pd.notna(h['Uczniowie']) else "wszyscy")
+            c_h, c_x = st.columns([6, 1])
+            c_h.write(f"{h['Data_od']:%Y-%m-%d} – {h['Data_do']:%Y-%m-%d} · {h['Nazwa']} ({scope})")
+            if pd.notna(h.get("id")) and c_x.button("🗑️", key=f"hol_del_{int(h['id'])}"):
+                UnitOfWork().delete("dni_wolne", id=int(h['id'])).commit(); st.rerun()
 
-            with tab_del:
-                if props['Typ'] == 'Stała':
-                    powod_del = st.radio("Kto zawinił?", ["Wina Ucznia", "Wina Korepetytora", "Święto / Inne (Bez liczników)"], key="del_reason_click")
-                    if st.button("❌ Odwołaj zajęcia"):
-                        nc = pd.DataFrame([{'Uczen_ID': props['Uczen_ID'], 'Data': props['Data'], 'Powod': powod_del}])
-                        df_cancellations = pd.concat([df_cancellations, nc], ignore_index=True)
-                        save_cancellations(df_cancellations)
-                        if "Święto" not in powod_del:
-                            idx = df.index[df['ID'] == props['Uczen_ID']].tolist()[0]
-                            duration_to_add = float(props.get('Czas', 1.0))
-                            if powod_del == "Wina Ucznia":
-                                df.at[idx, 'Nieobecnosci'] += 1
-                                df.at[idx, 'Odrabiania'] += 1
-                                df.at[idx, 'Do_odrobienia_nieumowione'] += duration_to_add
-                            else:
-                                df.at[idx, 'Do_odrobienia_nieumowione'] += duration_to_add
-                            save_data(df)
-                        st.success("Odwołano."); st.rerun()
-                else:
-                    if st.button("🗑️ Usuń z kalendarza"):
-                        mask = (df_extra['Uczen_ID'] == props['Uczen_ID']) & (df_extra['Data'] == props['Data']) & (df_extra['Godzina'].astype(str).str.contains(str(props['Godzina'])[:5]))
-                        if mask.any():
-                            idx = df_extra[mask].index[0]
-                            if props['Typ'] == 'Odrabianie':
-                                s_idx = df.index[df['ID'] == props['Uczen_ID']].tolist()
-                                if s_idx:
-                                    s_idx = s_idx[0]
-                                    dur_to_rev = float(props.get('Czas', 1.0))
-                                    if df.at[s_idx, 'Do_odrobienia_umowione'] >= dur_to_rev:
-                                        df.at[s_idx, 'Do_odrobienia_umowione'] -= dur_to_rev
-                                    df.at[s_idx, 'Do_odrobienia_nieumowione'] += dur_to_rev 
-                                    save_data(df)
-                                    st.toast("Cofnięto status odrabiania.")
-                            df_extra = df_extra.drop(idx).reset_index(drop=True)
-                            save_extra(df_extra)
-                        st.success("Usunięto."); st.rerun()
+    with st.expander("🗓️ Odwołanie zbiorcze / przełożenie"):
+        st.caption("Odwołuje wszystkie zajęcia z planu wybranych uczniów w podanym okresie jednym zapisem.")
+        b1, b2, b3 = st.columns([2, 2, 2])
+        b_od = b1.date_input("Od", date.today(), key="bulk_od")
+        b_do = b2.date_input("Do", date.today() + timedelta(days=6), key="bulk_do")
+        b_shift = b3.number_input("Przełóż o (dni, 0 = bez przełożenia)", 0, 60, 0, key="bulk_shift")
+        labels = student_labels(df)
+        b_ids = st.multiselect("Uczniowie", df['ID'].tolist(), format_func=labels.get, key="bulk_students")
+        b_reason = st.radio("Kto zawinił?", POWODY_ODWOLANIA[:3], horizontal=True, key="bulk_reason")
+        if b_ids:
+            preview = plan_bulk_cancellation(df, b_ids, b_od, b_do)
+            if preview.empty: st.info("Brak zajęć do odwołania w tym okresie.")
+            else:
+                prev_df = pd.DataFrame({
+                    "Data": preview['Data'].dt.strftime("%Y-%m-%d"), "Godzina": minutes_to_time_str(preview['Minuty']),
+                    "Uczeń": preview['Uczen_ID'].map(labels), "Czas (h)": preview['Czas'], "Stawka": preview['Stawka']
+                })
+                if b_shift: prev_df["Nowy termin"] = (preview['Data'] + pd.Timedelta(days=int(b_shift))).dt.strftime("%Y-%m-%d")
+                st.dataframe(prev_df, hide_index=True, use_container_width=True)
+                if st.button(f"❌ Odwołaj zajęcia ({len(preview)})", key="bulk_apply"):
+                    apply_bulk_cancellation(df, preview, b_reason, int(b_shift))
+                    st.success(f"Odwołano {len(preview)} zajęć."); st.rerun()
+
+    with st.expander("⚠️ Kolizje w grafiku"):
+        index = lesson_index(TENANT)
+        first, second, direct = index.all_conflicts()
+        st.caption(f"Zajęcia nakładające się albo bez {TRAVEL_BUFFER_MIN} min na dojazd do/od ucznia z dojazdem "
+                   f"(±{CONFLICT_HORIZON_DAYS} dni od dziś).")
+        if len(first) == 0: st.success("Brak kolizji.")
+        else:
+            st.dataframe(conflict_table(index.lessons.iloc[first], index.lessons.iloc[second], direct, df), hide_index=True, use_container_width=True)
+
+    with st.expander("📲 Subskrypcja kalendarza (ICS)"):
+        ics_links()
+
+    calendar_section()
 
 elif menu == "👤 Szczegóły Ucznia":
     st.header("Karta Ucznia")
+    selected_id = student_picker("Wybierz ucznia:", key="student_pick") if not df.empty else None
     if df.empty:
         st.warning("Brak uczniów.")
-    else:
-        student_options = {f"{r['Imie']} {r['Nazwisko']}": r['ID'] for i, r in df.iterrows()}
-        selected_student_name = st.selectbox("Wybierz ucznia:", list(student_options.keys()))
-        selected_id = student_options[selected_student_name]
+    elif selected_id is not None:
         student_row = df[df['ID'] == selected_id].iloc[0]
-        tryb = student_row.get('Tryb_platnosci', 'Co zajęcia')
         
         st.markdown("---")
         with st.expander("📅 Historia i Zmiany Planu (Harmonogram)"):
-            st.caption("Tutaj możesz zmienić dzień/godzinę zajęć w czasie.")
-            s_sch = df_schedule[df_schedule['Uczen_ID'] == selected_id].copy()
-            c_h1, c_h2, c_h3, c_h4, c_h5, c_h6, c_h7 = st.columns([2, 2, 1.5, 1.5, 2, 2, 1])
-            new_day = c_h1.selectbox("Dzień", list(DNI_MAPA.keys()), key="ns_d")
-            new_hour = c_h2.time_input("Godz", time(16,0), key="ns_t")
-            new_dur = c_h3.number_input("h", 0.5, 3.0, 1.0, 0.25, key="ns_dur")
-            new_rate_val = float(student_row['Stawka'])
-            new_rate = c_h4.number_input("Stawka", value=new_rate_val, key="ns_rate")
-            new_start = c_h5.date_input("Od", date.today(), key="ns_od")
-            new_end = c_h6.date_input("Do", date(2026, 6, 26), key="ns_do")
-            if c_h7.button("➕", help="Dodaj nowy okres"):
-                new_sch_entry = pd.DataFrame([{
-                    'Uczen_ID': selected_id, 'Dzien_tyg': new_day, 'Godzina': new_hour, 
-                    'Czas_trwania': new_dur, 'Data_od': new_start, 'Data_do': new_end,
-                    'Stawka': new_rate
-                }])
-                df_schedule = pd.concat([df_schedule, new_sch_entry], ignore_index=True)
-                save_schedule(df_schedule); st.rerun()
-            
-            if not s_sch.empty:
-                try: s_sch['Godzina'] = pd.to_datetime(s_sch['Godzina'].astype(str)).dt.time
-                except: pass
-                try: 
-                    s_sch['Data_od'] = pd.to_datetime(s_sch['Data_od']).dt.date
-                    s_sch['Data_do'] = pd.to_datetime(s_sch['Data_do']).dt.date
-                except: pass
-
-                edited_sch = st.data_editor(
-                    s_sch, 
-                    column_config={
-                        "Uczen_ID": None,
-                        "Dzien_tyg": st.column_config.SelectboxColumn("Dzień", options=list(DNI_MAPA.keys()), required=True),
-                        "Godzina": st.column_config.TimeColumn("Godzina", required=True),
-                        "Czas_trwania": st.column_config.NumberColumn("Czas (h)", min_value=0.5, max_value=4.0, step=0.25),
-                        "Stawka": st.column_config.NumberColumn("Stawka (zł/h)", min_value=0.0, step=5.0),
-                        "Data_od": st.column_config.DateColumn("Od", required=True),
-                        "Data_do": st.column_config.DateColumn("Do", required=True)
-                    },
-                    hide_index=True, use_container_width=True, key="sch_editor"
-                )
-                if st.button("Zapisz zmiany w planie"):
-                    df_schedule = df_schedule[df_schedule['Uczen_ID'] != selected_id]
-                    df_schedule = pd.concat([df_schedule, edited_sch], ignore_index=True)
-                    save_schedule(df_schedule); st.success("Plan zaktualizowany!"); st.rerun()
-            else: st.warning("Brak zdefiniowanego planu.")
+            schedule_editor(student_row)
 
         st.markdown("---")
         col_info1, col_info2, col_info3 = st.columns(3)
@@ -711,8 +2441,8 @@ elif menu == "👤 Szczegóły Ucznia":
             st.write(f"**Adres:** {student_row['Adres']}")
         with col_info2:
             st.markdown("##### 📚 Finanse")
-            dojazd_info = f"+ {student_row.get('Dojazd', 0)} zł dojazd"
-            st.write(f"Stawka: {student_row['Stawka']} zł/h {dojazd_info}")
+            dojazd_info = f"+ {student_row['Dojazd']:g} zł dojazd"
+            st.write(f"Stawka: {student_row['Stawka']:g} zł/h {dojazd_info}")
         with col_info3:
             st.markdown("##### 📊 Status i Liczniki")
             c_stat1, c_stat2 = st.columns(2)
@@ -721,59 +2451,7 @@ elif menu == "👤 Szczegóły Ucznia":
             c_stat2.metric("Do odrobienia (UMÓWIONE)", f"{float(student_row['Do_odrobienia_umowione']):.1f}h")
             c_stat2.metric("Do odrobienia (WISZĄCE)", f"{float(student_row['Do_odrobienia_nieumowione']):.1f}h", delta_color="inverse")
 
-        start_date = pd.to_datetime(student_row['Data_rozp']).date()
-        end_date = pd.to_datetime(student_row['Data_zak']).date()
-        effective_end = min(end_date, date.today())
-        saved_for_student = df_settlements[df_settlements['Uczen_ID'] == selected_id]
-        if not saved_for_student.empty: saved_for_student = saved_for_student.set_index('Okres')
-        
-        table_data = []
-        details_map = {}
-
-        if tryb == "Miesięcznie":
-            curr = start_date.replace(day=1)
-            view_limit = (date.today().replace(day=1) + relativedelta(months=1)) - timedelta(days=1)
-            df_extra_all = load_extra()
-            while curr <= view_limit:
-                m_str = curr.strftime("%Y-%m")
-                calc_amount, details = calculate_monthly_breakdown(df, selected_id, curr)
-                details_map[m_str] = details
-                final_req = float(calc_amount)
-                paid_val = 0.0
-                if not saved_for_student.empty and m_str in saved_for_student.index:
-                    record = saved_for_student.loc[m_str]
-                    if isinstance(record, pd.DataFrame): record = record.iloc[0]
-                    paid_val = float(record['Wplacono'])
-                table_data.append({"ID Okresu": m_str, "Termin": f"{MIESIACE_PL.get(curr.month)} {curr.year}", "Kwota do zapłaty": float(calc_amount), "Ile wpłacono": paid_val})
-                
-                month_start, month_end = curr, curr + relativedelta(months=1) - timedelta(days=1)
-                extras_in_month = df_extra_all[(df_extra_all['Uczen_ID'] == selected_id) & (df_extra_all['Typ'] == 'Dodatkowa') & (pd.to_datetime(df_extra_all['Data']).dt.date >= month_start) & (pd.to_datetime(df_extra_all['Data']).dt.date <= month_end)]
-                for _, ex_row in extras_in_month.iterrows():
-                    d_str = ex_row['Data']
-                    label = f"Lekcja dodatkowa: {d_str}"
-                    req = float(ex_row['Stawka'])
-                    paid = 0.0
-                    if not saved_for_student.empty and d_str in saved_for_student.index:
-                        record = saved_for_student.loc[d_str]
-                        if isinstance(record, pd.DataFrame): record = record.iloc[0]
-                        paid = float(record['Wplacono'])
-                    table_data.append({"ID Okresu": d_str, "Termin": label, "Kwota do zapłaty": req, "Ile wpłacono": paid})
-                curr += relativedelta(months=1)
-            table_data.sort(key=lambda x: x['ID Okresu'], reverse=True)
-        else:
-            all_lessons = get_lessons_in_period(df[df['ID'] == selected_id], start_date, effective_end)
-            all_lessons.sort(key=lambda x: x['Data'], reverse=True)
-            for l in all_lessons:
-                d_str = l['Data'].strftime("%Y-%m-%d")
-                label = f"{l['Data'].day} {MIESIACE_PL.get(l['Data'].month)} {l['Data'].year}"
-                if l['Typ'] != 'Stała': label += f" ({l['Typ']})"
-                paid_val = 0.0
-                if not saved_for_student.empty and d_str in saved_for_student.index:
-                    record = saved_for_student.loc[d_str]
-                    if isinstance(record, pd.DataFrame): record = record.iloc[0]
-                    paid_val = float(record['Wplacono'])
-                table_data.append({"ID Okresu": d_str, "Termin": label, "Kwota do zapłaty": float(l['Stawka']), "Ile wpłacono": paid_val})
-
+        table_data = payment_rows(TENANT, selected_id, data_version(TENANT, 'wszystko'))
         total_req = sum(r['Kwota do zapłaty'] for r in table_data)
         total_paid = sum(r['Ile wpłacono'] for r in table_data)
         saldo = total_paid - total_req
@@ -782,41 +2460,9 @@ elif menu == "👤 Szczegóły Ucznia":
             color = "green" if saldo >= 0 else "red"
             st.markdown(f"<h2 style='color:{color}'>{saldo:+.2f} zł</h2>", unsafe_allow_html=True)
 
-        st.subheader("💳 Rejestr wpłat")
-        if not table_data: st.info("Brak danych.")
-        else:
-            df_disp = pd.DataFrame(table_data)
-            edited = st.data_editor(df_disp, column_config={"ID Okresu": None, "Termin": st.column_config.TextColumn(disabled=True), "Kwota do zapłaty": st.column_config.NumberColumn(format="%.2f zł", disabled=True), "Ile wpłacono": st.column_config.NumberColumn(format="%.2f zł", min_value=0, step=10)}, hide_index=True, use_container_width=True, key=f"edit_{selected_id}", num_rows="fixed")
-            if st.button("💾 Zapisz wpłaty", type="primary"):
-                other = df_settlements[df_settlements['Uczen_ID'] != selected_id]
-                new_rows = []
-                for _, r in edited.iterrows():
-                    new_rows.append({'Uczen_ID': selected_id, 'Okres': r['ID Okresu'], 'Kwota_Wymagana': r['Kwota do zapłaty'], 'Wplacono': r['Ile wpłacono']})
-                updated = pd.concat([other, pd.DataFrame(new_rows)], ignore_index=True)
-                save_settlements(updated)
-                st.success("Zapisano!"); st.rerun()
-
+        payment_register(selected_id)
         st.divider()
-        st.subheader("🔍 Szczegóły wyliczeń dla miesiąca (Plan)")
-        month_map = {}
-        iter_date = start_date.replace(day=1)
-        safe_end = end_date if end_date >= start_date else date.today() + relativedelta(years=1)
-        while iter_date <= safe_end:
-            m_label = f"{MIESIACE_PL.get(iter_date.month)} {iter_date.year}"
-            month_map[m_label] = iter_date
-            iter_date += relativedelta(months=1)
-        sorted_opts = sorted(month_map.keys(), key=lambda x: month_map[x], reverse=True)
-        if sorted_opts:
-            sel_month_label = st.selectbox("Wybierz miesiąc do analizy:", sorted_opts)
-            target_date = month_map[sel_month_label]
-            calc_amount, details = calculate_monthly_breakdown(df, selected_id, target_date)
-            if details:
-                det_df = pd.DataFrame(details)
-                st.dataframe(det_df, hide_index=True, use_container_width=True)
-                sum_info = sum(d['Kwota'] for d in details)
-                st.caption(f"Suma wyliczona z planu (Abonament + Dodatki): **{sum_info:.2f} zł**")
-            else: st.info("Brak pozycji w rachunku.")
-        else: st.info("Brak miesięcy do wyświetlenia.")
+        month_breakdown(selected_id)
 
 elif menu == "💰 Finanse (Wykres)":
     st.header("Analiza Finansowa")
@@ -826,32 +2472,24 @@ elif menu == "💰 Finanse (Wykres)":
         start_year = date(today.year if today.month >= 9 else today.year - 1, 9, 1)
         end_year = date(today.year + 1 if today.month >= 9 else today.year, 6, 30)
         
-        income_total = calculate_predicted_income(df, start_year, end_year)
+        income_total = plan_summary(df, start_year, end_year)['total']
         
         paid_total = df_settlements['Wplacono'].sum()
         c1, c2 = st.columns(2)
         c1.metric("Przychód Przewidywany (Rok)", f"{income_total:.2f} PLN")
         c2.metric("Rzeczywiście Wpłacono (Total)", f"{paid_total:.2f} PLN")
         
-        real_income_map = {}
-        if not df_settlements.empty:
-            temp_settle = df_settlements.copy()
-            temp_settle['MonthKey'] = temp_settle['Okres'].astype(str).str.slice(0, 7)
-            real_income_map = temp_settle.groupby('MonthKey')['Wplacono'].sum().to_dict()
-
+        # Plan i wpłaty miesięcznie prosto z zestawienia (zamknięte miesiące są w nim już ze snapshotów)
+        by_month = monthly_rollup(TENANT, month_keys(start_year, end_year)).groupby('Miesiac')[['Plan', 'Wplacono']].sum()
         chart_data = []
         curr = start_year
         while curr <= end_year:
-            nm = curr + relativedelta(months=1)
-            e_m = nm - timedelta(days=1)
             month_key = curr.strftime("%Y-%m")
-            
-            val_pred = calculate_predicted_income(df, curr, e_m)
-            
-            val_real = real_income_map.get(month_key, 0.0)
+            val_pred = by_month['Plan'].get(month_key, 0.0)
+            val_real = by_month['Wplacono'].get(month_key, 0.0)
             label = f"{MIESIACE_PL.get(curr.month)} {curr.year}"
             chart_data.append({"Miesiąc": label, "Przewidywany": val_pred, "Rzeczywisty": val_real, "SortKey": month_key})
-            curr = nm
+            curr += relativedelta(months=1)
             
         st.divider()
         st.subheader("Porównanie: Plan vs Rzeczywistość (Miesiącami)")
@@ -861,173 +2499,13 @@ elif menu == "💰 Finanse (Wykres)":
         st.altair_chart(c, use_container_width=True)
 
         st.divider()
-        st.subheader("📊 Raport Miesięczny")
-        months_options = [d['Miesiąc'] for d in chart_data]
-        if months_options:
-            curr_month_str = f"{MIESIACE_PL[today.month]} {today.year}"
-            def_idx = months_options.index(curr_month_str) if curr_month_str in months_options else 0
-            sel_month_report = st.selectbox("Wybierz miesiąc do analizy:", months_options, index=def_idx)
-            target_report_date = None
-            m_ptr = start_year
-            while m_ptr <= end_year:
-                if f"{MIESIACE_PL[m_ptr.month]} {m_ptr.year}" == sel_month_report:
-                    target_report_date = m_ptr
-                    break
-                m_ptr += relativedelta(months=1)
-                
-            if target_report_date:
-                r_start = target_report_date.replace(day=1)
-                r_end = r_start + relativedelta(months=1) - timedelta(days=1)
-                
-                lessons_report = get_predicted_lessons(df, r_start, r_end)
-                
-                plan_total, plan_monthly, plan_single, plan_tuition, plan_travel = 0, 0, 0, 0, 0
-                student_plan_total, student_plan_travel = {}, {}
-                
-                for l in lessons_report:
-                    amt = float(l['Stawka'])
-                    sid = l['Uczen_ID']
-                    s_row = df[df['ID'] == sid].iloc[0]
-                    mode = s_row.get('Tryb_platnosci', 'Co zajęcia')
-                    travel_unit_cost = float(s_row.get('Dojazd', 0))
-                    curr_travel = travel_unit_cost
-                    curr_tuition = amt - travel_unit_cost
-                    if curr_tuition < 0: curr_travel = amt; curr_tuition = 0
-                    plan_total += amt; plan_travel += curr_travel; plan_tuition += curr_tuition
-                    lesson_type = l.get('Typ', 'Stała')
-                    if mode == 'Miesięcznie' and lesson_type != 'Dodatkowa': plan_monthly += amt
-                    else: plan_single += amt
-                    student_plan_total[sid] = student_plan_total.get(sid, 0) + amt
-                    student_plan_travel[sid] = student_plan_travel.get(sid, 0) + curr_travel
-                
-                st.markdown("#### 🔵 PLAN (Przewidywane)")
-                c1, c2, c3, c4 = st.columns(4)
-                c1.metric("Suma", f"{plan_total:.2f} zł")
-                c2.metric("Edukacja", f"{plan_tuition:.2f} zł")
-                c3.metric("Dojazdy", f"{plan_travel:.2f} zł")
-                c4.caption(f"Abonamenty: {plan_monthly:.2f}\nPojedyncze: {plan_single:.2f}")
-
-                real_total, real_monthly, real_single, real_tuition, real_travel = 0, 0, 0, 0, 0
-                month_prefix = target_report_date.strftime("%Y-%m")
-                if not df_settlements.empty:
-                    df_settlements['OkresStr'] = df_settlements['Okres'].astype(str)
-                    real_recs = df_settlements[df_settlements['OkresStr'].str.startswith(month_prefix)]
-                    for _, row in real_recs.iterrows():
-                        paid = float(row['Wplacono'])
-                        if paid > 0:
-                            sid = row['Uczen_ID']
-                            real_total += paid
-                            s_row = df[df['ID'] == sid]
-                            if not s_row.empty:
-                                s_row = s_row.iloc[0]
-                                mode = s_row.get('Tryb_platnosci', 'Co zajęcia')
-                                is_extra = len(str(row['Okres'])) > 7
-                                if mode == 'Miesięcznie' and not is_extra: real_monthly += paid
-                                else: real_single += paid
-                                p_tot = student_plan_total.get(sid, 0)
-                                p_trav = student_plan_travel.get(sid, 0)
-                                if p_tot > 0:
-                                    ratio = min(paid / p_tot, 1.0)
-                                    est_travel = p_trav * ratio
-                                    real_travel += est_travel
-                                    real_tuition += (paid - est_travel)
-                                else: real_tuition += paid
-
-                st.markdown("#### 🟢 RZECZYWISTOŚĆ (Wpłacone)")
-                r1, r2, r3, r4 = st.columns(4)
-                r1.metric("Suma", f"{real_total:.2f} zł", delta=f"{real_total - plan_total:.2f} zł")
-                r2.metric("Edukacja", f"{real_tuition:.2f} zł")
-                r3.metric("Dojazdy", f"{real_travel:.2f} zł")
-                r4.caption(f"Abonamenty: {real_monthly:.2f}\nPojedyncze: {real_single:.2f}")
-        else: st.info("Brak danych.")
-
+        monthly_report(start_year, end_year)
         st.divider()
-        st.subheader("📊 Raport Kwartalny")
-        quarter_options = []
-        q_ptr = start_year
-        while q_ptr <= end_year:
-            curr_q = (q_ptr.month - 1) // 3 + 1
-            label_q = f"Q{curr_q} {q_ptr.year}"
-            if not quarter_options or quarter_options[-1]['Label'] != label_q:
-                q_start_month = (curr_q - 1) * 3 + 1
-                q_start_date = date(q_ptr.year, q_start_month, 1)
-                q_end_date = q_start_date + relativedelta(months=3) - timedelta(days=1)
-                quarter_options.append({'Label': label_q, 'Start': q_start_date, 'End': q_end_date})
-            q_ptr += relativedelta(months=1)
-        q_labels = [q['Label'] for q in quarter_options]
-        if q_labels:
-            curr_q_label = f"Q{(today.month - 1) // 3 + 1} {today.year}"
-            def_q_idx = q_labels.index(curr_q_label) if curr_q_label in q_labels else 0
-            sel_q_label = st.selectbox("Wybierz kwartał:", q_labels, index=def_q_idx)
-            sel_q_data = next(q for q in quarter_options if q['Label'] == sel_q_label)
-            if sel_q_data:
-                q_start, q_end = sel_q_data['Start'], sel_q_data['End']
-                
-                # Use get_predicted_lessons for Plan report
-                q_lessons_report = get_predicted_lessons(df, q_start, q_end)
-                
-                q_plan_total, q_plan_monthly, q_plan_single, q_plan_tuition, q_plan_travel = 0, 0, 0, 0, 0
-                q_student_plan_total, q_student_plan_travel = {}, {}
-                for l in q_lessons_report:
-                    amt = float(l['Stawka'])
-                    sid = l['Uczen_ID']
-                    s_row = df[df['ID'] == sid].iloc[0]
-                    mode = s_row.get('Tryb_platnosci', 'Co zajęcia')
-                    travel_unit_cost = float(s_row.get('Dojazd', 0))
-                    curr_travel = travel_unit_cost
-                    curr_tuition = amt - travel_unit_cost
-                    if curr_tuition < 0: curr_travel = amt; curr_tuition = 0
-                    q_plan_total += amt; q_plan_travel += curr_travel; q_plan_tuition += curr_tuition
-                    lesson_type = l.get('Typ', 'Stała')
-                    if mode == 'Miesięcznie' and lesson_type != 'Dodatkowa': q_plan_monthly += amt
-                    else: q_plan_single += amt
-                    q_student_plan_total[sid] = q_student_plan_total.get(sid, 0) + amt
-                    q_student_plan_travel[sid] = q_student_plan_travel.get(sid, 0) + curr_travel
-
-                st.markdown("#### 🔵 PLAN KWARTALNY (Przewidywane)")
-                qc1, qc2, qc3, qc4 = st.columns(4)
-                qc1.metric("Suma", f"{q_plan_total:.2f} zł")
-                qc2.metric("Edukacja", f"{q_plan_tuition:.2f} zł")
-                qc3.metric("Dojazdy", f"{q_plan_travel:.2f} zł")
-                qc4.caption(f"Abonamenty: {q_plan_monthly:.2f}\nPojedyncze: {q_plan_single:.2f}")
-                
-                q_real_total, q_real_monthly, q_real_single, q_real_tuition, q_real_travel = 0, 0, 0, 0, 0
-                if not df_settlements.empty:
-                    q_months_prefixes = []
-                    iter_m = q_start
-                    while iter_m <= q_end:
-                        q_months_prefixes.append(iter_m.strftime("%Y-%m"))
-                        iter_m += relativedelta(months=1)
-                    df_settlements['OkresStr'] = df_settlements['Okres'].astype(str)
-                    q_real_recs = df_settlements[df_settlements['OkresStr'].str.slice(0, 7).isin(q_months_prefixes)]
-                    for _, row in q_real_recs.iterrows():
-                        paid = float(row['Wplacono'])
-                        if paid > 0:
-                            sid = row['Uczen_ID']
-                            q_real_total += paid
-                            s_row = df[df['ID'] == sid]
-                            if not s_row.empty:
-                                s_row = s_row.iloc[0]
-                                mode = s_row.get('Tryb_platnosci', 'Co zajęcia')
-                                is_extra = len(str(row['Okres'])) > 7
-                                if mode == 'Miesięcznie' and not is_extra: q_real_monthly += paid
-                                else: q_real_single += paid
-                                p_tot = q_student_plan_total.get(sid, 0)
-                                p_trav = q_student_plan_travel.get(sid, 0)
-                                if p_tot > 0:
-                                    ratio = min(paid / p_tot, 1.0)
-                                    est_travel = p_trav * ratio
-                                    q_real_travel += est_travel
-                                    q_real_tuition += (paid - est_travel)
-                                else: q_real_tuition += paid
-
-                st.markdown("#### 🟢 RZECZYWISTOŚĆ KWARTALNA (Wpłacone)")
-                qr1, qr2, qr3, qr4 = st.columns(4)
-                qr1.metric("Suma", f"{q_real_total:.2f} zł", delta=f"{q_real_total - q_plan_total:.2f} zł")
-                qr2.metric("Edukacja", f"{q_real_tuition:.2f} zł")
-                qr3.metric("Dojazdy", f"{q_real_travel:.2f} zł")
-                qr4.caption(f"Abonamenty: {q_real_monthly:.2f}\nPojedyncze: {q_real_single:.2f}")
-        else: st.info("Brak danych.")
+        quarterly_report(start_year, end_year)
+        st.divider()
+        scenario_forecaster(start_year, end_year)
+        st.divider()
+        month_closing()
 
 elif menu == "➕ Dodaj Ucznia":
     st.header("Dodaj nowego ucznia")
@@ -1042,7 +2520,7 @@ elif menu == "➕ Dodaj Ucznia":
         st.markdown("---")
         c3, c4, c5 = st.columns(3)
         data_rozp, data_zak = c3.date_input("Start", date.today()), c4.date_input("Koniec", date(2026, 6, 26))
-        tryb = c5.selectbox("Tryb płatności", ["Co zajęcia", "Miesięcznie"])
+        tryb = c5.selectbox("Tryb płatności", TRYBY_PLATNOSCI)
         st.markdown("---"); st.caption("Terminy zajęć")
         col_t1, col_t2 = st.columns(2)
         with col_t1:
@@ -1060,32 +2538,27 @@ elif menu == "➕ Dodaj Ucznia":
             else:
                 days_str, times_str, lens_str = d1, str(g1), str(len1)
                 if use_t2: days_str += f";{d2}"; times_str += f";{g2}"; lens_str += f";{len2}"
-                # Pobierz nowe ID
-                res_id = supabase.table("uczniowie").select("ID").order("ID", desc=True).limit(1).execute()
-                max_id = res_id.data[0]['ID'] if res_id.data else 0
-                new_id = max_id + 1
+                # Nowe ID z sekwencji korepetytora (sql/04_tenanci.sql)
+                new_id = next_ids("uczniowie")[0]
                 
                 new_row = {'ID': new_id, 'Imie': imie, 'Nazwisko': nazwisko, 'Dzien_tyg': days_str, 'Godzina': times_str, 'Data_rozp': str(data_rozp), 'Data_zak': str(data_zak), 'Stawka': stawka, 'Dojazd': dojazd, 'H_w_tygodniu': lens_str, 'Nieobecnosci': 0, 'Tryb_platnosci': tryb, 'Odrabiania': 0, 'Do_odrobienia_umowione': 0, 'Do_odrobienia_nieumowione': 0, 'Szkola': szkola, 'Klasa': klasa, 'Poziom': poziom, 'Nr_tel': nr_tel, 'Adres': adres}
                 
-                # Zapisz do bazy
-                supabase.table("uczniowie").insert(new_row).execute()
-                
-                # Generuj harmonogram
-                new_sch_rows = []
-                # Helper dummy row for parsing
-                dummy_series = pd.Series(new_row)
-                terms = parse_student_terms(dummy_series)
-                for t in terms:
-                    new_sch_rows.append({'Uczen_ID': new_id, 'Dzien_tyg': t['day_name'], 'Godzina': t['time_str'], 'Czas_trwania': t['duration'], 'Data_od': str(data_rozp), 'Data_do': str(data_zak), 'Stawka': stawka})
-                
+                # Uczeń i jego harmonogram trafiają do bazy jedną transakcją
+                uow = UnitOfWork().insert("uczniowie", pd.DataFrame([new_row]))
+                new_sch_rows = student_schedule_rows(pd.Series(new_row))
                 if new_sch_rows:
-                    supabase.table("harmonogram").insert(new_sch_rows).execute()
-                
-                clear_cache()
+                    uow.insert("harmonogram", pd.DataFrame(new_sch_rows))
+                uow.commit()
                 st.success("Dodano!"); st.rerun()
+    st.divider()
+    student_import()
 
 elif menu == "📋 Baza Danych":
     st.header("Podgląd i edycja (Tylko odczyt)")
+    if not df_issues.empty:
+        with st.expander(f"⚠️ Błędne wiersze ({len(df_issues)})", expanded=True):
+            st.caption("Te wiersze nie są brane pod uwagę w kalendarzu i rozliczeniach, dopóki nie zostaną poprawione w bazie.")
+            st.dataframe(df_issues, hide_index=True, use_container_width=True)
     st.dataframe(df)
     st.divider()
     c1, c2 = st.columns(2)
@@ -1094,4 +2567,12 @@ elif menu == "📋 Baza Danych":
         st.dataframe(df_cancellations)
     with c2:
         st.caption("Dodatkowe")
-        st.dataframe(df_extra)
\ No newline at end of file
+        st.dataframe(df_extra)
+    st.divider()
+    data_export()
+    st.divider()
+    counter_check()
+    st.divider()
+    memo_stats()
+    st.divider()
+    scheduler_status()
\ No newline at end of file
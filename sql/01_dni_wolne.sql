@@ -0,0 +1,12 @@
+-- Globalny kalendarz dni wolnych (święta, ferie).
+-- Jeden wiersz = jeden przedział dat; zastępuje wpisy "Święto / Inne" w tabeli odwolane
+-- dodawane osobno dla każdego ucznia i każdego dnia.
+create table if not exists dni_wolne (
+    id bigint generated by default as identity primary key,
+    "Data_od" date not null,
+    "Data_do" date not null,
+    "Nazwa" text,
+    "Szkola" text,      -- null = wszystkie szkoły
+    "Uczniowie" text,   -- lista ID rozdzielona ';', null = wszyscy uczniowie
+    check ("Data_do" >= "Data_od")
+);
@@ -0,0 +1,17 @@
+-- Atomowa zmiana liczników odrabiania/nieobecności.
+-- p_changes: [{"ID": 1, "Nieobecnosci": 1, "Do_odrobienia_nieumowione": 1.5}, ...]
+-- Brakujące klucze = brak zmiany; wartości nie spadają poniżej zera.
+-- Zwraca zaktualizowane wiersze. Przestarzałe od sql/07_zdarzenia_licznikow.sql - liczniki to projekcja dziennika zdarzeń.
+create or replace function adjust_student_counters(p_changes jsonb)
+returns setof uczniowie
+language sql
+as $$
+    update uczniowie u set
+        "Nieobecnosci" = greatest(0, coalesce(u."Nieobecnosci", 0) + coalesce((c->>'Nieobecnosci')::numeric, 0)),
+        "Odrabiania" = greatest(0, coalesce(u."Odrabiania", 0) + coalesce((c->>'Odrabiania')::numeric, 0)),
+        "Do_odrobienia_umowione" = greatest(0, coalesce(u."Do_odrobienia_umowione", 0) + coalesce((c->>'Do_odrobienia_umowione')::numeric, 0)),
+        "Do_odrobienia_nieumowione" = greatest(0, coalesce(u."Do_odrobienia_nieumowione", 0) + coalesce((c->>'Do_odrobienia_nieumowione')::numeric, 0))
+    from jsonb_array_elements(p_changes) c
+    where u."ID" = (c->>'ID')::bigint
+    returning u.*;
+$$;
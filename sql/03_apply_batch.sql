@@ -0,0 +1,61 @@
+-- Zapis jednej akcji użytkownika (UnitOfWork w app.py) w jednej transakcji.
+-- p_ops: lista operacji wykonywanych po kolei:
+--   {"op": "insert",   "table": "odwolane",    "rows": [{...}, ...]}
+--   {"op": "upsert",   "table": "rozliczenia", "rows": [{...}], "on_conflict": "Uczen_ID,Okres"}
+--   {"op": "delete",   "table": "dodatkowe",   "match": {"id": 7}}
+--   {"op": "counters", "changes": [{"ID": 1, "Nieobecnosci": 1}, ...]}   -- adjust_student_counters
+-- Błąd w dowolnej operacji wycofuje całą akcję.
+-- Zwraca {"counters": [zaktualizowane wiersze uczniów]} (operacja 'counters' przestarzała od sql/07_zdarzenia_licznikow.sql).
+create or replace function apply_batch(p_ops jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    o jsonb;
+    t text;
+    cols text;
+    keys text;
+    upd text;
+    cond text;
+    counters jsonb := '[]'::jsonb;
+begin
+    for o in select * from jsonb_array_elements(p_ops) loop
+        t := o->>'table';
+        if o->>'op' <> 'counters' and t not in ('uczniowie', 'rozliczenia', 'odwolane', 'dodatkowe', 'harmonogram', 'dni_wolne') then
+            raise exception 'apply_batch: niedozwolona tabela %', t;
+        end if;
+
+        if o->>'op' in ('insert', 'upsert') then
+            -- Tylko kolumny obecne w przesłanych wierszach (reszta dostaje wartości domyślne, np. id)
+            select string_agg(distinct format('%I', k), ', ') into cols
+            from jsonb_array_elements(o->'rows') r, jsonb_object_keys(r) k;
+            if o->>'op' = 'insert' then
+                execute format('insert into %I (%s) select %s from jsonb_populate_recordset(null::%I, $1)', t, cols, cols, t)
+                using o->'rows';
+            else
+                select string_agg(format('%I', trim(k)), ', ') into keys
+                from unnest(string_to_array(o->>'on_conflict', ',')) k;
+                select string_agg(format('%1$I = excluded.%1$I', k), ', ') into upd
+                from (select distinct k from jsonb_array_elements(o->'rows') r, jsonb_object_keys(r) k) s
+                where k <> all (select trim(x) from unnest(string_to_array(o->>'on_conflict', ',')) x);
+                execute format('insert into %I (%s) select %s from jsonb_populate_recordset(null::%I, $1) on conflict (%s) do %s',
+                               t, cols, cols, t, keys, coalesce('update set ' || upd, 'nothing'))
+                using o->'rows';
+            end if;
+
+        elsif o->>'op' = 'delete' then
+            select string_agg(format('%I::text = ($1->>%L)', k, k), ' and ') into cond
+            from jsonb_object_keys(o->'match') k;
+            if cond is null then raise exception 'apply_batch: delete bez warunku'; end if;
+            execute format('delete from %I where %s', t, cond) using o->'match';
+
+        elsif o->>'op' = 'counters' then
+            counters := counters || coalesce((select jsonb_agg(to_jsonb(u)) from adjust_student_counters(o->'changes') u), '[]'::jsonb);
+
+        else
+            raise exception 'apply_batch: nieznana operacja %', o->>'op';
+        end if;
+    end loop;
+    return jsonb_build_object('counters', counters);
+end;
+$$;
@@ -0,0 +1,137 @@
+-- Wielu korepetytorów w jednej bazie: każda tabela dostaje kolumnę "Tenant_ID",
+-- a wszystkie odczyty i zapisy aplikacji są zawężone do zalogowanego korepetytora.
+-- Istniejące dane trafiają do tenanta 'default' (logowanie jednym hasłem z [general]).
+
+alter table uczniowie   add column if not exists "Tenant_ID" text not null default 'default';
+alter table rozliczenia add column if not exists "Tenant_ID" text not null default 'default';
+alter table odwolane    add column if not exists "Tenant_ID" text not null default 'default';
+alter table dodatkowe   add column if not exists "Tenant_ID" text not null default 'default';
+alter table harmonogram add column if not exists "Tenant_ID" text not null default 'default';
+alter table dni_wolne   add column if not exists "Tenant_ID" text not null default 'default';
+
+-- ID ucznia jest unikalne w obrębie korepetytora; klucze rozliczeń również
+alter table uczniowie drop constraint if exists uczniowie_pkey;
+alter table uczniowie add primary key ("Tenant_ID", "ID");
+alter table rozliczenia drop constraint if exists rozliczenia_pkey;
+alter table rozliczenia add primary key ("Tenant_ID", "Uczen_ID", "Okres");
+
+-- Indeksy pod filtr "Tenant_ID" = ... (każdy odczyt aplikacji)
+create index if not exists odwolane_tenant_idx    on odwolane ("Tenant_ID", "Uczen_ID", "Data");
+create index if not exists dodatkowe_tenant_idx   on dodatkowe ("Tenant_ID", "Uczen_ID", "Data");
+create index if not exists harmonogram_tenant_idx on harmonogram ("Tenant_ID", "Uczen_ID");
+create index if not exists dni_wolne_tenant_idx   on dni_wolne ("Tenant_ID", "Data_od");
+
+-- Sekwencje ID per korepetytor (zamiast odczytu max("ID") przed każdym dodaniem ucznia)
+create table if not exists tenant_sequences (
+    tenant_id text not null,
+    name text not null,
+    last_value bigint not null,
+    primary key (tenant_id, name)
+);
+
+-- Rezerwuje p_count kolejnych ID; przy pierwszym użyciu sekwencja startuje od max("ID") korepetytora.
+create or replace function next_ids(p_tenant text, p_name text, p_count int default 1)
+returns setof bigint
+language plpgsql
+as $$
+declare
+    v_last bigint;
+begin
+    if p_name <> 'uczniowie' then raise exception 'next_ids: nieznana sekwencja %', p_name; end if;
+    insert into tenant_sequences as s (tenant_id, name, last_value)
+    values (p_tenant, p_name, (select coalesce(max("ID"), 0) from uczniowie where "Tenant_ID" = p_tenant) + p_count)
+    on conflict (tenant_id, name) do update set last_value = s.last_value + p_count
+    returning last_value into v_last;
+    return query select generate_series(v_last - p_count + 1, v_last);
+end;
+$$;
+
+-- Liczniki: zmiana wyłącznie w obrębie korepetytora
+drop function if exists adjust_student_counters(jsonb);
+create or replace function adjust_student_counters(p_changes jsonb, p_tenant text)
+returns setof uczniowie
+language sql
+as $$
+    update uczniowie u set
+        "Nieobecnosci" = greatest(0, coalesce(u."Nieobecnosci", 0) + coalesce((c->>'Nieobecnosci')::numeric, 0)),
+        "Odrabiania" = greatest(0, coalesce(u."Odrabiania", 0) + coalesce((c->>'Odrabiania')::numeric, 0)),
+        "Do_odrobienia_umowione" = greatest(0, coalesce(u."Do_odrobienia_umowione", 0) + coalesce((c->>'Do_odrobienia_umowione')::numeric, 0)),
+        "Do_odrobienia_nieumowione" = greatest(0, coalesce(u."Do_odrobienia_nieumowione", 0) + coalesce((c->>'Do_odrobienia_nieumowione')::numeric, 0))
+    from jsonb_array_elements(p_changes) c
+    where u."ID" = (c->>'ID')::bigint and u."Tenant_ID" = p_tenant
+    returning u.*;
+$$;
+
+-- Lista tabel dozwolonych w apply_batch wydzielona do osobnej funkcji,
+-- żeby kolejne migracje dopisywały tabele bez przepisywania apply_batch.
+create or replace function apply_batch_tables()
+returns text[]
+language sql
+immutable
+as $$
+    select array['uczniowie', 'rozliczenia', 'odwolane', 'dodatkowe', 'harmonogram', 'dni_wolne'];
+$$;
+
+-- apply_batch (sql/03_apply_batch.sql) z tenantem: "Tenant_ID" wierszy i warunków usuwania
+-- ustawia baza, a upsert aktualizuje tylko wiersze tenanta, więc sesja jednego korepetytora
+-- nie może zmienić cudzych danych.
+-- Nowy parametr zmienia sygnaturę, więc funkcja jest definiowana od nowa (ostatni raz - dalsze migracje
+-- zmieniają tylko apply_batch_tables).
+drop function if exists apply_batch(jsonb);
+create or replace function apply_batch(p_tenant text, p_ops jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    o jsonb;
+    t text;
+    rows jsonb;
+    cols text;
+    keys text;
+    upd text;
+    cond text;
+    counters jsonb := '[]'::jsonb;
+begin
+    for o in select * from jsonb_array_elements(p_ops) loop
+        t := o->>'table';
+        if o->>'op' <> 'counters' and t <> all (apply_batch_tables()) then
+            raise exception 'apply_batch: niedozwolona tabela %', t;
+        end if;
+
+        if o->>'op' in ('insert', 'upsert') then
+            select jsonb_agg(r || jsonb_build_object('Tenant_ID', p_tenant)) into rows
+            from jsonb_array_elements(o->'rows') r;
+            select string_agg(distinct format('%I', k), ', ') into cols
+            from jsonb_array_elements(rows) r, jsonb_object_keys(r) k;
+            if o->>'op' = 'insert' then
+                execute format('insert into %I (%s) select %s from jsonb_populate_recordset(null::%I, $1)', t, cols, cols, t)
+                using rows;
+            else
+                select string_agg(format('%I', trim(k)), ', ') into keys
+                from unnest(string_to_array(o->>'on_conflict', ',')) k;
+                select string_agg(format('%1$I = excluded.%1$I', k), ', ') into upd
+                from (select distinct k from jsonb_array_elements(rows) r, jsonb_object_keys(r) k) s
+                where k <> 'Tenant_ID' and k <> all (select trim(x) from unnest(string_to_array(o->>'on_conflict', ',')) x);
+                -- Konflikt z cudzym wierszem (tabele z kluczem samym id) nie nadpisuje go ani nie przenosi do tenanta
+                execute format('insert into %I (%s) select %s from jsonb_populate_recordset(null::%I, $1) on conflict (%s) do %s',
+                               t, cols, cols, t, keys,
+                               coalesce(format('update set %s where %I."Tenant_ID" = $2', upd, t), 'nothing'))
+                using rows, p_tenant;
+            end if;
+
+        elsif o->>'op' = 'delete' then
+            select string_agg(format('%I::text = ($1->>%L)', k, k), ' and ') into cond
+            from jsonb_object_keys(o->'match') k;
+            if cond is null then raise exception 'apply_batch: delete bez warunku'; end if;
+            execute format('delete from %I where "Tenant_ID" = $2 and %s', t, cond) using o->'match', p_tenant;
+
+        elsif o->>'op' = 'counters' then
+            counters := counters || coalesce((select jsonb_agg(to_jsonb(u)) from adjust_student_counters(o->'changes', p_tenant) u), '[]'::jsonb);
+
+        else
+            raise exception 'apply_batch: nieznana operacja %', o->>'op';
+        end if;
+    end loop;
+    return jsonb_build_object('counters', counters);
+end;
+$$;
@@ -0,0 +1,28 @@
+-- Zamknięte miesiące: zamrożone rozliczenie ucznia (kwota, pozycje rachunku, wiersze rejestru,
+-- stan wpłat, plan). Aplikacja czyta zamknięte miesiące stąd i przelicza tylko okresy otwarte.
+create table if not exists zamkniete_miesiace (
+    "Tenant_ID" text not null default 'default',
+    "Miesiac" text not null,            -- 'YYYY-MM'
+    "Uczen_ID" bigint not null,
+    "Tryb_platnosci" text,
+    "Kwota" numeric not null default 0, -- suma wierszy rejestru w miesiącu
+    "Wplacono" numeric not null default 0,
+    "Oplacone" boolean not null default false,
+    "Pozycje" jsonb not null default '[]',  -- szczegóły wyliczenia (calculate_monthly_breakdown)
+    "Rejestr" jsonb not null default '[]',  -- wiersze rejestru wpłat: ID Okresu, Termin, Kwota do zapłaty
+    "Plan" numeric not null default 0,
+    "Plan_abonament" numeric not null default 0,
+    "Plan_dojazd" numeric not null default 0,
+    "Zamkniete_at" timestamptz not null default now(),
+    primary key ("Tenant_ID", "Miesiac", "Uczen_ID"),
+    check ("Miesiac" ~ '^\d{4}-\d{2}$')
+);
+
+-- apply_batch (sql/04_tenanci.sql) może zapisywać zamknięte miesiące
+create or replace function apply_batch_tables()
+returns text[]
+language sql
+immutable
+as $$
+    select array['uczniowie', 'rozliczenia', 'odwolane', 'dodatkowe', 'harmonogram', 'dni_wolne', 'zamkniete_miesiace'];
+$$;
@@ -0,0 +1,14 @@
+-- Reguły powtarzania w harmonogramie: zamiast dwóch naprzemiennych wierszy albo ręcznych lekcji dodatkowych
+-- okres harmonogramu opisuje regułę (jak RRULE FREQ=WEEKLY):
+--   "Interwal" - co ile tygodni (1 = co tydzień, 2 = co dwa tygodnie), licząc od pierwszego "Dzien_tyg" >= "Data_od"
+--   "Liczba"   - najwyżej tyle lekcji (null/0 = bez limitu, do "Data_do" jak dotąd)
+--   "Wyjatki"  - pominięte daty 'RRRR-MM-DD' rozdzielone ';'
+-- Istniejące wiersze dostają "Interwal" = 1, więc dotychczasowe plany się nie zmieniają.
+alter table harmonogram add column if not exists "Interwal" int not null default 1;
+alter table harmonogram add column if not exists "Liczba" int;
+alter table harmonogram add column if not exists "Wyjatki" text;
+
+alter table harmonogram drop constraint if exists harmonogram_interwal_check;
+alter table harmonogram add constraint harmonogram_interwal_check check ("Interwal" >= 1);
+alter table harmonogram drop constraint if exists harmonogram_liczba_check;
+alter table harmonogram add constraint harmonogram_liczba_check check ("Liczba" is null or "Liczba" >= 0);
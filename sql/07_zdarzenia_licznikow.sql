@@ -0,0 +1,80 @@
+-- Liczniki odrabiań i nieobecności z dziennika zdarzeń.
+-- Każda zmiana liczników (odwołanie, umówione / cofnięte / zrealizowane odrabianie) to dopisany wiersz
+-- zdarzenia ze zmianą każdego licznika. Kolumny liczników w tabeli uczniowie są projekcją dziennika,
+-- utrzymywaną przez wyzwalacz: licznik = greatest(0, licznik + zmiana) - jak adjust_student_counters.
+-- Aplikacja dopisuje zdarzenia zwykłym insertem w apply_batch (ta sama transakcja co reszta akcji)
+-- i potrafi odtworzyć liczniki od zera z całego dziennika (weryfikacja projekcji).
+create table if not exists zdarzenia_licznikow (
+    id bigint generated by default as identity primary key,
+    "Tenant_ID" text not null default 'default',
+    "Uczen_ID" bigint not null,
+    "Rodzaj" text not null,
+    "Nieobecnosci" numeric not null default 0,
+    "Odrabiania" numeric not null default 0,
+    "Do_odrobienia_umowione" numeric not null default 0,
+    "Do_odrobienia_nieumowione" numeric not null default 0,
+    "Utworzono" timestamptz not null default now()
+);
+create index if not exists zdarzenia_licznikow_tenant_idx on zdarzenia_licznikow ("Tenant_ID", "Uczen_ID", id);
+
+-- Stan początkowy: dotychczasowe liczniki jako pierwsze zdarzenie ucznia (przed utworzeniem wyzwalacza -
+-- te wartości już są w tabeli uczniowie; przy ponownym uruchomieniu nic nie jest dopisywane)
+insert into zdarzenia_licznikow ("Tenant_ID", "Uczen_ID", "Rodzaj", "Nieobecnosci", "Odrabiania", "Do_odrobienia_umowione", "Do_odrobienia_nieumowione")
+select "Tenant_ID", "ID", 'Stan początkowy', coalesce("Nieobecnosci", 0), coalesce("Odrabiania", 0),
+       coalesce("Do_odrobienia_umowione", 0), coalesce("Do_odrobienia_nieumowione", 0)
+from uczniowie
+where not exists (select 1 from zdarzenia_licznikow)
+  and (coalesce("Nieobecnosci", 0) <> 0 or coalesce("Odrabiania", 0) <> 0
+       or coalesce("Do_odrobienia_umowione", 0) <> 0 or coalesce("Do_odrobienia_nieumowione", 0) <> 0);
+
+-- Projekcja: każde dopisane zdarzenie zmienia liczniki ucznia
+create or replace function zdarzenia_licznikow_projekcja()
+returns trigger
+language plpgsql
+as $$
+begin
+    update uczniowie u set
+        "Nieobecnosci" = greatest(0, coalesce(u."Nieobecnosci", 0) + new."Nieobecnosci"),
+        "Odrabiania" = greatest(0, coalesce(u."Odrabiania", 0) + new."Odrabiania"),
+        "Do_odrobienia_umowione" = greatest(0, coalesce(u."Do_odrobienia_umowione", 0) + new."Do_odrobienia_umowione"),
+        "Do_odrobienia_nieumowione" = greatest(0, coalesce(u."Do_odrobienia_nieumowione", 0) + new."Do_odrobienia_nieumowione")
+    where u."Tenant_ID" = new."Tenant_ID" and u."ID" = new."Uczen_ID";
+    return new;
+end;
+$$;
+
+drop trigger if exists zdarzenia_licznikow_projekcja on zdarzenia_licznikow;
+create trigger zdarzenia_licznikow_projekcja after insert on zdarzenia_licznikow
+    for each row execute function zdarzenia_licznikow_projekcja();
+
+-- Dziennik tylko do dopisywania
+create or replace function zdarzenia_licznikow_bez_zmian()
+returns trigger
+language plpgsql
+as $$
+begin
+    raise exception 'zdarzenia_licznikow: dziennik zdarzeń można tylko dopisywać';
+end;
+$$;
+
+drop trigger if exists zdarzenia_licznikow_bez_zmian on zdarzenia_licznikow;
+create trigger zdarzenia_licznikow_bez_zmian before update or delete on zdarzenia_licznikow
+    for each row execute function zdarzenia_licznikow_bez_zmian();
+
+-- apply_batch (sql/04_tenanci.sql) może dopisywać zdarzenia
+create or replace function apply_batch_tables()
+returns text[]
+language sql
+immutable
+as $$
+    select array['uczniowie', 'rozliczenia', 'odwolane', 'dodatkowe', 'harmonogram', 'dni_wolne', 'zamkniete_miesiace', 'zdarzenia_licznikow'];
+$$;
+
+-- Liczniki zmieniają już tylko zdarzenia: operacja 'counters' w apply_batch i adjust_student_counters
+-- (sql/02_liczniki.sql, sql/04_tenanci.sql) nie są używane przez aplikację, a zwracane przez nie wiersze
+-- nie służą już do łatania kopii tabeli po stronie klienta. Zostają tylko dla zgodności ze starszymi
+-- wersjami aplikacji - do usunięcia razem z gałęzią 'counters' przy następnej zmianie apply_batch.
+comment on function adjust_student_counters(jsonb, text) is
+    'PRZESTARZAŁE: liczniki to projekcja dziennika zdarzeń (zdarzenia_licznikow). Nie używać w nowym kodzie.';
+comment on function apply_batch(text, jsonb) is
+    'Zapis akcji w jednej transakcji. Operacja ''counters'' jest PRZESTARZAŁA - liczniki zmieniają zdarzenia w zdarzenia_licznikow.';
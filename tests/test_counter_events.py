@@ -0,0 +1,48 @@
+"""Odtworzenie liczników z dziennika zdarzeń (rebuild_counters) = sekwencyjne max(0, licznik + zmiana), jak wyzwalacz w bazie.
+
+app.py to skrypt Streamlit (łączy się z bazą przy imporcie), więc test wczytuje z niego tylko potrzebne definicje.
+"""
+import ast
+import random
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+DEFINITIONS = {'COUNTER_COLUMNS', 'rebuild_counters'}
+
+
+def app_definitions(**overrides):
+    ns = {'np': np, 'pd': pd, 'datetime': datetime, **overrides}
+    for node in ast.parse(APP.read_text(encoding='utf-8')).body:
+        targets = [t for a in getattr(node, 'targets', []) for t in (a.elts if isinstance(a, ast.Tuple) else [a])]
+        if ({getattr(t, 'id', None) for t in targets} | {getattr(node, 'name', None)}) & DEFINITIONS:
+            exec(compile(ast.Module([node], []), str(APP), 'exec'), ns)
+    return ns
+
+
+def replay(events, columns, student_ids):
+    """Zdarzenia po kolei wg id, licznik obcinany do zera po każdym z nich."""
+    state = {sid: dict.fromkeys(columns, 0.0) for sid in student_ids}
+    for event in sorted(events, key=lambda e: e['id']):
+        for col in columns:
+            state[event['Uczen_ID']][col] = max(0.0, state[event['Uczen_ID']][col] + event[col])
+    return state
+
+
+def test_rebuild_counters_matches_sequential_replay():
+    ns = app_definitions()
+    columns = ns['COUNTER_COLUMNS']
+    rng = random.Random(48)
+    for _ in range(100):
+        student_ids = list(range(1, rng.randint(2, 6)))
+        ids = rng.sample(range(1, 1000), rng.randrange(40))
+        # Zmiany w krokach 0,5 h - suma dokładna w float, porównanie bez tolerancji
+        events = [{'id': i, 'Uczen_ID': rng.choice(student_ids), **{c: rng.randint(-6, 6) / 2 for c in columns}} for i in ids]
+        df_events = pd.DataFrame(events, columns=['id', 'Uczen_ID', *columns]).astype({'id': 'int64', 'Uczen_ID': 'int64', **dict.fromkeys(columns, 'float64')})
+        rebuilt = ns['rebuild_counters'](df_events, student_ids)
+        expected = replay(events, columns, student_ids)
+        for sid in student_ids:
+            assert rebuilt.loc[sid].to_dict() == expected[sid], (sid, events)
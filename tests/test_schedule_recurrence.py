@@ -0,0 +1,64 @@
+"""Rozwijanie harmonogramu (expand_schedule) wprost z numerów wystąpień = ta sama reguła co dateutil.rruleset.
+
+app.py to skrypt Streamlit (łączy się z bazą przy imporcie), więc test wczytuje z niego tylko potrzebne definicje.
+"""
+import ast
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from dateutil.rrule import WEEKLY, rrule, rruleset
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+DEFINITIONS = {'parse_dates', 'LESSON_TYPES', 'empty_lessons', 'lesson_keys', 'expand_schedule'}
+
+
+def app_definitions(**overrides):
+    ns = {'np': np, 'pd': pd, 'datetime': datetime, **overrides}
+    for node in ast.parse(APP.read_text(encoding='utf-8')).body:
+        targets = [t for a in getattr(node, 'targets', []) for t in (a.elts if isinstance(a, ast.Tuple) else [a])]
+        if ({getattr(t, 'id', None) for t in targets} | {getattr(node, 'name', None)}) & DEFINITIONS:
+            exec(compile(ast.Module([node], []), str(APP), 'exec'), ns)
+    return ns
+
+
+def random_rule(rng, uid):
+    """Okres harmonogramu: dowolny dzień startu, interwał 1-3, limit wystąpień (0 = bez), wyjątki trafione i chybione."""
+    start = datetime(2025, 9, 1) + timedelta(days=rng.randrange(120))
+    end = start + timedelta(days=rng.randrange(300))
+    weekday, interval, count = rng.randrange(7), rng.randint(1, 3), rng.choice([0, 0, rng.randint(1, 20)])
+    first = start + timedelta(days=(weekday - start.weekday()) % 7)
+    skipped = [first + timedelta(days=7 * interval * rng.randrange(25)) for _ in range(rng.randrange(4))]
+    skipped += [start + timedelta(days=rng.randrange(200)) for _ in range(rng.randrange(2))]
+    return {'Uczen_ID': uid, 'Dzien_nr': weekday, 'Interwal': float(interval), 'Liczba': float(count),
+            'Data_od': start, 'Data_do': end, 'Wyjatki': ';'.join(d.strftime('%Y-%m-%d') for d in skipped) or None,
+            'Minuty': 16 * 60, 'Czas_trwania': 1.0, 'Stawka': 0.0}
+
+
+def expected_dates(rule, window_start, window_end):
+    rules = rruleset()
+    first = rule['Data_od'] + timedelta(days=(rule['Dzien_nr'] - rule['Data_od'].weekday()) % 7)
+    # count razem z until dateutil odrzuca (RFC 5545) - Data_do ogranicza okno zamiast reguły
+    rules.rrule(rrule(WEEKLY, dtstart=first, interval=int(rule['Interwal']), count=int(rule['Liczba']) or None,
+                      until=None if rule['Liczba'] else rule['Data_do']))
+    for day in filter(None, (rule['Wyjatki'] or '').split(';')):
+        rules.exdate(datetime.strptime(day, '%Y-%m-%d'))
+    return rules.between(window_start, min(window_end, rule['Data_do']), inc=True)
+
+
+def test_expand_schedule_matches_rruleset():
+    ns = app_definitions()
+    rng = random.Random(47)
+    for _ in range(100):
+        rules = [random_rule(rng, uid) for uid in range(1, 6)]
+        window_start = datetime(2025, 9, 1) + timedelta(days=rng.randrange(250))
+        window_end = window_start + timedelta(days=rng.randrange(1, 200))
+        schedule = pd.DataFrame(rules)
+        schedule['Wyjatki'] = schedule['Wyjatki'].astype(object)
+        students = pd.DataFrame({'ID': range(1, 6), 'Stawka': 100.0, 'Dojazd': 0.0})
+        lessons = ns['expand_schedule'](students, schedule, window_start.date(), window_end.date())
+        for rule in rules:
+            got = lessons.loc[lessons['Uczen_ID'] == rule['Uczen_ID'], 'Data'].sort_values().dt.to_pydatetime().tolist()
+            assert got == expected_dates(rule, window_start, window_end), rule
@@ -0,0 +1,60 @@
+"""Bufor na dojazd między lekcjami (LessonIndex, free_slots): liczony raz na przerwę, nie po obu stronach.
+
+app.py to skrypt Streamlit (łączy się z bazą przy imporcie), więc test wczytuje z niego tylko potrzebne definicje.
+"""
+import ast
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+DEFINITIONS = {'DNI_MAPA', 'time_to_minutes', 'minutes_to_time_str', 'TRAVEL_BUFFER_MIN', 'lesson_spans', 'LessonIndex',
+               'SLOT_MIN_TIME', 'SLOT_MAX_TIME', 'SLOT_STEP_MIN', 'free_slots'}
+MONDAY = pd.Timestamp('2026-01-05')
+
+
+def app_definitions(**overrides):
+    ns = {'np': np, 'pd': pd, 'datetime': datetime, **overrides}
+    for node in ast.parse(APP.read_text(encoding='utf-8')).body:
+        targets = [t for a in getattr(node, 'targets', []) for t in (a.elts if isinstance(a, ast.Tuple) else [a])]
+        if ({getattr(t, 'id', None) for t in targets} | {getattr(node, 'name', None)}) & DEFINITIONS:
+            exec(compile(ast.Module([node], []), str(APP), 'exec'), ns)
+    return ns
+
+
+def lessons(*rows):
+    """(uczeń, 'HH:MM', godziny) w poniedziałek MONDAY."""
+    return pd.DataFrame({'Data': MONDAY, 'Uczen_ID': [r[0] for r in rows],
+                         'Minuty': [int(r[1][:2]) * 60 + int(r[1][3:]) for r in rows], 'Czas': [float(r[2]) for r in rows]})
+
+
+STUDENTS = pd.DataFrame({'ID': [1, 2], 'Dojazd': [10.0, 15.0]})
+
+
+def test_travel_lessons_one_buffer_apart_do_not_conflict():
+    ns = app_definitions()
+    buffer = ns['TRAVEL_BUFFER_MIN']
+    index = ns['LessonIndex'](lessons((1, '10:00', 1)), STUDENTS)
+    after = f"{11 + buffer // 60:02d}:{buffer % 60:02d}"
+
+    start, end, buf = ns['lesson_spans'](lessons((2, after, 1)), STUDENTS)
+    assert len(index.query(2, start[0], end[0], buf[0])[0]) == 0
+    start, end, buf = ns['lesson_spans'](lessons((2, '11:15', 1)), STUDENTS)
+    found, direct = index.query(2, start[0], end[0], buf[0])
+    assert len(found) == 1 and not direct[0]
+
+    both = ns['LessonIndex'](lessons((1, '10:00', 1), (2, after, 1)), STUDENTS)
+    assert len(both.all_conflicts()[0]) == 0
+    assert len(ns['LessonIndex'](lessons((1, '10:00', 1), (2, '11:15', 1)), STUDENTS).all_conflicts()[0]) == 1
+
+
+def test_free_slots_next_to_travel_lesson():
+    schedule = pd.DataFrame({'Uczen_ID': [2], 'Data_do': [MONDAY + pd.Timedelta(days=30)], 'Dzien_nr': [0], 'Minuty': [11 * 60 + 30]})
+    ns = app_definitions(current_tenant=lambda: 'default', load_schedule=lambda tenant: schedule,
+                         load_holidays=lambda tenant: None, drop_holidays=lambda lessons, *args: lessons)
+    index = ns['LessonIndex'](lessons((1, '10:00', 1)), STUDENTS)
+    slots = ns['free_slots'](index, STUDENTS, 2, 1.0, weeks=1, n=1, now=MONDAY)
+    assert slots['Data'].tolist() == [MONDAY.date()]
+    assert slots['Godzina'].tolist() == ['11:30']